@@ -0,0 +1,74 @@
+# coding:utf-8
+"""Headless batch runs of poster generation and upscaling, without Streamlit
+
+Usage:
+    python batch.py prompts.jsonl --output runs/may --concurrency 8 --upscale
+    python batch.py images.csv --output runs/hd
+
+Progress is checkpointed in <output>/manifest.jsonl; rerunning the same
+command resumes where an interrupted run stopped.
+"""
+import argparse
+import sys
+
+from lib.batch_runner import BatchRunner, read_items
+from lib.metrics import setup_metrics
+from lib.services import get_comfyui_client, get_poster_generator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate and upscale posters from a JSONL/CSV file")
+    parser.add_argument("input", help="JSONL (objects or plain prompt strings) or CSV with a header row")
+    parser.add_argument("--output", "-o", default="batch_output", help="directory for images, manifest.jsonl and summary.json")
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="items processed at the same time")
+    parser.add_argument("--count", type=int, default=1, help="images per prompt unless the item sets count")
+    parser.add_argument("--ratio", help="aspect ratio such as 1:1 or 16:9 unless the item sets width/height or ratio")
+    parser.add_argument("--upscale", action="store_true", help="upscale generated images (image items are always upscaled)")
+    parser.add_argument("--skip-prompt", action="store_true", help="use prompts as-is instead of asking Doubao to rewrite them")
+    parser.add_argument("--template", help="upscale workflow template, e.g. realesrgan_x4")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    items = read_items(args.input)
+
+    # Same services as the pages, configured from config.py
+    poster_generator = get_poster_generator()
+    comfyui_client = get_comfyui_client()
+
+    # Scrape endpoint and span logs, if enabled in config.py
+    setup_metrics()
+
+    runner = BatchRunner(
+        poster_generator, comfyui_client, args.output, concurrency=args.concurrency, upscale=args.upscale,
+        skip_prompt=args.skip_prompt, count=args.count, ratio=args.ratio, template=args.template
+    )
+
+    def report(record, finished, total):
+        line = f"[{finished}/{total}] {record['status']:<7} {record['id']} ({record['seconds']:.1f}s)"
+        if record["status"] != "ok":
+            line += f" {record['error'] or next(entry['error'] for entry in record['images'] if entry['error'])}"
+        print(line, flush=True)
+
+    pending = len(runner.pending(items))
+    if pending < len(items):
+        print(f"Resuming: {len(items) - pending} of {len(items)} items already done")
+
+    try:
+        summary = runner.run(items, on_record=report)
+    except KeyboardInterrupt:
+        print("\nInterrupted; rerun the same command to resume", file=sys.stderr)
+        return 130
+    finally:
+        comfyui_client.close()
+
+    print(
+        f"Done in {summary['seconds']:.1f}s: {summary['ok']} ok, {summary['partial']} partial, "
+        f"{summary['failed']} failed, {summary['skipped']} skipped. Manifest: {runner.manifest_path}"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
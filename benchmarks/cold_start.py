@@ -0,0 +1,157 @@
+# coding:utf-8
+"""Cold start and rerun timings of the Streamlit pages
+
+Each page runs in a fresh interpreter through Streamlit's AppTest (no server
+or browser). The first run covers the page's imports and service setup, as
+for the first visitor after a restart; later runs are plain reruns, as after
+any widget change.
+
+Usage (from the repository root):
+    python -m benchmarks.cold_start --reruns 20 --output cold_start.json
+    python -m benchmarks.cold_start --compare cold_start.json
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_servers import FakeComfyUI
+from benchmarks.harness import percentile
+
+
+# Modules that are expensive to import and that a page should only load when it needs them
+HEAVY_MODULES = ("volcengine", "numpy", "PIL", "requests")
+
+
+def measure_page(path, reruns):
+    """Run in the child interpreter: time the first run and reruns of one page"""
+    from streamlit.testing.v1 import AppTest
+
+    before = set(sys.modules)
+    app = AppTest.from_file(path, default_timeout=120)
+
+    start = time.perf_counter()
+    app.run()
+    first_run = time.perf_counter() - start
+    loaded = set(sys.modules) - before
+
+    rerun_times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        app.run()
+        rerun_times.append(time.perf_counter() - start)
+    rerun_times.sort()
+
+    return {
+        "first_run_ms": round(first_run * 1000, 1),
+        "rerun_ms": {
+            "p50": round(percentile(rerun_times, 50) * 1000, 2),
+            "p95": round(percentile(rerun_times, 95) * 1000, 2),
+            "mean": round(statistics.mean(rerun_times) * 1000, 2)
+        } if rerun_times else None,
+        "modules_loaded": len(loaded),
+        "heavy_loaded": sorted(name for name in HEAVY_MODULES if name in loaded),
+        "exceptions": [str(item.value)[:160] for item in app.exception]
+    }
+
+
+def run_child(path, reruns, env):
+    result = subprocess.run(
+        [sys.executable, "-m", "benchmarks.cold_start", "--child", path, "--reruns", str(reruns)],
+        capture_output=True, text=True, env=env, timeout=600
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"{path} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {item["page"]: item for item in json.load(f)["results"]}
+
+    def change(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {baseline_path} (negative is better):")
+    for result in results:
+        old = baseline.get(result["page"])
+        if old is None:
+            continue
+        print(
+            f"  {result['page']:<28} first run {change(result['first_run_ms'], old['first_run_ms']):>8}  "
+            f"rerun p50 {change(result['rerun_ms']['p50'], old['rerun_ms']['p50']):>8}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time cold start and reruns of the Streamlit pages")
+    parser.add_argument("--pages", default="pages/*.py", help="glob of page scripts to measure")
+    parser.add_argument("--reruns", type=int, default=20, help="reruns timed after the first run")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per page; the median first run is reported")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(measure_page(args.child, args.reruns)))
+        return None
+
+    # Pages start health checks and create job, archive and artifact stores;
+    # keep them local and out of the working tree
+    comfyui = FakeComfyUI()
+    comfyui.start()
+    workdir = tempfile.mkdtemp(prefix="cold_start_")
+    env = dict(
+        os.environ,
+        COMFYUI_BASE_URLS=comfyui.base_url,
+        JOB_DB_PATH=os.path.join(workdir, "jobs.db"),
+        ARCHIVE_DIR=os.path.join(workdir, "archive"),
+        ARTIFACT_DIR=os.path.join(workdir, "artifacts"),
+        UPSCALE_CACHE_DIR=os.path.join(workdir, "upscale_cache"),
+        GENERATION_CACHE_DIR=os.path.join(workdir, "generation_cache"),
+        METRICS_PORT="0"
+    )
+
+    results = []
+    try:
+        print(f"{'page':<28}  {'first run ms':>12}  {'rerun p50 ms':>12}  {'rerun p95 ms':>12}  heavy modules loaded")
+        for path in sorted(glob.glob(args.pages)):
+            runs = [run_child(path, args.reruns, env) for _ in range(max(1, args.repeat))]
+            result = dict(runs[len(runs) // 2], page=os.path.basename(path))
+            result["first_run_ms"] = round(statistics.median(run["first_run_ms"] for run in runs), 1)
+            results.append(result)
+            print(
+                f"{result['page']:<28}  {result['first_run_ms']:>12}  {result['rerun_ms']['p50']:>12}  "
+                f"{result['rerun_ms']['p95']:>12}  {', '.join(result['heavy_loaded']) or '-'}"
+            )
+            for exception in result["exceptions"]:
+                print(f"    exception: {exception}")
+    finally:
+        comfyui.stop()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0], "settings": vars(args)},
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
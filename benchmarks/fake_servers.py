@@ -0,0 +1,505 @@
+# coding:utf-8
+"""Local stand-ins for ComfyUI, Volcengine cv_process and OpenAI-compatible chat
+
+Standard library only. Every server listens on 127.0.0.1 with an ephemeral
+port and injects configurable latency, jitter and errors, so the real clients
+in lib/ can be benchmarked without touching live services.
+"""
+import base64
+import hashlib
+import json
+import queue
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+FAKE_POSTER_PROMPT = "生成几位分别在挥拳、前冲、吹冲锋号、办公的劳动者作为主体，复古大字报风格的插画，背景是工厂机械，底部是'劳动最光荣'"
+
+
+class Behavior:
+    """Latency, jitter and error rate of a fake endpoint (seconds, fraction)"""
+
+    def __init__(self, latency=0.02, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            offset = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.latency + offset)
+
+    def sleep(self):
+        time.sleep(self.delay())
+
+    def fails(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+
+def make_png(width, height, seed=0):
+    """Build a noisy RGB PNG in memory without Pillow, sized like a real result"""
+    rng = random.Random(seed)
+    row_bytes = width * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Request handler with body, JSON, chunked and error helpers; routes to server.app"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    @property
+    def app(self):
+        return self.server.app
+
+    def read_body(self):
+        """Read a Content-Length or chunked request body"""
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def send_bytes(self, data, content_type="application/octet-stream", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, payload, status=200):
+        self.send_bytes(json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", status)
+
+    def send_error_json(self, status=500, message="injected failure"):
+        self.send_json({"error": message}, status)
+
+    def begin_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.app.handle(self, "GET")
+
+    def do_POST(self):
+        self.app.handle(self, "POST")
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded server that ignores clients hanging up mid-request"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeServer:
+    """Base class: threaded HTTP server on an ephemeral localhost port"""
+
+    def __init__(self):
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), FakeHandler)
+        self.httpd.app = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def host(self):
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def handle(self, handler, method):
+        raise NotImplementedError
+
+
+class WebSocketConnection:
+    """Minimal server side of RFC 6455: text frames out, masked frames in"""
+
+    def __init__(self, handler):
+        self.rfile = handler.rfile
+        self.wfile = handler.wfile
+        self._send_lock = threading.Lock()
+        self.closed = False
+
+    @staticmethod
+    def accept(handler):
+        """Complete the upgrade handshake and return the connection"""
+        key = handler.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode("ascii")).digest()).decode("ascii")
+        handler.send_response(101, "Switching Protocols")
+        handler.send_header("Upgrade", "websocket")
+        handler.send_header("Connection", "Upgrade")
+        handler.send_header("Sec-WebSocket-Accept", accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        return WebSocketConnection(handler)
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self._send_lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(header + payload)
+                self.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def send_json(self, payload):
+        self._send_frame(0x1, json.dumps(payload).encode("utf-8"))
+
+    def _recv_exact(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError("socket closed")
+        return data
+
+    def serve_until_closed(self):
+        """Read client frames until a close frame or disconnect, answering pings"""
+        try:
+            while True:
+                first, second = self._recv_exact(2)
+                opcode, length = first & 0x0F, second & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self._recv_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self._recv_exact(8))[0]
+                mask = self._recv_exact(4) if second & 0x80 else b"\x00\x00\x00\x00"
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exact(length)))
+                if opcode == 0x8:
+                    self._send_frame(0x8, payload[:2])
+                    break
+                if opcode == 0x9:
+                    self._send_frame(0xA, payload)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self._send_lock:
+                self.closed = True
+
+
+class FakeComfyUI(FakeServer):
+    """ComfyUI stand-in: /upload/image, /prompt, /history, /view and /ws
+
+    Queued prompts run on `workers` simulated GPUs, each taking
+    processing.delay() seconds, so queue depth and waiting behave like a real
+    server. Finished prompts push executing/executed events to the socket of
+    their clientId and appear in /history.
+    """
+
+    def __init__(self, api=None, processing=None, workers=1, result_size=(1024, 1024), output_node="7"):
+        super().__init__()
+        self.api = api or Behavior()
+        self.processing = processing or Behavior(latency=0.2)
+        self.output_node = output_node
+        self.result_png = make_png(*result_size)
+
+        self._lock = threading.Lock()
+        self._prompts = {}
+        self._sockets = {}
+        self._queue = queue.Queue()
+        self._pending = 0
+        self._workers = [
+            threading.Thread(target=self._work, name=f"fake-comfyui-gpu-{index}", daemon=True)
+            for index in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _output_images(self, prompt_id):
+        return [{"filename": f"{prompt_id}.png", "subfolder": "", "type": "temp"}]
+
+    def _notify(self, client_id, payload):
+        with self._lock:
+            connection = self._sockets.get(client_id)
+        if connection is not None:
+            connection.send_json(payload)
+
+    def _work(self):
+        while True:
+            prompt_id = self._queue.get()
+            with self._lock:
+                client_id = self._prompts[prompt_id]["client_id"]
+
+            self._notify(client_id, {"type": "executing", "data": {"node": "4", "prompt_id": prompt_id}})
+            self.processing.sleep()
+            failed = self.processing.fails()
+
+            with self._lock:
+                self._prompts[prompt_id]["state"] = "error" if failed else "success"
+                self._pending -= 1
+
+            if failed:
+                self._notify(client_id, {"type": "execution_error", "data": {
+                    "prompt_id": prompt_id, "node_id": "4", "exception_message": "injected failure"
+                }})
+                continue
+
+            self._notify(client_id, {"type": "executed", "data": {
+                "node": self.output_node, "prompt_id": prompt_id,
+                "output": {"images": self._output_images(prompt_id)}
+            }})
+            self._notify(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+    def handle(self, handler, method):
+        parts = urlsplit(handler.path)
+        path = parts.path
+        query = parse_qs(parts.query)
+
+        if method == "GET" and path == "/ws":
+            self._serve_websocket(handler, query.get("clientId", [""])[0])
+            return
+
+        body = handler.read_body() if method == "POST" else b""
+        self.api.sleep()
+        if self.api.fails():
+            handler.send_error_json()
+            return
+
+        if method == "POST" and path == "/upload/image":
+            handler.send_json({"name": f"{uuid.uuid4().hex}.png", "subfolder": "", "type": "input"})
+        elif method == "POST" and path == "/prompt":
+            payload = json.loads(body or b"{}")
+            prompt_id = uuid.uuid4().hex
+            with self._lock:
+                self._prompts[prompt_id] = {"client_id": payload.get("client_id"), "state": "queued"}
+                self._pending += 1
+                number = len(self._prompts)
+            self._queue.put(prompt_id)
+            handler.send_json({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+        elif method == "GET" and path == "/prompt":
+            with self._lock:
+                pending = self._pending
+            handler.send_json({"exec_info": {"queue_remaining": pending}})
+        elif method == "GET" and path.startswith("/history/"):
+            handler.send_json(self._history(path[len("/history/"):]))
+        elif method == "GET" and path == "/view":
+            handler.send_bytes(self.result_png, "image/png")
+        else:
+            handler.send_error_json(404, "not found")
+
+    def _history(self, prompt_id):
+        with self._lock:
+            prompt = self._prompts.get(prompt_id)
+            state = prompt["state"] if prompt else None
+        if state == "success":
+            return {prompt_id: {
+                "outputs": {self.output_node: {"images": self._output_images(prompt_id)}},
+                "status": {"status_str": "success", "completed": True}
+            }}
+        if state == "error":
+            return {prompt_id: {"outputs": {}, "status": {"status_str": "error", "completed": False}}}
+        return {}
+
+    def _serve_websocket(self, handler, client_id):
+        connection = WebSocketConnection.accept(handler)
+        with self._lock:
+            self._sockets[client_id] = connection
+        connection.send_json({"type": "status", "data": {"sid": client_id}})
+        try:
+            connection.serve_until_closed()
+        finally:
+            with self._lock:
+                if self._sockets.get(client_id) is connection:
+                    del self._sockets[client_id]
+
+
+class FakeVolcengine(FakeServer):
+    """Volcengine visual API stand-in: CVProcess returns URLs served by this server
+
+    Point a VisualService at it with set_host(server.host) and set_scheme("http").
+    Injected failures answer like the real API's throttling (HTTP 200 with
+    error_code), so callers see the same response shape they handle in production.
+    quota > 0 additionally throttles calls beyond that many per rolling second.
+    """
+
+    def __init__(self, api=None, image_size=(1328, 1328), error_code=50429, quota=0):
+        super().__init__()
+        self.api = api or Behavior(latency=0.5)
+        self.error_code = error_code
+        self.image_png = make_png(*image_size, seed=1)
+        self.quota = quota
+        self.throttled = 0
+        self._recent = deque()
+        self._quota_lock = threading.Lock()
+
+    def over_quota(self):
+        """Count this call against the rolling one-second window; True when it exceeds quota"""
+        if self.quota <= 0:
+            return False
+        with self._quota_lock:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.quota:
+                self.throttled += 1
+                return True
+            self._recent.append(now)
+            return False
+
+    def handle(self, handler, method):
+        parts = urlsplit(handler.path)
+
+        if method == "GET" and parts.path.startswith("/images/"):
+            handler.send_bytes(self.image_png, "image/png")
+            return
+
+        handler.read_body()
+        action = parse_qs(parts.query).get("Action", [""])[0]
+        if method != "POST" or action != "CVProcess":
+            handler.send_error_json(404, "not found")
+            return
+
+        request_id = uuid.uuid4().hex
+        if self.over_quota():
+            handler.send_json({
+                "code": self.error_code, "data": None, "message": "Request Has Reached API Limit",
+                "request_id": request_id, "status": self.error_code
+            })
+            return
+
+        self.api.sleep()
+        if self.api.fails():
+            handler.send_json({
+                "code": self.error_code, "data": None, "message": "Request Has Reached API Limit",
+                "request_id": request_id, "status": self.error_code
+            })
+            return
+
+        handler.send_json({
+            "code": 10000,
+            "data": {"image_urls": [f"{self.base_url}/images/{request_id}.png"]},
+            "message": "Success",
+            "request_id": request_id,
+            "status": 10000
+        })
+
+
+class FakeOpenAI(FakeServer):
+    """OpenAI-compatible /chat/completions, plain JSON or SSE streaming
+
+    api.delay() is the time to first token; each further streamed chunk of
+    chunk_chars characters arrives after token_interval seconds. Requests for
+    several prompt variants get a JSON reply with that many distinct prompts.
+    """
+
+    def __init__(self, api=None, token_interval=0.01, chunk_chars=4, reply=FAKE_POSTER_PROMPT):
+        super().__init__()
+        self.api = api or Behavior(latency=0.3)
+        self.token_interval = token_interval
+        self.chunk_chars = chunk_chars
+        self.reply = reply
+
+    def reply_for(self, payload):
+        """The canned reply, or a JSON list of distinct variants when the prompt asks for N of them"""
+        messages = payload.get("messages") or [{}]
+        match = re.search(r"生成(\d+)个不同", messages[-1].get("content", ""))
+        if not match:
+            return self.reply
+        prompts = [self.reply.replace("几位", f"第{index + 1}组", 1) for index in range(int(match.group(1)))]
+        return json.dumps({"prompts": prompts}, ensure_ascii=False)
+
+    def handle(self, handler, method):
+        if method != "POST" or not urlsplit(handler.path).path.endswith("/chat/completions"):
+            handler.send_error_json(404, "not found")
+            return
+
+        payload = json.loads(handler.read_body() or b"{}")
+        self.api.sleep()
+        if self.api.fails():
+            handler.send_error_json(503, "injected failure")
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = payload.get("model", "fake-model")
+        reply = self.reply_for(payload)
+        if not payload.get("stream"):
+            # Non-streaming clients wait for the whole completion
+            time.sleep(self.token_interval * max(0, len(reply) // self.chunk_chars - 1))
+            handler.send_json({
+                "id": completion_id, "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}]
+            })
+            return
+
+        handler.begin_chunked("text/event-stream")
+        try:
+            for offset in range(0, len(reply), self.chunk_chars):
+                if offset:
+                    time.sleep(self.token_interval)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "model": model,
+                    "choices": [{"index": 0, "delta": {"content": reply[offset:offset + self.chunk_chars]}}]
+                }
+                handler.write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            handler.write_chunk(b"data: [DONE]\n\n")
+            handler.end_chunked()
+        except OSError:
+            handler.close_connection = True
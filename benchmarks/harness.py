@@ -0,0 +1,77 @@
+# coding:utf-8
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile of an already sorted list, q in [0, 100]"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(values):
+    """p50/p95/p99/mean/max of a list of seconds, reported in milliseconds"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+    return {
+        "p50": round(percentile(ordered, 50) * 1000, 2),
+        "p95": round(percentile(ordered, 95) * 1000, 2),
+        "p99": round(percentile(ordered, 99) * 1000, 2),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2)
+    }
+
+
+def run_load(func, concurrency, requests, warmup=0):
+    """Call func(i) `requests` times from `concurrency` threads and measure it
+
+    func may return a dict of extra timings in seconds (e.g. {"ttft": 0.12});
+    each key is summarized alongside the end-to-end latency. Latency covers
+    successful calls only; failures are counted and sampled.
+    """
+    for index in range(warmup):
+        try:
+            func(-1 - index)
+        except Exception:
+            pass
+
+    def timed(index):
+        start = time.perf_counter()
+        try:
+            extra = func(index)
+            return time.perf_counter() - start, extra if isinstance(extra, dict) else {}, None
+        except Exception as e:
+            return time.perf_counter() - start, {}, str(e)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        outcomes = list(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [latency for latency, _, error in outcomes if error is None]
+    errors = [error for _, _, error in outcomes if error is not None]
+    extras = {}
+    for _, extra, error in outcomes:
+        if error is None:
+            for key, value in extra.items():
+                extras.setdefault(key, []).append(value)
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+        "latency_ms": summarize(latencies),
+        **{f"{key}_ms": summarize(values) for key, values in extras.items()}
+    }
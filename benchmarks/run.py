@@ -0,0 +1,272 @@
+# coding:utf-8
+"""Benchmark the real clients in lib/ against local fake servers
+
+Usage (from the repository root):
+    python -m benchmarks.run --concurrency 1,4,16 --requests 64 --output results.json
+    python -m benchmarks.run --scenarios upscale_ws,prompt_stream --compare results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI, FakeOpenAI, FakeVolcengine, make_png
+from benchmarks.harness import run_load
+from lib.comfyui_client import ComfyUIClient
+from lib.http_transport import HttpTransport
+from lib.pipeline import generate_and_upscale
+from lib.poster_generator import PosterGenerator
+from lib.rate_limiter import AdaptiveRateLimiter
+
+
+USER_PROMPT = "几位劳动者在工厂工作"
+
+
+def make_transport(args, concurrency):
+    """A private pool per scenario and level, sized so the client is not the bottleneck"""
+    return HttpTransport(max_connections_per_host=max(10, concurrency * 2), max_retries=args.retries)
+
+
+def make_poster_generator(servers, args, concurrency):
+    generator = PosterGenerator(
+        "fake-ak", "fake-sk", "fake-key", f"{servers['openai'].base_url}/api/v3", "fake-model",
+        max_concurrency=args.images_per_call, transport=make_transport(args, concurrency),
+        rate_limiter=AdaptiveRateLimiter(
+            rate=args.volc_qps, burst=max(1, int(args.volc_qps)),
+            max_concurrency=concurrency * args.images_per_call, backoff_base=args.volc_latency
+        )
+    )
+    generator.visual_service.set_host(servers["volcengine"].host)
+    generator.visual_service.set_scheme("http")
+    return generator
+
+
+def setup_upscale(use_websocket):
+    def setup(servers, args, concurrency):
+        client = ComfyUIClient(
+            servers["comfyui"].base_url, use_websocket=use_websocket, transport=make_transport(args, concurrency)
+        )
+        source = make_png(args.input_size, args.input_size, seed=2)
+
+        def run(index):
+            client.upscale_image(source)
+        return run
+    return setup
+
+
+def setup_generate(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+
+    def run(index):
+        generator.generate_single_image(USER_PROMPT, 1328, 1328)
+    return run
+
+
+def setup_generate_images(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+
+    def run(index):
+        generator.generate_images(USER_PROMPT, args.images_per_call, 1328, 1328)
+    return run
+
+
+def setup_prompt(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+
+    def run(index):
+        generator.generate_prompt(USER_PROMPT, regenerate=True)
+    return run
+
+
+def setup_prompt_variants(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+
+    def run(index):
+        prompts = generator.generate_prompt_variants(USER_PROMPT, args.images_per_call, regenerate=True)
+        if len(prompts) != args.images_per_call:
+            raise Exception(f"Expected {args.images_per_call} variants, got {len(prompts)}")
+    return run
+
+
+def setup_prompt_stream(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+
+    def run(index):
+        start = time.perf_counter()
+        ttft = None
+        for _ in generator.generate_prompt_stream(USER_PROMPT, regenerate=True):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+        return {"ttft": ttft}
+    return run
+
+
+def setup_pipeline(servers, args, concurrency):
+    generator = make_poster_generator(servers, args, concurrency)
+    client = ComfyUIClient(servers["comfyui"].base_url, transport=make_transport(args, concurrency))
+
+    def run(index):
+        failures = [
+            event["error"]
+            for event in generate_and_upscale(generator, client, USER_PROMPT, args.images_per_call, 1328, 1328)
+            if event["stage"] == "failed"
+        ]
+        if failures:
+            raise Exception(failures[0])
+    return run
+
+
+# name -> (description, setup(servers, args, concurrency) -> func(index))
+SCENARIOS = {
+    "upscale_ws": ("ComfyUIClient.upscale_image, completion via /ws events", setup_upscale(True)),
+    "upscale_polling": ("ComfyUIClient.upscale_image, completion via /history polling", setup_upscale(False)),
+    "generate": ("PosterGenerator.generate_single_image (one cv_process call)", setup_generate),
+    "generate_images": ("PosterGenerator.generate_images (images_per_call concurrent cv_process calls)", setup_generate_images),
+    "prompt": ("PosterGenerator.generate_prompt, cache bypassed", setup_prompt),
+    "prompt_stream": ("PosterGenerator.generate_prompt_stream, cache bypassed; reports time to first token", setup_prompt_stream),
+    "prompt_variants": ("PosterGenerator.generate_prompt_variants, images_per_call prompts in one completion", setup_prompt_variants),
+    "pipeline": ("generate_and_upscale end to end (images_per_call posters)", setup_pipeline)
+}
+
+
+def start_servers(args):
+    def behavior(latency, offset):
+        return Behavior(latency, args.jitter * latency, args.error_rate, None if args.seed is None else args.seed + offset)
+
+    servers = {
+        "comfyui": FakeComfyUI(
+            api=behavior(args.api_latency, 1),
+            processing=Behavior(args.comfy_process_time, args.jitter * args.comfy_process_time, 0.0, args.seed),
+            workers=args.comfy_workers,
+            result_size=(args.input_size * 2, args.input_size * 2)
+        ),
+        "volcengine": FakeVolcengine(api=behavior(args.volc_latency, 2), quota=args.volc_quota),
+        "openai": FakeOpenAI(api=behavior(args.llm_latency, 3), token_interval=args.token_interval)
+    }
+    for server in servers.values():
+        server.start()
+    return servers
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def format_row(result):
+    latency = result["latency_ms"]
+    cells = [
+        result["scenario"], str(result["concurrency"]), f"{result['ok']}/{result['requests']}",
+        f"{result['throughput_rps']}", f"{latency['p50']}", f"{latency['p95']}", f"{latency['p99']}"
+    ]
+    return "  ".join(cell.ljust(width) for cell, width in zip(cells, (16, 5, 9, 9, 9, 9, 9)))
+
+
+def compare(results, baseline_path):
+    """Print p50/p95/throughput changes against a previous results file"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(item["scenario"], item["concurrency"]): item for item in json.load(f)["results"]}
+
+    def change(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {baseline_path} (negative latency / positive throughput is better):")
+    for result in results:
+        old = baseline.get((result["scenario"], result["concurrency"]))
+        if old is None:
+            continue
+        print(
+            f"  {result['scenario']:<16} c={result['concurrency']:<4} "
+            f"p50 {change(result['latency_ms']['p50'], old['latency_ms']['p50']):>8}  "
+            f"p95 {change(result['latency_ms']['p95'], old['latency_ms']['p95']):>8}  "
+            f"rps {change(result['throughput_rps'], old['throughput_rps']):>8}"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark lib/ clients against local fake services")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="calls per scenario and level")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed calls before each level")
+    parser.add_argument("--api-latency", type=float, default=0.01, help="ComfyUI HTTP endpoint latency (s)")
+    parser.add_argument("--comfy-process-time", type=float, default=0.2, help="simulated GPU time per upscale (s)")
+    parser.add_argument("--comfy-workers", type=int, default=4, help="simulated ComfyUI GPUs")
+    parser.add_argument("--volc-latency", type=float, default=0.5, help="cv_process latency (s)")
+    parser.add_argument("--volc-quota", type=int, default=0, help="cv_process calls per second before the fake throttles (0 = unlimited)")
+    parser.add_argument("--volc-qps", type=float, default=0, help="client-side token bucket rate for cv_process (0 = no rate cap)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="chat completion time to first token (s)")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="delay between streamed chunks (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="latency jitter as a fraction of latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of injected failures per endpoint")
+    parser.add_argument("--input-size", type=int, default=512, help="edge of the synthetic upscale input (px)")
+    parser.add_argument("--images-per-call", type=int, default=4, help="images per generate_images / pipeline call")
+    parser.add_argument("--retries", type=int, default=3, help="HttpTransport retries for idempotent calls")
+    parser.add_argument("--seed", type=int, default=None, help="seed for jitter and error injection")
+    parser.add_argument("--output", help="write machine-readable results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    servers = start_servers(args)
+    results = []
+    try:
+        print("  ".join(title.ljust(width) for title, width in zip(
+            ("scenario", "conc", "ok", "rps", "p50 ms", "p95 ms", "p99 ms"), (16, 5, 9, 9, 9, 9, 9)
+        )))
+        for name in names:
+            setup = SCENARIOS[name][1]
+            for concurrency in levels:
+                throttled = servers["volcengine"].throttled
+                result = dict(scenario=name, **run_load(setup(servers, args, concurrency), concurrency, args.requests, args.warmup))
+                result["volc_throttled"] = servers["volcengine"].throttled - throttled
+                results.append(result)
+                print(format_row(result))
+                if result["volc_throttled"]:
+                    print(f"    cv_process calls throttled by --volc-quota: {result['volc_throttled']}")
+                for sample in result["error_samples"]:
+                    print(f"    error: {sample[:160]}")
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "settings": vars(args)
+        },
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
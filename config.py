@@ -13,5 +13,78 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'your_openai_api_key_here')
 OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://ark.cn-beijing.volces.com/api/v3')
 DOUBAO_MODEL = os.getenv('DOUBAO_MODEL', 'doubao-1-5-pro-32k-250115')
 
+# Doubao prompt cache: TTL in seconds, LRU size, optional JSON file to persist across restarts
+PROMPT_CACHE_TTL = int(os.getenv('PROMPT_CACHE_TTL', '86400'))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv('PROMPT_CACHE_MAX_ENTRIES', '512'))
+PROMPT_CACHE_PATH = os.getenv('PROMPT_CACHE_PATH', '')
+
+# Maximum concurrent image generation requests per submit
+IMAGE_GEN_MAX_CONCURRENCY = int(os.getenv('IMAGE_GEN_MAX_CONCURRENCY', '4'))
+
+# Volcengine cv_process limits shared by every session in the process: token bucket rate
+# (requests/second, set just under your quota; 0 = no rate cap) and burst, adaptive
+# concurrency ceiling, and retries for throttled (50429/50430) requests
+VOLCENGINE_QPS = float(os.getenv('VOLCENGINE_QPS', '2'))
+VOLCENGINE_BURST = int(os.getenv('VOLCENGINE_BURST', '2'))
+VOLCENGINE_MAX_CONCURRENCY = int(os.getenv('VOLCENGINE_MAX_CONCURRENCY', '8'))
+VOLCENGINE_THROTTLE_RETRIES = int(os.getenv('VOLCENGINE_THROTTLE_RETRIES', '5'))
+
+# Shared HTTP transport: keep-alive connections per host and retries for idempotent calls
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', '10'))
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '3'))
+
 # ComfyUI configuration
-COMFYUI_BASE_URL = os.getenv('COMFYUI_BASE_URL', 'https://comfyui.internal.wj2015.com') 
\ No newline at end of file
+COMFYUI_BASE_URL = os.getenv('COMFYUI_BASE_URL', 'https://comfyui.internal.wj2015.com')
+
+# Comma-separated ComfyUI servers; jobs go to the healthy one with the shortest queue
+COMFYUI_BASE_URLS = [url.strip() for url in (os.getenv('COMFYUI_BASE_URLS') or COMFYUI_BASE_URL).split(',') if url.strip()]
+COMFYUI_HEALTH_CHECK_INTERVAL = int(os.getenv('COMFYUI_HEALTH_CHECK_INTERVAL', '10'))
+
+# Maximum concurrent upscale jobs per batch
+UPSCALE_MAX_CONCURRENCY = int(os.getenv('UPSCALE_MAX_CONCURRENCY', '4'))
+
+# Tiled upscaling: tile edge and overlap in input pixels; images whose longest
+# edge exceeds UPSCALE_TILE_MIN_EDGE are tiled by default on the upscale page
+UPSCALE_TILE_SIZE = int(os.getenv('UPSCALE_TILE_SIZE', '512'))
+UPSCALE_TILE_OVERLAP = int(os.getenv('UPSCALE_TILE_OVERLAP', '32'))
+UPSCALE_TILE_MIN_EDGE = int(os.getenv('UPSCALE_TILE_MIN_EDGE', '1024'))
+
+# Upscale input normalization: strip metadata and re-encode compactly before upload.
+# UPSCALE_MAX_OUTPUT_EDGE > 0 shrinks inputs so results stay within that edge.
+UPSCALE_NORMALIZE_INPUT = os.getenv('UPSCALE_NORMALIZE_INPUT', 'true').lower() in ('1', 'true', 'yes')
+UPSCALE_MAX_OUTPUT_EDGE = int(os.getenv('UPSCALE_MAX_OUTPUT_EDGE', '0'))
+
+# Upscale result cache (content-addressed, LRU by size); set max to 0 to disable
+UPSCALE_CACHE_DIR = os.getenv('UPSCALE_CACHE_DIR', 'upscale_cache')
+UPSCALE_CACHE_MAX_MB = int(os.getenv('UPSCALE_CACHE_MAX_MB', '1024'))
+
+# Upscale artifacts: full-resolution files plus display previews on disk.
+# Under static/ they are served by Streamlit static serving at ARTIFACT_URL_PREFIX.
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR', 'static/artifacts')
+ARTIFACT_URL_PREFIX = os.getenv('ARTIFACT_URL_PREFIX', 'app/static/artifacts')
+ARTIFACT_PREVIEW_MAX_EDGE = int(os.getenv('ARTIFACT_PREVIEW_MAX_EDGE', '800'))
+# Artifacts are only for display and download: older than ARTIFACT_MAX_AGE_HOURS, then
+# the oldest past ARTIFACT_MAX_MB, are removed (0 disables either limit)
+ARTIFACT_MAX_AGE_HOURS = float(os.getenv('ARTIFACT_MAX_AGE_HOURS', '24'))
+ARTIFACT_MAX_MB = int(os.getenv('ARTIFACT_MAX_MB', '1024'))
+
+# Background jobs: SQLite job table and worker pool size
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs.db')
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', '4'))
+
+# Fixed-seed generation cache: image bytes keyed on the canonical request body, LRU-evicted
+# past GENERATION_CACHE_MAX_MB (0 disables)
+GENERATION_CACHE_DIR = os.getenv('GENERATION_CACHE_DIR', 'generation_cache')
+GENERATION_CACHE_MAX_MB = int(os.getenv('GENERATION_CACHE_MAX_MB', '512'))
+
+# Image archive: every generated and upscaled image is kept here, content-addressed,
+# with a SQLite index; past ARCHIVE_MAX_MB files are evicted by ARCHIVE_EVICTION
+# ("lru" = least recently used, "oldest" = first archived). Set max to 0 to disable.
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_MAX_MB = int(os.getenv('ARCHIVE_MAX_MB', '2048'))
+ARCHIVE_EVICTION = os.getenv('ARCHIVE_EVICTION', 'lru')
+
+# Stage timing metrics: Prometheus scrape endpoint (0 disables) and one JSON log line per span
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_LOG_SPANS = os.getenv('METRICS_LOG_SPANS', 'false').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,171 @@
+# coding:utf-8
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from PIL import Image
+
+
+class Artifact:
+    """A stored result: full-resolution file plus a small preview, referenced by id"""
+
+    def __init__(self, artifact_id, path, preview_path, url=None, preview_url=None):
+        self.id = artifact_id
+        self.path = path
+        self.preview_path = preview_path
+        self.url = url
+        self.preview_url = preview_url
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+    @property
+    def size_mb(self):
+        return os.path.getsize(self.path) / (1024 * 1024)
+
+    @property
+    def mime_type(self):
+        ext = self.path.rsplit('.', 1)[-1].lower()
+        return {"jpg": "image/jpeg", "jpeg": "image/jpeg", "webp": "image/webp"}.get(ext, "image/png")
+
+
+class ArtifactStore:
+    """Writes results to disk once and derives a downscaled preview for display
+
+    Files live at <root>/<artifact_id>/full.<ext> and preview.<ext>. When root is
+    served as static files, url_prefix makes them downloadable without passing
+    the bytes through the Streamlit websocket. Artifacts are transient: ones
+    older than max_age_seconds, then the oldest past max_bytes, are removed
+    when the store opens and after every new artifact (0 disables either).
+    """
+
+    def __init__(self, root="artifacts", url_prefix=None, preview_max_edge=800, preview_format="WEBP",
+                 max_age_seconds=0, max_bytes=0):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/') if url_prefix else None
+        self.preview_max_edge = preview_max_edge
+        self.preview_format = preview_format
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+
+        os.makedirs(root, exist_ok=True)
+        self.cleanup()
+
+    def _url(self, artifact_id, name):
+        if not self.url_prefix:
+            return None
+        return f"{self.url_prefix}/{artifact_id}/{name}"
+
+    def _preview_name(self):
+        return "preview.webp" if self.preview_format == "WEBP" else "preview.jpg"
+
+    def make_preview(self, src_path, dst_path):
+        """Write a downscaled WebP/JPEG preview of src_path"""
+        with Image.open(src_path) as image:
+            # Lets the JPEG decoder skip straight to a reduced scale
+            image.draft("RGB", (self.preview_max_edge, self.preview_max_edge))
+            image.thumbnail((self.preview_max_edge, self.preview_max_edge))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+            if self.preview_format == "WEBP":
+                image.save(dst_path, "WEBP", quality=80, method=4)
+            else:
+                image.convert("RGB").save(dst_path, "JPEG", quality=85, optimize=True)
+
+    def create(self, write_into, ext="png"):
+        """Create an artifact by letting write_into(path) stream the full file to disk"""
+        artifact_id = uuid.uuid4().hex
+        directory = os.path.join(self.root, artifact_id)
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, f"full.{ext}")
+        preview_path = os.path.join(directory, self._preview_name())
+        try:
+            write_into(path)
+            self.make_preview(path, preview_path)
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+
+        self.cleanup(keep=(artifact_id,))
+        return self.get(artifact_id)
+
+    def temp_path(self, ext="png"):
+        """Return a fresh file path in the store for a result to be adopted by create_from_file()"""
+        fd, path = tempfile.mkstemp(dir=self.root, suffix=f".{ext}.tmp")
+        os.close(fd)
+        return path
+
+    def create_from_file(self, src_path, ext="png"):
+        """Create an artifact by moving an already written file (e.g. from temp_path()) into the store"""
+        return self.create(lambda path: os.replace(src_path, path), ext)
+
+    def save_bytes(self, data, ext="png"):
+        """Create an artifact from bytes already in memory"""
+        def write_into(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        return self.create(write_into, ext)
+
+    def get(self, artifact_id):
+        """Look up an artifact by id, or None if it no longer exists"""
+        directory = os.path.join(self.root, artifact_id)
+        if not os.path.isdir(directory):
+            return None
+
+        full_name = next((name for name in os.listdir(directory) if name.startswith("full.")), None)
+        if full_name is None:
+            return None
+
+        preview_name = self._preview_name()
+        return Artifact(
+            artifact_id,
+            os.path.join(directory, full_name),
+            os.path.join(directory, preview_name),
+            self._url(artifact_id, full_name),
+            self._url(artifact_id, preview_name)
+        )
+
+    def _entries(self):
+        """(mtime, bytes, artifact_id) of every stored artifact, oldest first"""
+        entries = []
+        for artifact_id in os.listdir(self.root):
+            directory = os.path.join(self.root, artifact_id)
+            try:
+                if not os.path.isdir(directory):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+                entries.append((os.path.getmtime(directory), size, artifact_id))
+            except OSError:
+                pass  # Removed concurrently
+        entries.sort()
+        return entries
+
+    def cleanup(self, max_age_seconds=None, max_bytes=None, keep=()):
+        """Remove artifacts older than max_age_seconds, then the oldest until at most max_bytes remain
+
+        Limits default to the store's; 0 disables a limit. Artifacts in keep
+        are never removed. Returns the number removed.
+        """
+        max_age_seconds = self.max_age_seconds if max_age_seconds is None else max_age_seconds
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if not max_age_seconds and not max_bytes:
+            return 0
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - max_age_seconds if max_age_seconds else None
+        removed = 0
+        for mtime, size, artifact_id in entries:
+            expired = cutoff is not None and mtime < cutoff
+            if artifact_id in keep or not (expired or (max_bytes and total > max_bytes)):
+                continue
+            shutil.rmtree(os.path.join(self.root, artifact_id), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,280 @@
+# coding:utf-8
+import asyncio
+import os
+import uuid
+
+import httpx
+
+from lib.comfyui_client import PROMPT_FINISHED, ComfyUIClient, extract_output_images, read_event, websocket_url
+from lib.metrics import count, span
+
+try:
+    import websockets  # optional, enables event-driven completion
+except ImportError:
+    websockets = None
+
+
+class AsyncComfyUIClient:
+    """Asyncio front end of ComfyUIClient for driving many upscale jobs on one event loop
+
+    Uploads, queueing, result downloads, normalization, the upscale cache,
+    metrics and the archive all go through the wrapped ComfyUIClient, each as
+    a short call on a worker thread. Only the wait for completion, which can
+    take minutes, is native asyncio (websockets for /ws, httpx for /history),
+    so an outstanding job parks a coroutine instead of a thread.
+    """
+
+    def __init__(self, client=None, base_url="https://comfyui.internal.wj2015.com", use_websocket=True,
+                 max_connections=100, max_retries=3):
+        # The sync client owns every request except the wait
+        self.sync_client = client or ComfyUIClient(base_url)
+        self.base_url = self.sync_client.base_url
+
+        # Completion is pushed over /ws when websockets is installed,
+        # otherwise wait_for_completion polls /history with adaptive backoff
+        self.use_websocket = use_websocket and websockets is not None
+
+        # Connection pool for /history polling, shared by every job of this client
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self._client = None
+
+        # Cache misses in flight on this client's loop, by cache key
+        self._flights = {}
+
+    @property
+    def client(self):
+        """Lazily created httpx.AsyncClient, bound to the loop that first uses it"""
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            )
+            self._client = httpx.AsyncClient(
+                timeout=30,
+                transport=httpx.AsyncHTTPTransport(retries=self.max_retries, limits=limits)
+            )
+        return self._client
+
+    async def aclose(self):
+        """Close the underlying connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def open_event_socket(self, client_id):
+        """Open the ComfyUI /ws event stream for client_id, or None when unavailable"""
+        if not self.use_websocket:
+            return None
+
+        try:
+            return await websockets.connect(
+                f"{websocket_url(self.base_url)}/ws?clientId={client_id}",
+                open_timeout=10,
+                max_size=None
+            )
+        except Exception as e:
+            print(f"WebSocket unavailable, falling back to polling: {e}")
+            return None
+
+    async def _check_history(self, prompt_id, output_node):
+        """Fetch history and extract output images, tolerating transient fetch errors"""
+        try:
+            response = await self.client.get(f"{self.base_url}/history/{prompt_id}")
+            response.raise_for_status()
+            history = response.json()
+        except Exception as e:
+            print(f"Error checking status: {e}")
+            return None
+        return extract_output_images(history, prompt_id, output_node)
+
+    async def _wait_via_websocket(self, ws, prompt_id, deadline, output_node):
+        """Wait for prompt completion using executing/executed events, None on deadline"""
+        loop = asyncio.get_running_loop()
+
+        # Events sent before the socket attached are lost, so check history once first
+        images = await self._check_history(prompt_id, output_node)
+        if images:
+            return images
+
+        while loop.time() < deadline:
+            try:
+                message = await asyncio.wait_for(ws.recv(), timeout=max(0.1, min(5.0, deadline - loop.time())))
+            except asyncio.TimeoutError:
+                # Quiet socket: make sure we did not miss the finish event
+                images = await self._check_history(prompt_id, output_node)
+                if images:
+                    return images
+                continue
+
+            _, outcome = read_event(message, prompt_id, output_node)
+            if outcome is PROMPT_FINISHED:
+                images = await self._check_history(prompt_id, output_node)
+                if images:
+                    return images
+                raise Exception("Workflow finished without output images")
+            if outcome:
+                return outcome
+
+        return None
+
+    async def _wait_via_polling(self, prompt_id, deadline, output_node):
+        """Poll /history with the sync client's adaptive backoff, None on deadline"""
+        loop = asyncio.get_running_loop()
+        interval = self.sync_client.poll_initial_interval
+
+        while loop.time() < deadline:
+            images = await self._check_history(prompt_id, output_node)
+            if images:
+                return images
+
+            await asyncio.sleep(max(0, min(interval, deadline - loop.time())))
+            interval = min(interval * self.sync_client.poll_backoff, self.sync_client.poll_max_interval)
+
+        return None
+
+    async def wait_for_completion(self, prompt_id, timeout=300, ws=None, output_node=None):
+        """Wait for workflow completion and return result images"""
+        output_node = output_node or self.sync_client.template.output_node
+        deadline = asyncio.get_running_loop().time() + timeout
+        images = None
+
+        with span("comfyui.wait", backend=self.base_url):
+            if ws is not None:
+                try:
+                    images = await self._wait_via_websocket(ws, prompt_id, deadline, output_node)
+                except (websockets.exceptions.WebSocketException, OSError) as e:
+                    print(f"WebSocket lost, falling back to polling: {e}")
+
+            if images is None:
+                images = await self._wait_via_polling(prompt_id, deadline, output_node)
+
+            if images is None:
+                raise Exception(f"Workflow timeout after {timeout} seconds")
+
+        return images
+
+    async def _queue_and_wait(self, uploaded_filename, template, timeout):
+        """Queue the upscale workflow for an uploaded image and wait for its output images"""
+        sync_client = self.sync_client
+        workflow = sync_client._build_upscale_workflow(uploaded_filename, template)
+
+        # Subscribe to events, then queue workflow
+        client_id = uuid.uuid4().hex
+        ws = await self.open_event_socket(client_id)
+        try:
+            prompt_id = await asyncio.to_thread(sync_client.queue_prompt, workflow, client_id)
+            if not prompt_id:
+                raise Exception("Failed to get prompt ID")
+
+            return await self.wait_for_completion(prompt_id, timeout, ws=ws, output_node=template.output_node)
+        finally:
+            if ws is not None:
+                await ws.close()
+
+    async def _compute_cached(self, key, spooled, filename, template, timeout):
+        """Run one upscale into the cache under key; closes spooled when done
+
+        The result is fetched into a temporary file of the store, which is
+        removed if any step fails, so failed jobs leave nothing behind.
+        """
+        sync_client = self.sync_client
+        store = sync_client.cache.store
+        tmp_path = store.temp_path()
+        try:
+            with spooled:
+                uploaded_filename = await asyncio.to_thread(sync_client._upload_source, spooled, template, filename)
+            result_images = await self._queue_and_wait(uploaded_filename, template, timeout)
+            await asyncio.to_thread(sync_client._fetch_first_image, result_images, tmp_path)
+            return await asyncio.to_thread(store.put_file, key, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def _upscale_cached(self, image_source, output, timeout, template):
+        """Serve an upscale from the sync client's cache, or run it and store the result there
+
+        Identical inputs in flight on this client share one job, as
+        UpscaleCache.get_or_compute_path does for threads. The job runs as its
+        own task, so a caller that gives up does not cancel it for the others.
+        """
+        sync_client = self.sync_client
+        spooled, content_hash, filename = await asyncio.to_thread(sync_client._spool_image_source, image_source)
+        key = sync_client._cache_key(template, content_hash=content_hash)
+        cached_path = sync_client.cache.store.get_path(key)
+
+        flight = self._flights.get(key) if cached_path is None else None
+        count("upscale_cache", result="miss" if cached_path is None and flight is None else "hit")
+        if cached_path is None and flight is None:
+            # The task takes ownership of the spooled input
+            flight = asyncio.ensure_future(self._compute_cached(key, spooled, filename, template, timeout))
+            self._flights[key] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            spooled.close()
+
+        if cached_path is None:
+            cached_path = await asyncio.shield(flight)
+        return await asyncio.to_thread(sync_client._deliver_file, cached_path, output)
+
+    async def upscale_image(self, image_source, timeout=300, template=None, output=None):
+        """High-level method to upscale an image - supports URL, bytes, or file objects
+
+        Same inputs, template, cache and output handling as ComfyUIClient.upscale_image.
+        """
+        sync_client = self.sync_client
+        try:
+            template = sync_client.resolve_template(template)
+
+            with span("comfyui.upscale", backend=self.base_url, template=template.name):
+                if sync_client.cache is not None:
+                    result = await self._upscale_cached(image_source, output, timeout, template)
+                else:
+                    uploaded_filename = await asyncio.to_thread(sync_client._upload_source, image_source, template)
+                    result_images = await self._queue_and_wait(uploaded_filename, template, timeout)
+                    result = await asyncio.to_thread(sync_client._fetch_first_image, result_images, output)
+
+            sync_client._archive_result(result, image_source, template)
+            return result
+
+        except Exception as e:
+            raise Exception(f"Upscale failed: {e}")
+
+    async def upscale_many(self, image_sources, max_in_flight=100, timeout=300, template=None):
+        """Upscale many images on one event loop, keeping input order
+
+        Returns dicts: {"index": int, "image_data": bytes or None, "error": str or None}
+        """
+        semaphore = asyncio.Semaphore(max(1, max_in_flight))
+
+        async def run(index, image_source):
+            async with semaphore:
+                try:
+                    image_data = await self.upscale_image(image_source, timeout, template=template)
+                    return {"index": index, "image_data": image_data, "error": None}
+                except Exception as e:
+                    return {"index": index, "image_data": None, "error": str(e)}
+
+        return await asyncio.gather(*(run(index, source) for index, source in enumerate(image_sources)))
+
+
+def upscale_many_sync(image_sources, client, max_in_flight=100, timeout=300, template=None):
+    """Run upscale_many from synchronous code on a private event loop
+
+    client is a ComfyUIClient (its cache, normalization and archive apply) or a base URL.
+    """
+    if isinstance(client, str):
+        client = ComfyUIClient(client)
+
+    async def run():
+        async with AsyncComfyUIClient(client) as async_client:
+            return await async_client.upscale_many(image_sources, max_in_flight, timeout, template)
+
+    return asyncio.run(run())
@@ -0,0 +1,321 @@
+# coding:utf-8
+import csv
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lib.fetched_image import FORMAT_CONTENT_TYPES, HEADER_PROBE_BYTES, is_url, probe_image_header
+from lib.http_transport import get_transport
+from lib.metrics import span, trace
+
+
+# Manifest statuses; "partial" and "failed" items are retried when a run is resumed
+OK = "ok"
+PARTIAL = "partial"
+FAILED = "failed"
+
+DONE_STATUSES = (OK,)
+
+# Item fields that may come from a JSONL object or a CSV column
+ITEM_FIELDS = ("id", "prompt", "image", "count", "width", "height", "ratio", "upscale", "template")
+
+
+def _parse_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    text = str(value).strip().lower()
+    if not text:
+        return None
+    return text in ("1", "true", "yes", "y")
+
+
+def _normalize_item(raw, position):
+    """Keep known fields, coerce CSV strings and assign a stable id"""
+    if isinstance(raw, str):
+        raw = {"prompt": raw}
+    if not isinstance(raw, dict):
+        raise Exception(f"Item {position}: expected an object or a prompt string, got {type(raw).__name__}")
+
+    item = {key: raw[key] for key in ITEM_FIELDS if raw.get(key) not in (None, "")}
+    for key in ("count", "width", "height"):
+        if key in item:
+            item[key] = int(item[key])
+    if "upscale" in item:
+        item["upscale"] = _parse_bool(item["upscale"])
+
+    if not item.get("prompt") and not item.get("image"):
+        raise Exception(f"Item {position}: needs a prompt or an image")
+
+    # Without an explicit id the position is the id, so resuming needs the same input file
+    item["id"] = str(item.get("id") or f"{position:06d}")
+    return item
+
+
+def read_items(path):
+    """Read batch items from a .jsonl or .csv file
+
+    JSONL lines are objects or plain strings (taken as prompts); CSV needs a
+    header row. Recognised fields: id, prompt, image (path or URL), count,
+    width, height, ratio, upscale, template. A row that is not a usable item
+    (bad JSON, a list or number, no prompt or image) does not stop the batch:
+    it becomes an item carrying an "invalid" message, recorded as failed.
+    """
+    items = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        is_csv = path.lower().endswith(".csv")
+        rows = csv.DictReader(f) if is_csv else (line for line in f if line.strip())
+
+        for position, row in enumerate(rows, 1):
+            try:
+                if not is_csv:
+                    try:
+                        row = json.loads(row)
+                    except ValueError as e:
+                        raise Exception(f"Item {position}: invalid JSON: {e}")
+                items.append(_normalize_item(row, position))
+            except Exception as e:
+                row_id = row.get("id") if isinstance(row, dict) else None
+                items.append({"id": str(row_id or f"{position:06d}"), "invalid": str(e)})
+
+    ids = [item["id"] for item in items]
+    if len(set(ids)) != len(ids):
+        raise Exception("Item ids must be unique")
+    return items
+
+
+def load_manifest(path):
+    """Return {item id: last manifest record}; a line cut off by a crash is ignored"""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and "id" in record:
+                records[record["id"]] = record
+    return records
+
+
+def _safe_name(text):
+    return re.sub(r"[^\w.-]+", "_", text).strip("._") or "item"
+
+
+class BatchRunner:
+    """Runs prompt generation, image generation and optional upscaling over many items
+
+    Each finished item is appended to manifest.jsonl in output_dir and
+    flushed to disk, so the manifest doubles as the checkpoint: a rerun with
+    the same input skips items already recorded as ok and retries the rest.
+    """
+
+    def __init__(self, poster_generator, comfyui_client, output_dir, concurrency=4, upscale=False,
+                 skip_prompt=False, count=1, ratio=None, template=None, transport=None):
+        self.poster_generator = poster_generator
+        self.comfyui_client = comfyui_client
+        self.output_dir = output_dir
+        self.image_dir = os.path.join(output_dir, "images")
+        self.manifest_path = os.path.join(output_dir, "manifest.jsonl")
+        self.concurrency = max(1, concurrency)
+
+        # Defaults for items that do not set their own
+        self.upscale = upscale
+        self.skip_prompt = skip_prompt
+        self.count = count
+        self.ratio = ratio
+        self.template = template
+
+        self.transport = transport or get_transport()
+        self._manifest_lock = threading.Lock()
+        os.makedirs(self.image_dir, exist_ok=True)
+
+    def _size(self, item):
+        """(width, height) from the item, else its ratio, else the runner default ratio"""
+        if item.get("width") and item.get("height"):
+            return item["width"], item["height"]
+
+        aspect_ratios = self.poster_generator.get_aspect_ratios()
+        ratio = item.get("ratio") or self.ratio
+        if not ratio:
+            return next(iter(aspect_ratios.values()))
+        for label, size in aspect_ratios.items():
+            if label == ratio or label.split(" ")[0] == ratio:
+                return size
+        raise Exception(f"Unknown ratio {ratio}, expected one of: {', '.join(aspect_ratios)}")
+
+    def _path(self, name):
+        return os.path.join(self.image_dir, name)
+
+    def _download(self, url, stem):
+        """Save a generated image next to the other outputs; the URLs expire
+
+        url may also be a local path, as for cached fixed-seed generations.
+        """
+        if is_url(url):
+            with span("batch.download"):
+                response = self.transport.get(url, timeout=60)
+                response.raise_for_status()
+            data = response.content
+            content_type = response.headers.get("content-type", "").split(";")[0].strip()
+        else:
+            with open(url, "rb") as f:
+                data = f.read()
+            content_type = ""
+
+        # Name the file after the actual image format when it can be recognised
+        probed = probe_image_header(data[:HEADER_PROBE_BYTES])
+        if probed:
+            content_type = FORMAT_CONTENT_TYPES.get(probed[0], content_type)
+        extension = mimetypes.guess_extension(content_type) or ".png"
+        path = self._path(f"{stem}{extension}")
+
+        def write(partial):
+            with open(partial, "wb") as f:
+                f.write(data)
+        return self._write_atomic(path, write)
+
+    @staticmethod
+    def _write_atomic(path, write):
+        """Write through a temporary name so an interrupted run never leaves a truncated output"""
+        partial = path + ".part"
+        write(partial)
+        os.replace(partial, path)
+        return path
+
+    def _upscale(self, source_path, stem, template):
+        """Upscale a local file into <stem>_hd.png"""
+        path = self._path(f"{stem}_hd.png")
+        with open(source_path, "rb") as source:
+            return self._write_atomic(
+                path, lambda partial: self.comfyui_client.upscale_image(source, output=partial, template=template)
+            )
+
+    def _process_prompt(self, item, record, upscale, template):
+        text = item["prompt"]
+        record["prompt"] = text if self.skip_prompt else self.poster_generator.generate_prompt(text)
+
+        width, height = self._size(item)
+        results = self.poster_generator.generate_images_detailed(
+            record["prompt"], item.get("count", self.count), width, height
+        )
+
+        for result in results:
+            for position, url in enumerate(result["urls"] or [None]):
+                entry = {"index": result["index"], "url": url, "path": None, "hd_path": None, "error": result["error"]}
+                record["images"].append(entry)
+                if url is None:
+                    entry["error"] = entry["error"] or "No image returned"
+                    continue
+
+                stem = f"{_safe_name(item['id'])}_{result['index'] + 1}" + (f"_{position + 1}" if position else "")
+                try:
+                    entry["path"] = self._download(url, stem)
+                    if upscale:
+                        entry["hd_path"] = self._upscale(entry["path"], stem, template)
+                except Exception as e:
+                    entry["error"] = str(e)
+
+    def _process_image(self, item, record, template):
+        source = item["image"]
+        entry = {"index": 0, "url": source if is_url(source) else None,
+                 "path": None, "hd_path": None, "error": None}
+        record["images"].append(entry)
+        stem = _safe_name(item["id"])
+        try:
+            if entry["url"]:
+                entry["path"] = self._download(source, stem)
+            else:
+                entry["path"] = source
+            entry["hd_path"] = self._upscale(entry["path"], stem, template)
+        except Exception as e:
+            entry["error"] = str(e)
+
+    def process(self, item):
+        """Run one item end to end and return its manifest record; never raises"""
+        record = {"id": item["id"], "input": item, "prompt": None, "images": [], "error": None}
+        upscale = item.get("upscale", self.upscale)
+        template = item.get("template") or self.template
+        started = time.time()
+
+        with trace() as item_trace:
+            try:
+                if item.get("invalid"):
+                    raise Exception(item["invalid"])
+                if item.get("image"):
+                    self._process_image(item, record, template)
+                else:
+                    self._process_prompt(item, record, upscale, template)
+            except Exception as e:
+                record["error"] = str(e)
+
+        errors = [entry["error"] for entry in record["images"] if entry["error"]]
+        if record["error"] or (errors and len(errors) == len(record["images"])):
+            record["status"] = FAILED
+            record["error"] = record["error"] or errors[0]
+        else:
+            record["status"] = PARTIAL if errors else OK
+        record["seconds"] = round(time.time() - started, 3)
+        record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        record["timings"] = item_trace.breakdown()
+        return record
+
+    def _append(self, record):
+        with self._manifest_lock, open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def pending(self, items):
+        """Items not yet recorded as done in the manifest"""
+        done = {item_id for item_id, record in load_manifest(self.manifest_path).items()
+                if record.get("status") in DONE_STATUSES}
+        return [item for item in items if item["id"] not in done]
+
+    def run(self, items, on_record=None):
+        """Process every pending item with bounded concurrency and return a summary
+
+        on_record(record, finished, total) is called as each item completes.
+        Items are submitted a window at a time, so an interrupt (Ctrl-C)
+        leaves at most `concurrency` items to redo.
+        """
+        todo = self.pending(items)
+        summary = {"total": len(items), "skipped": len(items) - len(todo), OK: 0, PARTIAL: 0, FAILED: 0}
+        started = time.time()
+
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch")
+        running = set()
+        finished = 0
+
+        def drain():
+            nonlocal running, finished
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                finished += 1
+                self._finish(future.result(), summary, finished, len(todo), on_record)
+
+        try:
+            for item in todo:
+                if len(running) >= self.concurrency:
+                    drain()
+                running.add(executor.submit(self.process, item))
+            while running:
+                drain()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        summary["seconds"] = round(time.time() - started, 3)
+        with open(os.path.join(self.output_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+
+    def _finish(self, record, summary, finished, total, on_record):
+        self._append(record)
+        summary[record["status"]] += 1
+        if on_record is not None:
+            on_record(record, finished, total)
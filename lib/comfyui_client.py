@@ -1,132 +1,312 @@
 # coding:utf-8
-import requests
+import contextvars
+import hashlib
 import json
+import mimetypes
+import os
+import shutil
+import tempfile
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from io import BytesIO
+from PIL import Image
+from lib.concurrency import run_bounded
+from lib.fetched_image import FORMAT_CONTENT_TYPES, is_url, probe_image_header
+from lib.http_transport import get_transport
+from lib.image_normalizer import normalize_image, prepare_image
+from lib.metrics import count, record, span
+from lib.tiling import PNGStripeWriter, TileStitcher, plan_tiles
+from lib.workflow_templates import DEFAULT_UPSCALE_TEMPLATE, WorkflowTemplate, get_template
+
+try:
+    import websocket  # websocket-client, optional
+except ImportError:
+    websocket = None
+
+
+# Buffer size for streamed uploads and downloads; bounds per-job memory
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def _is_seekable(file_obj):
+    """True for file-like objects that can be rewound and read again"""
+    try:
+        return hasattr(file_obj, 'read') and file_obj.seekable()
+    except Exception:
+        return False
+
+
+def websocket_url(base_url):
+    """Return the ComfyUI event stream base URL for an http(s) base URL"""
+    if base_url.startswith("https://"):
+        return "wss://" + base_url[len("https://"):]
+    return "ws://" + base_url.split("://", 1)[-1]
+
+
+def extract_output_images(history, prompt_id, output_node="7"):
+    """Return output node images from a history response, or None if not finished"""
+    history_item = history.get(prompt_id)
+    if not history_item:
+        return None
+    
+    outputs = history_item.get('outputs', {})
+    node_output = outputs.get(output_node)
+    if node_output and "images" in node_output:
+        return node_output["images"]
+    
+    status = history_item.get('status', {})
+    if status.get('status_str') == 'error':
+        raise Exception(f"Workflow {prompt_id} failed on ComfyUI")
+    
+    return None
+
+
+# read_event outcome: the whole prompt finished, its images (if any) are in history
+PROMPT_FINISHED = "finished"
+
+
+def read_event(message, prompt_id, output_node="7"):
+    """Interpret one /ws message, shared by the sync and async clients
+    
+    Returns (event_type, outcome) for events of prompt_id and (None, None)
+    otherwise. outcome is the output node's images once it ran,
+    PROMPT_FINISHED when the whole prompt ended (cached outputs send no
+    executed event), else None. Raises when the prompt hit execution_error.
+    """
+    if not isinstance(message, str):
+        return None, None  # Binary preview frames
+    
+    event = json.loads(message)
+    data = event.get("data", {})
+    if data.get("prompt_id") != prompt_id:
+        return None, None
+    
+    event_type = event.get("type")
+    if event_type == "executed" and data.get("node") == output_node:
+        return event_type, (data.get("output") or {}).get("images") or None
+    if event_type == "executing" and data.get("node") is None:
+        return event_type, PROMPT_FINISHED
+    if event_type == "execution_error":
+        raise Exception(f"Workflow failed: {data.get('exception_message', 'unknown error')}")
+    return event_type, None
 
 
 class ComfyUIClient:
     """ComfyUI client for image upscaling"""
     
-    def __init__(self, base_url="https://comfyui.internal.wj2015.com"):
+    def __init__(self, base_url="https://comfyui.internal.wj2015.com", use_websocket=True, transport=None, cache=None,
+                 template=DEFAULT_UPSCALE_TEMPLATE, normalize=True, max_output_edge=0, archive=None):
         self.base_url = base_url.rstrip('/')
         
-        # ComfyUI workflow template for upscaling
-        self.upscale_workflow = {
-            "2": {
-                "inputs": {
-                    "model_name": "RealESRGAN_x2.pth"
-                },
-                "class_type": "UpscaleModelLoader"
-            },
-            "4": {
-                "inputs": {
-                    "upscale_model": ["2", 0],
-                    "image": ["5", 0]
-                },
-                "class_type": "ImageUpscaleWithModel"
-            },
-            "5": {
-                "inputs": {
-                    "image": "",  # Will be filled with uploaded image filename
-                    "upload": "image"
-                },
-                "class_type": "LoadImage"
-            },
-            "7": {
-                "inputs": {
-                    "images": ["4", 0]
-                },
-                "class_type": "PreviewImage"
-            }
-        }
+        # Optional UpscaleCache: hits skip ComfyUI entirely
+        self.cache = cache
+        
+        # Pooled keep-alive sessions shared with the rest of the app
+        self.transport = transport or get_transport()
+        
+        # Completion is pushed over /ws when websocket-client is installed,
+        # otherwise wait_for_completion polls /history with adaptive backoff
+        self.use_websocket = use_websocket and websocket is not None
+        
+        # Polling backoff (seconds): start fast, grow to the cap
+        self.poll_initial_interval = 0.5
+        self.poll_max_interval = 4.0
+        self.poll_backoff = 1.5
+        
+        # Default upscale template; immutable, so one client is safe to share across sessions
+        self.template = self.resolve_template(template)
+        
+        # Re-encode inputs compactly before upload (see image_normalizer); when
+        # max_output_edge is set, inputs are shrunk so the result stays within it
+        self.normalize = normalize
+        self.max_output_edge = max_output_edge
+        
+        # Optional ImageArchive: finished upscales are archived in the background
+        self.archive = archive
     
-    def upload_image_from_url(self, image_url):
-        """Upload image from URL to ComfyUI"""
-        try:
-            # Download image from URL
-            response = requests.get(image_url, timeout=30)
-            response.raise_for_status()
-            
-            # Generate unique filename
-            filename = f"{uuid.uuid4().hex}.jpeg"
-            
-            # Upload to ComfyUI
-            files = {
-                'image': (filename, BytesIO(response.content), 'image/jpeg')
-            }
-            
-            upload_response = requests.post(
+    def _iter_multipart(self, boundary, filename, content_type, chunks):
+        """Yield a multipart/form-data body around a stream of file chunks"""
+        yield (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    
+    def _post_image_stream(self, chunks, filename, content_type='image/jpeg'):
+        """Upload an image to ComfyUI from an iterable of chunks using a chunked request body"""
+        boundary = uuid.uuid4().hex
+        with span("comfyui.upload", backend=self.base_url):
+            upload_response = self.transport.post(
                 f"{self.base_url}/upload/image",
-                files=files,
+                data=self._iter_multipart(boundary, filename, content_type, chunks),
+                headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
                 timeout=30
             )
             upload_response.raise_for_status()
             
             upload_result = upload_response.json()
-            return upload_result.get('name', filename)
+        return upload_result.get('name', filename)
+    
+    def upload_image_from_url(self, image_url):
+        """Upload image from URL to ComfyUI, streaming the download straight into the upload"""
+        try:
+            # Pipe the source download into the multipart upload chunk by chunk
+            with self.transport.get(image_url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                
+                # Label the upload with the type the server declared
+                content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+                if not content_type.startswith('image/'):
+                    content_type = 'image/jpeg'
+                ext = (mimetypes.guess_extension(content_type) or '.jpeg').lstrip('.')
+                filename = f"{uuid.uuid4().hex}.{ext}"
+                
+                return self._post_image_stream(response.iter_content(STREAM_CHUNK_SIZE), filename, content_type)
             
         except Exception as e:
             raise Exception(f"Failed to upload image from URL: {e}")
     
-    def upload_image_from_bytes(self, image_bytes, original_filename=None):
+    def upload_image_from_file(self, file_obj, original_filename=None):
+        """Upload image from a file-like object to ComfyUI in fixed-size chunks"""
+        try:
+            # Keep original extension if available
+            if original_filename and '.' in original_filename:
+                ext = original_filename.split('.')[-1].lower()
+            else:
+                ext = 'jpeg'
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            content_type = mimetypes.guess_type(filename)[0] or 'image/jpeg'
+            
+            chunks = iter(lambda: file_obj.read(STREAM_CHUNK_SIZE), b'')
+            return self._post_image_stream(chunks, filename, content_type)
+            
+        except Exception as e:
+            raise Exception(f"Failed to upload image from file: {e}")
+    
+    def upload_image_from_bytes(self, image_bytes, original_filename=None, content_type=None):
         """Upload image from bytes data to ComfyUI"""
         try:
-            # Generate unique filename
-            if original_filename:
-                # Keep original extension if available
-                ext = original_filename.split('.')[-1].lower() if '.' in original_filename else 'jpeg'
-                filename = f"{uuid.uuid4().hex}.{ext}"
+            # Name and label the upload after the actual image format
+            probed = probe_image_header(image_bytes[:64 * 1024])
+            if probed:
+                ext = 'jpg' if probed[0] == 'JPEG' else probed[0].lower()
+                content_type = content_type or FORMAT_CONTENT_TYPES[probed[0]]
+            elif original_filename and '.' in original_filename:
+                ext = original_filename.split('.')[-1].lower()
             else:
-                filename = f"{uuid.uuid4().hex}.jpeg"
+                ext = 'jpeg'
+            filename = f"{uuid.uuid4().hex}.{ext}"
+            content_type = content_type or mimetypes.guess_type(filename)[0] or 'image/jpeg'
             
             # Upload to ComfyUI
             files = {
-                'image': (filename, BytesIO(image_bytes), 'image/jpeg')
+                'image': (filename, BytesIO(image_bytes), content_type)
             }
             
-            upload_response = requests.post(
-                f"{self.base_url}/upload/image",
-                files=files,
-                timeout=30
-            )
-            upload_response.raise_for_status()
-            
-            upload_result = upload_response.json()
+            with span("comfyui.upload", backend=self.base_url):
+                upload_response = self.transport.post(
+                    f"{self.base_url}/upload/image",
+                    files=files,
+                    timeout=30
+                )
+                upload_response.raise_for_status()
+                
+                upload_result = upload_response.json()
             return upload_result.get('name', filename)
             
         except Exception as e:
             raise Exception(f"Failed to upload image from bytes: {e}")
     
     def upload_image(self, image_source):
-        """Upload image to ComfyUI - supports both URL and bytes"""
-        if isinstance(image_source, str):
+        """Upload image to ComfyUI - supports URL, local path, bytes and file-like objects"""
+        if is_url(image_source):
             return self.upload_image_from_url(image_source)
+        elif isinstance(image_source, str):
+            # Local file, e.g. a cached fixed-seed generation
+            with open(image_source, 'rb') as f:
+                return self.upload_image_from_file(f, image_source)
         else:
             # Assume it's bytes or file-like object
             if hasattr(image_source, 'read'):
-                # It's a file-like object
-                image_bytes = image_source.read()
+                # It's a file-like object, stream it without reading it whole
                 filename = getattr(image_source, 'name', None)
-                return self.upload_image_from_bytes(image_bytes, filename)
+                return self.upload_image_from_file(image_source, filename)
             else:
                 # It's bytes
                 return self.upload_image_from_bytes(image_source)
     
-    def queue_prompt(self, workflow):
+    def _read_image_source(self, image_source):
+        """Return (bytes, filename) for a URL, local path, bytes or file-like image source"""
+        if is_url(image_source):
+            with span("comfyui.download"):
+                response = self.transport.get(image_source, timeout=30)
+                response.raise_for_status()
+                return response.content, None
+        if isinstance(image_source, str):
+            with open(image_source, 'rb') as f:
+                return f.read(), image_source
+        if hasattr(image_source, 'read'):
+            return image_source.read(), getattr(image_source, 'name', None)
+        return image_source, None
+    
+    def _spool_image_source(self, image_source):
+        """Copy an image source into a temporary file in chunks while hashing it
+        
+        Returns (temp_file, sha256_hex, filename); the caller closes temp_file.
+        """
+        spooled = tempfile.TemporaryFile()
+        digest = hashlib.sha256()
+        filename = None
+        
+        def write(chunk):
+            digest.update(chunk)
+            spooled.write(chunk)
+        
+        try:
+            if is_url(image_source):
+                with span("comfyui.download"), self.transport.get(image_source, timeout=30, stream=True) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                        write(chunk)
+            elif isinstance(image_source, str):
+                with open(image_source, 'rb') as f:
+                    for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+                        write(chunk)
+            elif hasattr(image_source, 'read'):
+                filename = getattr(image_source, 'name', None)
+                for chunk in iter(lambda: image_source.read(STREAM_CHUNK_SIZE), b''):
+                    write(chunk)
+            else:
+                write(image_source)
+        except Exception:
+            spooled.close()
+            raise
+        
+        spooled.seek(0)
+        return spooled, digest.hexdigest(), filename
+    
+    def queue_prompt(self, workflow, client_id=None):
         """Queue workflow to ComfyUI"""
         try:
             payload = {"prompt": workflow}
+            if client_id:
+                payload["client_id"] = client_id
             
-            response = requests.post(
-                f"{self.base_url}/prompt",
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            
-            result = response.json()
+            with span("comfyui.queue", backend=self.base_url):
+                response = self.transport.post(
+                    f"{self.base_url}/prompt",
+                    json=payload,
+                    timeout=30
+                )
+                response.raise_for_status()
+                
+                result = response.json()
             return result.get('prompt_id')
             
         except Exception as e:
@@ -135,7 +315,7 @@ class ComfyUIClient:
     def get_history(self, prompt_id):
         """Get execution history for a prompt"""
         try:
-            response = requests.get(
+            response = self.transport.get(
                 f"{self.base_url}/history/{prompt_id}",
                 timeout=30
             )
@@ -145,9 +325,22 @@ class ComfyUIClient:
             
         except Exception as e:
             raise Exception(f"Failed to get history: {e}")
-    
-    def get_image(self, filename, subfolder="", folder_type="output"):
-        """Get processed image from ComfyUI"""
+
+    def get_queue_remaining(self, timeout=5):
+        """Number of prompts pending or running on this server, from GET /prompt"""
+        try:
+            response = self.transport.get(f"{self.base_url}/prompt", timeout=timeout)
+            response.raise_for_status()
+            return int(response.json().get("exec_info", {}).get("queue_remaining", 0))
+        except Exception as e:
+            raise Exception(f"Failed to get queue status: {e}")
+
+    def get_image(self, filename, subfolder="", folder_type="output", sink=None):
+        """Get processed image from ComfyUI
+        
+        Returns the image bytes, or when sink (a file path or writable file
+        object) is given, streams the download into it and returns sink.
+        """
         try:
             params = {
                 'filename': filename,
@@ -156,78 +349,538 @@ class ComfyUIClient:
             if subfolder:
                 params['subfolder'] = subfolder
             
-            response = requests.get(
-                f"{self.base_url}/view",
-                params=params,
-                timeout=30
-            )
-            response.raise_for_status()
+            with span("comfyui.fetch", backend=self.base_url):
+                if sink is None:
+                    response = self.transport.get(
+                        f"{self.base_url}/view",
+                        params=params,
+                        timeout=30
+                    )
+                    response.raise_for_status()
+                    
+                    return response.content
+                
+                with self.transport.get(f"{self.base_url}/view", params=params, timeout=30, stream=True) as response:
+                    response.raise_for_status()
+                    
+                    if isinstance(sink, str):
+                        with open(sink, 'wb') as f:
+                            for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                                f.write(chunk)
+                    else:
+                        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                            sink.write(chunk)
             
-            return response.content
+            return sink
             
         except Exception as e:
             raise Exception(f"Failed to get image: {e}")
     
-    def wait_for_completion(self, prompt_id, timeout=300):
-        """Wait for workflow completion and return result images"""
-        start_time = time.time()
+    def open_event_socket(self, client_id):
+        """Open the ComfyUI /ws event stream for client_id, or None when unavailable"""
+        if not self.use_websocket:
+            return None
+        
+        try:
+            return websocket.create_connection(f"{websocket_url(self.base_url)}/ws?clientId={client_id}", timeout=10)
+        except Exception as e:
+            print(f"WebSocket unavailable, falling back to polling: {e}")
+            return None
+    
+    def resolve_template(self, template=None):
+        """Return a WorkflowTemplate from a template, a registered name, or the client default"""
+        if template is None:
+            return self.template
+        if isinstance(template, WorkflowTemplate):
+            return template
+        return get_template(template)
+    
+    def _check_history(self, prompt_id, output_node):
+        """Fetch history and extract output images, tolerating transient fetch errors"""
+        try:
+            history = self.get_history(prompt_id)
+        except Exception as e:
+            print(f"Error checking status: {e}")
+            return None
+        return extract_output_images(history, prompt_id, output_node)
+    
+    def _wait_via_websocket(self, ws, prompt_id, deadline, output_node):
+        """Wait for prompt completion using executing/executed events, None on deadline
         
-        while time.time() - start_time < timeout:
+        The first event of the prompt marks the end of its queue wait, so the
+        wait is split into comfyui.queue_wait and comfyui.execute spans.
+        """
+        # Events sent before the socket attached are lost, so check history once first
+        images = self._check_history(prompt_id, output_node)
+        if images:
+            return images
+        
+        waiting_since = time.perf_counter()
+        executing_since = None
+        
+        def finished(images):
+            if executing_since is not None:
+                record("comfyui.execute", time.perf_counter() - executing_since, backend=self.base_url)
+            return images
+        
+        while time.time() < deadline:
+            ws.settimeout(max(0.1, min(5.0, deadline - time.time())))
             try:
-                history = self.get_history(prompt_id)
-                
-                if prompt_id in history:
-                    history_item = history[prompt_id]
-                    
-                    # Check if execution is complete
-                    if 'outputs' in history_item:
-                        outputs = history_item['outputs']
-                        
-                        # Look for PreviewImage output (node 7)
-                        if "7" in outputs:
-                            preview_output = outputs["7"]
-                            if "images" in preview_output:
-                                return preview_output["images"]
-                
-                time.sleep(2)  # Wait 2 seconds before checking again
-                
-            except Exception as e:
-                print(f"Error checking status: {e}")
-                time.sleep(2)
+                message = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # Quiet socket: make sure we did not miss the finish event
+                images = self._check_history(prompt_id, output_node)
+                if images:
+                    return images
+                continue
+            
+            event_type, outcome = read_event(message, prompt_id, output_node)
+            if executing_since is None and event_type in ("execution_start", "executing", "executed"):
+                executing_since = time.perf_counter()
+                record("comfyui.queue_wait", executing_since - waiting_since, backend=self.base_url)
+            
+            if outcome is PROMPT_FINISHED:
+                images = self._check_history(prompt_id, output_node)
+                if images:
+                    return finished(images)
+                raise Exception("Workflow finished without output images")
+            if outcome:
+                return finished(outcome)
         
-        raise Exception(f"Workflow timeout after {timeout} seconds")
+        return None
     
-    def upscale_image(self, image_source):
-        """High-level method to upscale an image - supports URL, bytes, or file objects"""
-        try:
-            # Step 1: Upload image
-            uploaded_filename = self.upload_image(image_source)
+    def _wait_via_polling(self, prompt_id, deadline, output_node):
+        """Poll /history with adaptive backoff until the output node is ready, None on deadline"""
+        interval = self.poll_initial_interval
+        
+        while time.time() < deadline:
+            images = self._check_history(prompt_id, output_node)
+            if images:
+                return images
             
-            # Step 2: Prepare workflow
-            workflow = self.upscale_workflow.copy()
-            workflow["5"]["inputs"]["image"] = uploaded_filename
+            time.sleep(max(0, min(interval, deadline - time.time())))
+            interval = min(interval * self.poll_backoff, self.poll_max_interval)
+        
+        return None
+    
+    def wait_for_completion(self, prompt_id, timeout=300, ws=None, output_node=None):
+        """Wait for workflow completion and return result images
+        
+        Uses the websocket opened by open_event_socket() when given, and falls
+        back to polling /history if the socket is missing or drops. output_node
+        defaults to the client template's output node.
+        """
+        output_node = output_node or self.template.output_node
+        deadline = time.time() + timeout
+        images = None
+        
+        with span("comfyui.wait", backend=self.base_url):
+            if ws is not None:
+                try:
+                    images = self._wait_via_websocket(ws, prompt_id, deadline, output_node)
+                except (websocket.WebSocketException, OSError) as e:
+                    print(f"WebSocket lost, falling back to polling: {e}")
             
-            # Step 3: Queue workflow
-            prompt_id = self.queue_prompt(workflow)
+            if images is None:
+                images = self._wait_via_polling(prompt_id, deadline, output_node)
+            
+            if images is None:
+                raise Exception(f"Workflow timeout after {timeout} seconds")
+        
+        return images
+    
+    def _build_upscale_workflow(self, uploaded_filename, template=None):
+        """Instantiate a fresh upscale workflow bound to an uploaded image"""
+        return self.resolve_template(template).instantiate(input_image=uploaded_filename)
+    
+    def _fetch_first_image(self, result_images, sink=None):
+        """Download the first output image of a finished workflow"""
+        if not result_images:
+            raise Exception("No output images found")
+        
+        first_image = result_images[0]
+        return self.get_image(
+            first_image["filename"],
+            first_image.get("subfolder", ""),
+            first_image.get("type", "output"),
+            sink=sink
+        )
+    
+    def _wait_and_fetch(self, prompt_id, client_id, timeout=300, output_node=None, sink=None):
+        """Attach to a queued job's event stream, wait for it and download the result (into sink if given)"""
+        ws = self.open_event_socket(client_id)
+        try:
+            result_images = self.wait_for_completion(prompt_id, timeout, ws=ws, output_node=output_node)
+        finally:
+            if ws is not None:
+                ws.close()
+        return self._fetch_first_image(result_images, sink)
+    
+    def _max_input_edge(self, template):
+        """Longest input edge that keeps the result within max_output_edge, or None"""
+        if not self.max_output_edge:
+            return None
+        return max(1, self.max_output_edge // max(1, template.scale))
+    
+    def _upload_params(self, template):
+        """Upload settings that change the result, folded into cache keys"""
+        if not self.normalize:
+            return {}
+        return {"normalize": True, "max_input_edge": self._max_input_edge(template)}
+    
+    def _upload_source(self, image_source, template, filename=None):
+        """Upload an image source, normalizing it first when enabled"""
+        if not self.normalize:
+            if hasattr(image_source, 'read'):
+                if filename is None:
+                    filename = getattr(image_source, 'name', None)
+                return self.upload_image_from_file(image_source, filename if isinstance(filename, str) else None)
+            return self.upload_image(image_source)
+        
+        if isinstance(image_source, (bytes, bytearray)) or _is_seekable(image_source):
+            return self._upload_normalized(image_source, template)
+        
+        # URLs and one-way streams are spooled to disk in chunks, never read whole
+        spooled, _, _ = self._spool_image_source(image_source)
+        with spooled:
+            return self._upload_normalized(spooled, template)
+    
+    def _upload_normalized(self, image_source, template):
+        """Normalize image bytes or a seekable file (see image_normalizer) and stream the result up"""
+        with span("comfyui.normalize"):
+            normalized = normalize_image(image_source, self._max_input_edge(template))
+        filename = f"{uuid.uuid4().hex}.{normalized.extension}"
+        return self._post_image_stream(normalized.iter_chunks(STREAM_CHUNK_SIZE), filename, normalized.content_type)
+    
+    def _cache_key(self, template, image_bytes=None, content_hash=None):
+        """Cache key for an input under an upscale template"""
+        if content_hash is None:
+            content_hash = hashlib.sha256(image_bytes).hexdigest()
+        params = dict(template.cache_params(), **self._upload_params(template))
+        return self.cache.make_key_from_digest(content_hash, template.model_name, params)
+    
+    def _archive_result(self, result, image_source, template):
+        """Hand a finished upscale (bytes or a written file path) to the archive
+
+        Paths are passed through: the archive snapshots the file and hashes it
+        on its own worker, so the result is never read back on this thread.
+        """
+        if self.archive is None:
+            return
+        if not isinstance(result, (str, bytes, bytearray)):
+            return  # Streamed into the caller's file object; nothing to read back
+        self.archive.submit(
+            result, kind="upscaled", model=template.model_name,
+            source_url=image_source if is_url(image_source) else None
+        )
+    
+    def _run_upscale(self, uploaded_filename, sink=None, on_queued=None, template=None):
+        """Queue the upscale workflow for an uploaded image and return the result bytes (or sink)"""
+        template = self.resolve_template(template)
+        
+        # Prepare workflow
+        workflow = self._build_upscale_workflow(uploaded_filename, template)
+        
+        # Subscribe to events, then queue workflow
+        client_id = uuid.uuid4().hex
+        ws = self.open_event_socket(client_id)
+        try:
+            prompt_id = self.queue_prompt(workflow, client_id)
             
             if not prompt_id:
                 raise Exception("Failed to get prompt ID")
             
-            # Step 4: Wait for completion
-            result_images = self.wait_for_completion(prompt_id)
+            # Let callers record the prompt_id so the job can be reattached later
+            if on_queued is not None:
+                on_queued(prompt_id)
             
-            if not result_images:
-                raise Exception("No output images found")
+            # Wait for completion
+            result_images = self.wait_for_completion(prompt_id, ws=ws, output_node=template.output_node)
+        finally:
+            if ws is not None:
+                ws.close()
+        
+        # Get the first result image
+        return self._fetch_first_image(result_images, sink)
+    
+    def upscale_image(self, image_source, output=None, on_queued=None, template=None):
+        """High-level method to upscale an image - supports URL, bytes, or file objects
+        
+        Returns the result bytes, or when output (a file path or writable file
+        object) is given, streams the result into it and returns output, so
+        memory per job stays at a fixed buffer size. on_queued(prompt_id) is
+        called once the workflow is in ComfyUI's queue. template selects a
+        registered model (e.g. "realesrgan_x4"); defaults to the client's.
+        """
+        try:
+            template = self.resolve_template(template)
             
-            # Step 5: Get the first result image
-            first_image = result_images[0]
-            image_data = self.get_image(
-                first_image["filename"],
-                first_image.get("subfolder", ""),
-                first_image.get("type", "output")
-            )
+            with span("comfyui.upscale", backend=self.base_url, template=template.name):
+                if self.cache is None:
+                    result = self._run_upscale(self._upload_source(image_source, template), output, on_queued, template)
+                else:
+                    # Cached path: identical inputs share one result and one in-flight job
+                    spooled, content_hash, filename = self._spool_image_source(image_source)
+                    computed = []
+                    with spooled:
+                        def compute_into(path):
+                            computed.append(True)
+                            spooled.seek(0)
+                            self._run_upscale(self._upload_source(spooled, template, filename), path, on_queued, template)
+                        
+                        cached_path = self.cache.get_or_compute_path(
+                            self._cache_key(template, content_hash=content_hash),
+                            compute_into
+                        )
+                    count("upscale_cache", result="miss" if computed else "hit")
+                    result = self._deliver_file(cached_path, output)
             
-            return image_data
+            self._archive_result(result, image_source, template)
+            return result
+            
+        except Exception as e:
+            raise Exception(f"Upscale failed: {e}")
+    
+    def upscale_image_tiled(self, image_source, output=None, tile_size=512, overlap=32, max_workers=4,
+                            template=None, timeout=300, lease=None):
+        """Upscale a large image as overlapping tiles dispatched concurrently
+        
+        Each tile is a separate workflow, so several ComfyUI workers can share
+        one image and per-job VRAM stays bounded by the tile size. Tiles are
+        stitched with feather blending across the overlaps. Images that fit in
+        a single tile go through upscale_image(). Output handling matches
+        upscale_image().
+        
+        lease() is a context manager yielding the ComfyUIClient that runs one
+        workflow; ComfyUIPool passes its own so each tile goes to the
+        least-loaded backend. By default every tile runs on this client.
+        """
+        try:
+            lease = lease or (lambda: nullcontext(self))
+            template = self.resolve_template(template)
+            image_bytes, filename = self._read_image_source(image_source)
+            
+            with span("comfyui.normalize"):
+                if self.normalize:
+                    # Same orientation, color and size handling as a normalized single upload
+                    image, _, _ = prepare_image(image_bytes, self._max_input_edge(template))
+                else:
+                    with Image.open(BytesIO(image_bytes)) as opened:
+                        image = opened.copy()
+            
+            if image.width <= tile_size and image.height <= tile_size:
+                with lease() as client:
+                    return client.upscale_image(image_bytes, output, template=template)
+            image = image.convert("RGB")
             
+            computed = []
+            
+            def compute_into(path):
+                computed.append(True)
+                self._run_tiled(image, path, filename, tile_size, overlap, max_workers, template, timeout, lease)
+            
+            with span("comfyui.upscale_tiled", backend=self.base_url, template=template.name):
+                if self.cache is None:
+                    with tempfile.TemporaryDirectory() as directory:
+                        path = os.path.join(directory, "tiled.png")
+                        compute_into(path)
+                        result = self._deliver_file(path, output)
+                else:
+                    params = dict(template.cache_params(), tile_size=tile_size, overlap=overlap, **self._upload_params(template))
+                    key = self.cache.make_key_from_digest(hashlib.sha256(image_bytes).hexdigest(), template.model_name, params)
+                    cached_path = self.cache.get_or_compute_path(key, compute_into)
+                    count("upscale_cache", result="miss" if computed else "hit")
+                    result = self._deliver_file(cached_path, output)
+            
+            self._archive_result(result, image_source, template)
+            return result
+        
         except Exception as e:
-            raise Exception(f"Upscale failed: {e}") 
\ No newline at end of file
+            raise Exception(f"Tiled upscale failed: {e}")
+    
+    def _run_tiled(self, image, path, filename, tile_size, overlap, max_workers, template, timeout, lease):
+        """Upscale every tile of a decoded image and write the stitched PNG to path"""
+        boxes = plan_tiles(image.width, image.height, tile_size, overlap)
+        stem = filename.rsplit('.', 1)[0] if filename else "image"
+        
+        def upscale_tile(index):
+            x, y, w, h = boxes[index]
+            buffer = BytesIO()
+            image.crop((x, y, x + w, y + h)).save(buffer, "PNG")
+            
+            # Upload, queue, wait and fetch of one tile all go to the same leased client
+            with lease() as client:
+                uploaded_filename = client.upload_image_from_bytes(buffer.getvalue(), f"{stem}_tile_{index}.png")
+                
+                client_id = uuid.uuid4().hex
+                ws = client.open_event_socket(client_id)
+                try:
+                    prompt_id = client.queue_prompt(client._build_upscale_workflow(uploaded_filename, template), client_id)
+                    if not prompt_id:
+                        raise Exception("Failed to get prompt ID")
+                    result_images = client.wait_for_completion(prompt_id, timeout, ws=ws, output_node=template.output_node)
+                finally:
+                    if ws is not None:
+                        ws.close()
+                
+                tile_bytes = client._fetch_first_image(result_images)
+            
+            with Image.open(BytesIO(tile_bytes)) as tile:
+                return tile.convert("RGB")
+        
+        # Finished rows are written as they are blended, so only the current tile row
+        # and tiles that arrived ahead of it are held in memory
+        with open(path, 'wb') as f, ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(boxes)))) as executor:
+            writer = PNGStripeWriter(f, image.width * template.scale, image.height * template.scale)
+            stitcher = TileStitcher(image.width, image.height, template.scale, tile_size, overlap, writer.write_rows)
+            
+            # Each tile runs in a copy of the caller's context so its spans join the caller's trace
+            futures = {
+                executor.submit(contextvars.copy_context().run, upscale_tile, index): index
+                for index in range(len(boxes))
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    tile = future.result()
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    raise Exception(f"Tile {index + 1}/{len(boxes)} failed: {e}")
+                with span("comfyui.stitch"):
+                    stitcher.add(boxes[index], tile)
+            
+            with span("comfyui.stitch"):
+                stitcher.finish()
+                writer.close()
+    
+    def _deliver_file(self, path, output=None):
+        """Return a result file's bytes, or copy it into output (path or file object)"""
+        if output is None:
+            with open(path, 'rb') as f:
+                return f.read()
+        
+        with open(path, 'rb') as src:
+            if isinstance(output, str):
+                with open(output, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, STREAM_CHUNK_SIZE)
+            else:
+                shutil.copyfileobj(src, output, STREAM_CHUNK_SIZE)
+        return output
+    
+    def resume_upscale(self, prompt_id, output=None, timeout=300, template=None):
+        """Reattach to an already queued upscale job by prompt_id and fetch its result"""
+        try:
+            # The original event socket is gone, so wait by polling history
+            template = self.resolve_template(template)
+            result_images = self.wait_for_completion(prompt_id, timeout, output_node=template.output_node)
+            result = self._fetch_first_image(result_images, output)
+            self._archive_result(result, None, template)
+            return result
+        except Exception as e:
+            raise Exception(f"Resume upscale failed: {e}")
+    
+    def _prepare_batch_item(self, image_source, template, output=None):
+        """Return (cache_key, cached_result, uploaded_filename) for one batch input
+        
+        A cache hit is returned as bytes, or copied into output when given.
+        """
+        if self.cache is None:
+            return None, None, self._upload_source(image_source, template)
+        
+        image_bytes, filename = self._read_image_source(image_source)
+        key = self._cache_key(template, image_bytes)
+        cached_path = self.cache.store.get_path(key)
+        if cached_path is not None:
+            try:
+                return key, self._deliver_file(cached_path, output), None
+            except OSError:
+                pass  # Evicted since the lookup; upscale it again
+        if self.normalize:
+            return key, None, self._upload_normalized(image_bytes, template)
+        return key, None, self.upload_image_from_bytes(image_bytes, filename)
+    
+    def _fetch_batch_result(self, prompt_id, client_id, timeout, template, key, output):
+        """Wait for one queued batch job and return its bytes, or stream it into output; cached under key"""
+        if key is None or output is None:
+            image_data = self._wait_and_fetch(prompt_id, client_id, timeout, template.output_node, output)
+            if key is not None:
+                self.cache.put(key, image_data)
+            return image_data
+        
+        # Download into the cache once, then copy into the caller's output
+        tmp_path = self.cache.store.temp_path()
+        try:
+            self._wait_and_fetch(prompt_id, client_id, timeout, template.output_node, tmp_path)
+            cached_path = self.cache.store.put_file(key, tmp_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._deliver_file(cached_path, output)
+    
+    def upscale_batch(self, image_sources, max_workers=4, timeout=300, template=None, outputs=None):
+        """Upscale several images, yielding results as each one completes
+        
+        All inputs are uploaded concurrently and every workflow is queued up
+        front so ComfyUI's queue stays full. Yields dicts in completion order:
+        {"index": int, "image_data": bytes or None, "error": str or None}.
+        outputs, one file path or writable file object per source, streams each
+        result into its output instead; image_data is then that output.
+        """
+        sources = list(image_sources)
+        outputs = list(outputs) if outputs is not None else [None] * len(sources)
+        template = self.resolve_template(template)
+        
+        # Step 1: Upload all inputs concurrently, serving cache hits right away
+        uploads = run_bounded(
+            lambda index: self._prepare_batch_item(sources[index], template, outputs[index]),
+            range(len(sources)), max_workers
+        )
+        
+        # Step 2: Queue every workflow before waiting on any of them
+        jobs = {}
+        for upload in uploads:
+            index = upload["index"]
+            if upload["error"]:
+                yield {"index": index, "image_data": None, "error": f"Upload failed: {upload['error']}"}
+                continue
+            
+            key, cached, uploaded_filename = upload["result"]
+            if cached is not None:
+                yield {"index": index, "image_data": cached, "error": None}
+                continue
+            
+            client_id = uuid.uuid4().hex
+            try:
+                prompt_id = self.queue_prompt(self._build_upscale_workflow(uploaded_filename, template), client_id)
+                if not prompt_id:
+                    raise Exception("Failed to get prompt ID")
+            except Exception as e:
+                yield {"index": index, "image_data": None, "error": str(e)}
+                continue
+            
+            jobs[index] = (prompt_id, client_id, key)
+        
+        if not jobs:
+            return
+        
+        # Step 3: Wait for the queued jobs and hand back each one as it finishes
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run, self._fetch_batch_result,
+                    prompt_id, client_id, timeout, template, key, outputs[index]
+                ): index
+                for index, (prompt_id, client_id, key) in jobs.items()
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    image_data = future.result()
+                except Exception as e:
+                    yield {"index": index, "image_data": None, "error": f"Upscale failed: {e}"}
+                    continue
+                
+                self._archive_result(image_data, sources[index], template)
+                yield {"index": index, "image_data": image_data, "error": None}
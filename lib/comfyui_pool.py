@@ -0,0 +1,211 @@
+# coding:utf-8
+import contextvars
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from lib.comfyui_client import ComfyUIClient
+
+
+class Backend:
+    """One ComfyUI server in the pool plus its last known load and health"""
+
+    def __init__(self, client):
+        self.client = client
+        self.healthy = True
+        self.failures = 0
+        self.queue_remaining = 0
+        self.in_flight = 0
+        self.last_failure = 0.0
+
+    @property
+    def base_url(self):
+        return self.client.base_url
+
+    @property
+    def load(self):
+        # Jobs routed here already show up in the server queue after the next
+        # check, so adding the two would count them twice
+        return max(self.queue_remaining, self.in_flight)
+
+
+class ComfyUIPool:
+    """Routes upscale jobs across several ComfyUI servers
+
+    Each job is leased to the healthy backend with the smallest queue, and all
+    of its calls (upload, queue, history, /view) go through that backend's
+    client. A background thread polls every backend's queue depth and takes
+    servers that keep failing out of rotation until they answer again; when
+    none is healthy, jobs still go to the least recently failed one.
+
+    Exposes the same upscale methods as ComfyUIClient, so pages and the
+    pipeline can use a pool wherever they used a single client.
+    """
+
+    def __init__(self, base_urls, health_check_interval=10, max_failures=2, **client_kwargs):
+        urls = [url.strip() for url in base_urls if url and url.strip()]
+        if not urls:
+            raise Exception("At least one ComfyUI base URL is required")
+
+        self.backends = [Backend(ComfyUIClient(url, **client_kwargs)) for url in urls]
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+        self._health_thread = None
+        if health_check_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_loop, name="comfyui-health", daemon=True)
+            self._health_thread.start()
+
+    @property
+    def template(self):
+        return self.backends[0].client.template
+
+    def check_health(self):
+        """Refresh queue depth and health of every backend once"""
+        for backend in self.backends:
+            try:
+                queue_remaining = backend.client.get_queue_remaining()
+            except Exception as e:
+                with self._lock:
+                    backend.failures += 1
+                    backend.last_failure = time.monotonic()
+                    if backend.healthy and backend.failures >= self.max_failures:
+                        backend.healthy = False
+                        print(f"ComfyUI backend {backend.base_url} out of rotation: {e}")
+                continue
+
+            with self._lock:
+                if not backend.healthy:
+                    print(f"ComfyUI backend {backend.base_url} back in rotation")
+                backend.healthy = True
+                backend.failures = 0
+                backend.queue_remaining = queue_remaining
+
+    def _health_loop(self):
+        while not self._stop.is_set():
+            self.check_health()
+            self._stop.wait(self.health_check_interval)
+
+    def close(self):
+        """Stop the health check thread"""
+        self._stop.set()
+
+    def status(self):
+        """Snapshot of every backend, for display"""
+        with self._lock:
+            return [
+                {
+                    "base_url": backend.base_url,
+                    "healthy": backend.healthy,
+                    "queue_remaining": backend.queue_remaining,
+                    "in_flight": backend.in_flight
+                }
+                for backend in self.backends
+            ]
+
+    def _acquire(self):
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy]
+            if candidates:
+                backend = min(candidates, key=lambda candidate: candidate.load)
+            else:
+                # Health checks may be stale or the outage brief; a failed job beats refusing all work
+                backend = min(self.backends, key=lambda candidate: candidate.last_failure)
+            backend.in_flight += 1
+            return backend
+
+    def _release(self, backend):
+        with self._lock:
+            backend.in_flight -= 1
+
+    @contextmanager
+    def lease(self):
+        """Pin a job to the least-loaded healthy backend; yields its ComfyUIClient"""
+        backend = self._acquire()
+        try:
+            yield backend.client
+        finally:
+            self._release(backend)
+
+    def client_for(self, base_url):
+        """Return the client of a specific backend, e.g. the one that owns a queued job"""
+        base_url = (base_url or "").rstrip('/')
+        for backend in self.backends:
+            if backend.base_url == base_url:
+                return backend.client
+        raise Exception(f"ComfyUI backend {base_url} is not configured")
+
+    def upscale_image(self, image_source, output=None, on_queued=None, template=None):
+        """ComfyUIClient.upscale_image() on the least-loaded backend"""
+        with self.lease() as client:
+            return client.upscale_image(image_source, output, on_queued, template)
+
+    def upscale_image_tiled(self, image_source, output=None, tile_size=512, overlap=32, max_workers=4,
+                            template=None, timeout=300):
+        """ComfyUIClient.upscale_image_tiled() with each tile leased to the least-loaded backend
+
+        Reading, normalizing, stitching and the cache run on the caller's
+        thread; only the tile workflows are spread over the pool.
+        """
+        return self.backends[0].client.upscale_image_tiled(
+            image_source, output, tile_size, overlap, max_workers, template, timeout, lease=self.lease
+        )
+
+    def resume_upscale(self, prompt_id, output=None, timeout=300, template=None, base_url=None):
+        """Reattach to a queued job on the backend that owns it"""
+        client = self.client_for(base_url) if base_url else self.backends[0].client
+        return client.resume_upscale(prompt_id, output, timeout, template)
+
+    def upscale_batch(self, image_sources, max_workers=4, timeout=300, template=None, outputs=None):
+        """Spread a batch over the backends, yielding results in completion order
+
+        Each image is leased to a backend up front; every backend then runs its
+        share through ComfyUIClient.upscale_batch() so its queue fills at once.
+        Yields the same dicts as ComfyUIClient.upscale_batch(); outputs are
+        split with their sources.
+        """
+        sources = list(image_sources)
+        outputs = list(outputs) if outputs is not None else None
+        if not sources:
+            return
+
+        # Assign images one at a time so in-flight counts balance the split
+        groups = {}
+        try:
+            for index in range(len(sources)):
+                backend = self._acquire()
+                groups.setdefault(backend, []).append(index)
+        except Exception:
+            for backend, indices in groups.items():
+                for _ in indices:
+                    self._release(backend)
+            raise
+
+        results = queue.Queue()
+
+        def run_group(backend, indices):
+            pending = set(range(len(indices)))
+            try:
+                for result in backend.client.upscale_batch(
+                    [sources[index] for index in indices], max_workers, timeout, template,
+                    [outputs[index] for index in indices] if outputs is not None else None
+                ):
+                    pending.discard(result["index"])
+                    self._release(backend)
+                    results.put(dict(result, index=indices[result["index"]]))
+            except Exception as e:
+                for local_index in pending:
+                    self._release(backend)
+                    results.put({"index": indices[local_index], "image_data": None, "error": str(e)})
+
+        # Groups run in copies of the caller's context so their spans join its trace
+        for backend, indices in groups.items():
+            threading.Thread(
+                target=contextvars.copy_context().run, args=(run_group, backend, indices), daemon=True
+            ).start()
+
+        for _ in range(len(sources)):
+            yield results.get()
@@ -0,0 +1,32 @@
+# coding:utf-8
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_bounded(func, items, max_workers=4):
+    """Run func over items with at most max_workers calls in flight.
+
+    Results keep the input order. Each entry is a dict with the item index,
+    the returned value (or None) and the error message (or None), so one
+    failing call never discards the results that already succeeded. Each
+    call runs in a copy of the caller's context (e.g. its metrics trace).
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, str(e)
+
+    max_workers = max(1, min(max_workers or 1, len(items)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call, item) for item in items]
+        outcomes = [future.result() for future in futures]
+
+    return [
+        {"index": index, "result": result, "error": error}
+        for index, (result, error) in enumerate(outcomes)
+    ]
@@ -0,0 +1,114 @@
+# coding:utf-8
+import os
+import tempfile
+import threading
+
+
+class DiskLRUCache:
+    """Byte blobs stored on disk by hex key, evicted least-recently-used past a size limit
+
+    Recency is tracked through file mtimes, which are refreshed on every hit,
+    so the cache survives restarts and can be shared by several processes.
+    """
+
+    def __init__(self, cache_dir, max_bytes, suffix=".bin"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path_for(self, key):
+        """Return the file path for key (sharded by the first two hex chars)"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def get_path(self, key):
+        """Return the cached file path for key and mark it recently used, or None"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def temp_path(self):
+        """Return a fresh temporary file path inside the cache directory"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        return tmp_path
+
+    def put_file(self, key, src_path):
+        """Move an already written file into the cache under key, then evict"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+
+        self.evict(keep=path)
+        return path
+
+    def put(self, key, data):
+        """Store bytes for key atomically, then evict down to max_bytes"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Delete least-recently-used entries until the cache fits in max_bytes
+
+        keep is the path just stored, which is never deleted here: callers
+        still have to read it. An entry larger than max_bytes therefore stays
+        until the next store evicts it.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    if not name.endswith(self.suffix):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,160 @@
+# coding:utf-8
+import hashlib
+import struct
+from io import BytesIO
+
+from lib.http_transport import get_transport
+
+
+# Enough bytes to reach the size fields of PNG/GIF/WEBP and of most JPEGs
+HEADER_PROBE_BYTES = 64 * 1024
+
+# JPEG start-of-frame markers that carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+FORMAT_CONTENT_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "GIF": "image/gif"
+}
+
+
+def _probe_jpeg(header):
+    """Walk JPEG segments up to the first SOF marker"""
+    offset = 2
+    while offset + 9 <= len(header):
+        if header[offset] != 0xFF:
+            return None
+        marker = header[offset + 1]
+        if marker == 0xFF:
+            offset += 1  # Fill byte
+            continue
+        if marker in (0x01,) or 0xD0 <= marker <= 0xD9:
+            offset += 2  # Standalone marker without length
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", header[offset + 5:offset + 9])
+            return "JPEG", width, height
+        segment_length = struct.unpack(">H", header[offset + 2:offset + 4])[0]
+        offset += 2 + segment_length
+    return None
+
+
+def _probe_webp(header):
+    """Read dimensions from the first WEBP chunk (lossy, lossless or extended)"""
+    chunk = header[12:16]
+    if chunk == b"VP8 " and len(header) >= 30:
+        width, height = struct.unpack("<HH", header[26:30])
+        return "WEBP", width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(header) >= 25:
+        b0, b1, b2, b3 = header[21:25]
+        width = 1 + (((b1 & 0x3F) << 8) | b0)
+        height = 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+        return "WEBP", width, height
+    if chunk == b"VP8X" and len(header) >= 30:
+        width = 1 + int.from_bytes(header[24:27], "little")
+        height = 1 + int.from_bytes(header[27:30], "little")
+        return "WEBP", width, height
+    return None
+
+
+def is_url(source):
+    """True for http(s) URLs; other strings passed as image sources are local file paths"""
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+def probe_image_header(header):
+    """Return (format, width, height) from the leading bytes of an image, or None
+
+    Only the header is parsed; the pixel data is never decoded.
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n") and len(header) >= 24:
+        width, height = struct.unpack(">II", header[16:24])
+        return "PNG", width, height
+    if header[:6] in (b"GIF87a", b"GIF89a") and len(header) >= 10:
+        width, height = struct.unpack("<HH", header[6:10])
+        return "GIF", width, height
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return _probe_webp(header)
+    if header[:2] == b"\xff\xd8":
+        return _probe_jpeg(header)
+    return None
+
+
+class FetchedImage:
+    """An image downloaded once and reused for validation, metadata and upload"""
+
+    def __init__(self, data, content_type="", filename=None):
+        self.data = data
+        self.filename = filename
+
+        probed = probe_image_header(data[:HEADER_PROBE_BYTES])
+        self.format, self.width, self.height = probed if probed else (None, None, None)
+
+        # Trust the bytes over the declared header when they disagree
+        self.content_type = FORMAT_CONTENT_TYPES.get(self.format, content_type.split(";")[0].strip().lower())
+
+    @classmethod
+    def from_url(cls, url, transport=None, timeout=30):
+        """Download an image URL in a single GET"""
+        try:
+            response = (transport or get_transport()).get(url, timeout=timeout)
+            response.raise_for_status()
+        except Exception as e:
+            raise Exception(f"Failed to fetch image: {e}")
+
+        filename = url.split("?")[0].rstrip("/").split("/")[-1] or None
+        return cls(response.content, response.headers.get("content-type", ""), filename)
+
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        """Wrap a Streamlit UploadedFile (or any file-like object) without re-reading it later"""
+        if hasattr(uploaded_file, "getvalue"):
+            data = uploaded_file.getvalue()
+        else:
+            data = uploaded_file.read()
+        return cls(data, getattr(uploaded_file, "type", "") or "", getattr(uploaded_file, "name", None))
+
+    @property
+    def is_image(self):
+        """True when the bytes are a recognized image or the server declared an image type"""
+        return self.format is not None or self.content_type.startswith("image/")
+
+    @property
+    def digest(self):
+        """sha256 of the image bytes, identifying the input across reruns"""
+        if getattr(self, "_digest", None) is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def size_mb(self):
+        return len(self.data) / (1024 * 1024)
+
+    @property
+    def extension(self):
+        """File extension matching the actual image format"""
+        if self.format:
+            return self.format.lower()
+        if self.filename and "." in self.filename:
+            return self.filename.rsplit(".", 1)[-1].lower()
+        return "jpeg"
+
+    def info(self):
+        """Image dimensions and format info, in the shape the pages display"""
+        if self.format is None:
+            return {"error": "Unrecognized image format"}
+        return {
+            "width": self.width,
+            "height": self.height,
+            "format": self.format,
+            "size_mb": self.size_mb
+        }
+
+    def as_file(self):
+        """Fresh file-like view of the bytes, named so uploads keep the right extension"""
+        stem = self.filename.rsplit(".", 1)[0] if self.filename else "image"
+        file_obj = BytesIO(self.data)
+        file_obj.name = f"{stem}.{self.extension}"
+        return file_obj
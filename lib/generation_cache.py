@@ -0,0 +1,131 @@
+# coding:utf-8
+import hashlib
+import json
+import threading
+
+from lib.disk_cache import DiskLRUCache
+from lib.http_transport import get_transport
+from lib.metrics import count
+from lib.singleflight import SingleFlight
+
+
+# Request fields that change how results are returned, not which images are generated
+RESPONSE_FIELDS = ("return_url",)
+
+
+class GenerationCache:
+    """Image bytes of fixed-seed cv_process requests, keyed on the canonical request body
+
+    With a seed >= 0 the same body always yields the same images, so a
+    repeat is answered from disk without Volcengine latency or quota. Bytes
+    are stored rather than URLs, which expire. Both hits and misses return
+    local file paths.
+
+    An entry is its images under <key>_0, <key>_1, ... plus a small record
+    under <key> holding their count, written last. The LRU store evicts files
+    one by one, so an entry only counts as a hit while the record and every
+    image are present; a hit refreshes them all together.
+    """
+
+    def __init__(self, cache_dir="generation_cache", max_bytes=512 * 1024 * 1024, transport=None):
+        self.store = DiskLRUCache(cache_dir, max_bytes, suffix=".img")
+        self.flight = SingleFlight()
+        self.transport = transport or get_transport()
+
+    @staticmethod
+    def is_cacheable(request_body):
+        """Only fixed-seed requests that return URLs are deterministic and cacheable"""
+        seed = request_body.get("seed")
+        return isinstance(seed, int) and seed >= 0 and bool(request_body.get("return_url", True))
+
+    @staticmethod
+    def make_key(request_body):
+        """Key on every generation parameter: req_key, prompt, seed, scale, size, logo_info..."""
+        canonical = {name: value for name, value in request_body.items() if name not in RESPONSE_FIELDS}
+        body_json = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(body_json.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached image paths for key, or None unless the whole entry is present"""
+        record = self.store.get(key)
+        if record is None:
+            return None
+        try:
+            image_count = int(json.loads(record)["count"])
+        except (ValueError, KeyError, TypeError):
+            return None
+
+        paths = [self.store.get_path(f"{key}_{index}") for index in range(image_count)]
+        if not paths or None in paths:
+            return None  # Partly evicted; regenerate the whole entry
+        return paths
+
+    def put(self, key, urls):
+        """Download every image URL and store the entry under key; returns the paths"""
+        # Fetch all images first so a failed download never leaves a partial entry
+        images = []
+        for url in urls:
+            response = self.transport.get(url, timeout=60)
+            response.raise_for_status()
+            images.append(response.content)
+        for index, data in enumerate(images):
+            self.store.put(f"{key}_{index}", data)
+        self.store.put(key, json.dumps({"count": len(images)}).encode('utf-8'))
+
+        # Eviction runs after every write, so confirm the entry survived as a whole
+        paths = self.get(key)
+        if paths is None:
+            raise Exception(f"{len(images)} images do not fit in the generation cache")
+        return paths
+
+    def get_or_generate(self, request_body, generate):
+        """Return local paths for request_body, running generate() -> URLs once across identical requests"""
+        return self.get_or_generate_detailed(request_body, generate)[0]
+
+    def get_or_generate_detailed(self, request_body, generate):
+        """Like get_or_generate, but returns (paths, hit)
+
+        hit is False only for the call whose generate() actually ran; callers
+        that joined its flight or found the entry on disk spent no quota.
+        """
+        key = self.make_key(request_body)
+        paths = self.get(key)
+        count("generation_cache", result="miss" if paths is None else "hit")
+        if paths is not None:
+            return paths, True
+
+        generated = []
+
+        def run():
+            # A flight that finished just before we joined may have filled the cache
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+            generated.append(True)
+            urls = generate()
+            if not urls:
+                return []
+            try:
+                return self.put(key, urls)
+            except Exception as e:
+                raise Exception(f"Caching generated images failed: {e}")
+
+        paths = self.flight.do(key, run)
+        return paths, not generated
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_generation_cache():
+    """Return the process-wide cache configured in config.py, or None when disabled"""
+    global _default_cache
+
+    with _default_lock:
+        if _default_cache is None:
+            from config import GENERATION_CACHE_DIR, GENERATION_CACHE_MAX_MB
+            if GENERATION_CACHE_MAX_MB <= 0:
+                return None
+            _default_cache = GenerationCache(GENERATION_CACHE_DIR, GENERATION_CACHE_MAX_MB * 1024 * 1024)
+        return _default_cache
@@ -0,0 +1,96 @@
+# coding:utf-8
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# Methods that are safe to retry automatically
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE"])
+
+
+class HttpTransport:
+    """Pooled keep-alive HTTP sessions, one per host, sharing a single retry policy"""
+
+    def __init__(self, max_connections_per_host=10, max_retries=3, backoff_factor=0.5):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _build_session(self):
+        """Create a session with a bounded connection pool and retry policy"""
+        # Idempotent calls retry on connection errors and 429/5xx with exponential
+        # backoff; POST is only retried when the connection never got established
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_connections_per_host,
+            pool_block=True,
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session_for(self, url):
+        """Return the pooled session for the host of url"""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._build_session()
+                self._sessions[key] = session
+            return session
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pooled session for its host"""
+        return self.session_for(url).request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        """Close every pooled session"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_default_transport = None
+_default_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the process-wide shared transport, configured from config.py"""
+    global _default_transport
+
+    with _default_lock:
+        if _default_transport is None:
+            from config import HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_MAX_RETRIES
+            _default_transport = HttpTransport(
+                max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_retries=HTTP_MAX_RETRIES
+            )
+        return _default_transport
@@ -0,0 +1,345 @@
+# coding:utf-8
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from lib.fetched_image import HEADER_PROBE_BYTES, is_url, probe_image_header
+from lib.http_transport import get_transport
+
+
+# Eviction policies once the archive exceeds its quota
+EVICT_LEAST_RECENTLY_USED = "lru"
+EVICT_OLDEST = "oldest"
+
+EVICTION_ORDER = {
+    EVICT_LEAST_RECENTLY_USED: "last_access ASC",
+    EVICT_OLDEST: "created_at ASC"
+}
+
+EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp", "GIF": "gif"}
+
+# Read size when copying local files into the archive
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+class ImageArchive:
+    """Durable, content-addressed store for generated and upscaled images
+
+    Files live at <root>/<sha[:2]>/<sha>.<ext>, so an image saved twice is
+    stored once. A SQLite index in <root>/archive.db keeps one row per file
+    (size, dimensions, access times) and one row per archived image with its
+    prompt, seed, model and source URL for browsing and search. Past
+    max_bytes, whole files are evicted by least recent use or by age.
+    """
+
+    def __init__(self, root="archive", max_bytes=2 * 1024 * 1024 * 1024, eviction=EVICT_LEAST_RECENTLY_USED,
+                 max_workers=2, transport=None):
+        if eviction not in EVICTION_ORDER:
+            raise Exception(f"Unknown eviction policy {eviction}, expected one of: {', '.join(EVICTION_ORDER)}")
+
+        self.root = root
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.db_path = os.path.join(root, "archive.db")
+        self.transport = transport or get_transport()
+
+        # Downloads and writes run here so callers (page scripts, job workers) never wait on them
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="archive")
+        self._lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    format TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    access_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+                    kind TEXT NOT NULL,
+                    prompt TEXT,
+                    seed INTEGER,
+                    model TEXT,
+                    source_url TEXT,
+                    params TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_created ON images (created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_sha ON images (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_access ON blobs (last_access)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_created ON blobs (created_at)")
+
+    def _read_source(self, source):
+        """Return (reader, source_url) for image bytes, a URL or a local file path
+
+        reader(f) copies the image into the open file f. Local files are
+        streamed in chunks, never read whole.
+        """
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+            return (lambda f: f.write(data)), None
+        if is_url(source):
+            response = self.transport.get(source, timeout=60)
+            response.raise_for_status()
+            data = response.content
+            return (lambda f: f.write(data)), source
+
+        def copy(f):
+            with open(source, 'rb') as src:
+                shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+        return copy, None
+
+    def _stage(self, path):
+        """Snapshot a local file inside the archive directory so its owner may move or delete it
+
+        A hard link costs no copy; across filesystems the file is copied in chunks.
+        """
+        staged = os.path.join(self.root, f"{uuid.uuid4().hex}.staged")
+        try:
+            os.link(path, staged)
+        except OSError:
+            with open(path, 'rb') as src, open(staged, 'wb') as dst:
+                shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        return staged
+
+    def _write_temp(self, reader):
+        """Copy a source into a temporary file of the archive while hashing it
+
+        Returns (tmp_path, sha256, size, header).
+        """
+        digest = hashlib.sha256()
+        state = {"size": 0, "header": b""}
+
+        class HashingWriter:
+            def __init__(self, f):
+                self.f = f
+
+            def write(self, chunk):
+                digest.update(chunk)
+                if len(state["header"]) < HEADER_PROBE_BYTES:
+                    state["header"] += chunk[:HEADER_PROBE_BYTES - len(state["header"])]
+                state["size"] += len(chunk)
+                return self.f.write(chunk)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                reader(HashingWriter(f))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), state["size"], state["header"]
+
+    def _store_blob(self, tmp_path, sha256, header):
+        """Move tmp_path into place as the file for sha256, or drop it when already stored
+
+        Returns (path, format, width, height). Called with self._lock held.
+        """
+        probed = probe_image_header(header)
+        image_format, width, height = probed if probed else (None, None, None)
+        directory = os.path.join(self.root, sha256[:2])
+        path = os.path.join(directory, f"{sha256}.{EXTENSIONS.get(image_format, 'bin')}")
+
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            os.replace(tmp_path, path)
+        return path, image_format, width, height
+
+    def add(self, source, kind="generated", prompt=None, seed=None, model=None, source_url=None, params=None):
+        """Archive an image now and return its entry dict
+
+        source is image bytes, an http(s) URL or a local path. The same
+        content with the same kind and prompt is recorded once; adding it
+        again only refreshes its access time.
+        """
+        reader, fetched_url = self._read_source(source)
+        tmp_path, sha256, size, header = self._write_temp(reader)
+
+        # evict() deletes files under the same lock, so the file cannot vanish
+        # between the existence check, the move and the row that points at it
+        try:
+            with self._lock, closing(self._connect()) as conn, conn:
+                path, image_format, width, height = self._store_blob(tmp_path, sha256, header)
+                now = time.time()
+                conn.execute(
+                    "INSERT INTO blobs (sha256, path, size, format, width, height, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (sha256) DO UPDATE SET last_access = excluded.last_access",
+                    (sha256, path, size, image_format, width, height, now, now)
+                )
+                row = conn.execute(
+                    "SELECT id FROM images WHERE sha256 = ? AND kind = ? AND prompt IS ?", (sha256, kind, prompt)
+                ).fetchone()
+                if row is None:
+                    entry_id = conn.execute(
+                        "INSERT INTO images (sha256, kind, prompt, seed, model, source_url, params, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (sha256, kind, prompt, seed if seed is None or seed >= 0 else None, model,
+                         source_url or fetched_url, json.dumps(params, ensure_ascii=False) if params else None, now)
+                    ).lastrowid
+                else:
+                    entry_id = row["id"]
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict()
+        return self.get(entry_id)
+
+    def submit(self, source, **meta):
+        """Archive in the background; returns a Future of the entry. Failures are logged, never raised
+
+        A local file path is snapshotted before submit returns, so the caller
+        may rename or delete the file right away; hashing and copying it run
+        on the archive worker, in chunks.
+        """
+        staged = None
+        if isinstance(source, str) and not is_url(source):
+            try:
+                source = staged = self._stage(source)
+            except Exception as e:
+                print(f"Archiving image failed: {e}")
+                return self.executor.submit(lambda: None)
+
+        def run():
+            try:
+                return self.add(source, **meta)
+            except Exception as e:
+                print(f"Archiving image failed: {e}")
+                return None
+            finally:
+                if staged is not None and os.path.exists(staged):
+                    os.remove(staged)
+        return self.executor.submit(run)
+
+    def _select(self, where="", params=(), order="images.created_at DESC", limit=None, offset=0):
+        sql = (
+            "SELECT images.*, blobs.path, blobs.size, blobs.format, blobs.width, blobs.height, "
+            "blobs.last_access, blobs.access_count FROM images JOIN blobs ON blobs.sha256 = images.sha256"
+        )
+        if where:
+            sql += f" WHERE {where}"
+        sql += f" ORDER BY {order}"
+        if limit:
+            sql += " LIMIT ? OFFSET ?"
+            params = (*params, limit, offset)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        entries = []
+        for row in rows:
+            entry = dict(row)
+            entry["params"] = json.loads(entry["params"]) if entry["params"] else None
+            entries.append(entry)
+        return entries
+
+    def get(self, entry_id):
+        """Return one archived image by id, or None"""
+        entries = self._select("images.id = ?", (entry_id,))
+        return entries[0] if entries else None
+
+    def search(self, query=None, kind=None, limit=50, offset=0):
+        """Archived images newest first, optionally filtered by prompt substring and kind"""
+        clauses, params = [], []
+        if query:
+            clauses.append("images.prompt LIKE ?")
+            params.append(f"%{query}%")
+        if kind:
+            clauses.append("images.kind = ?")
+            params.append(kind)
+        return self._select(" AND ".join(clauses), tuple(params), limit=limit, offset=offset)
+
+    def touch(self, sha256):
+        """Mark a file as used (e.g. downloaded), which protects it under LRU eviction"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE blobs SET last_access = ?, access_count = access_count + 1 WHERE sha256 = ?",
+                (time.time(), sha256)
+            )
+
+    def stats(self):
+        """Totals for display: {"images", "files", "bytes", "max_bytes"}"""
+        with closing(self._connect()) as conn:
+            files, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            images = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return {"images": images, "files": files, "bytes": total, "max_bytes": self.max_bytes}
+
+    def prune(self, sha256):
+        """Drop the index rows of a file that is missing on disk; returns True if they were removed"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT path FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is None or os.path.exists(row["path"]):
+                return False
+            conn.execute("DELETE FROM images WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            return True
+
+    def evict(self):
+        """Delete files and their index rows until the archive fits in max_bytes"""
+        with self._lock, closing(self._connect()) as conn, conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            candidates = conn.execute(
+                f"SELECT sha256, path, size FROM blobs ORDER BY {EVICTION_ORDER[self.eviction]}"
+            ).fetchall()
+            for row in candidates:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(row["path"])
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                conn.execute("DELETE FROM images WHERE sha256 = ?", (row["sha256"],))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (row["sha256"],))
+                total -= row["size"]
+
+
+_default_archive = None
+_default_lock = threading.Lock()
+
+
+def get_image_archive():
+    """Return the process-wide archive configured in config.py, or None when disabled"""
+    global _default_archive
+
+    with _default_lock:
+        if _default_archive is None:
+            from config import ARCHIVE_DIR, ARCHIVE_EVICTION, ARCHIVE_MAX_MB
+            if ARCHIVE_MAX_MB <= 0:
+                return None
+            _default_archive = ImageArchive(ARCHIVE_DIR, ARCHIVE_MAX_MB * 1024 * 1024, ARCHIVE_EVICTION)
+        return _default_archive
@@ -0,0 +1,351 @@
+# coding:utf-8
+from io import BytesIO
+
+import struct
+
+import numpy as np
+from PIL import Image, ImageOps
+
+try:
+    from PIL import ImageCms  # needs Pillow built with LittleCMS
+except ImportError:
+    ImageCms = None
+
+from lib.fetched_image import FORMAT_CONTENT_TYPES
+
+
+# Source formats whose pixels are already lossy; re-encoding them losslessly only adds bytes
+LOSSY_FORMATS = ("JPEG", "MPO")
+
+# JPEG segments dropped by strip_jpeg_metadata: APP1-APP13, APP15 (EXIF, XMP, ICC,
+# Photoshop, ...) and comments. APP0 (JFIF) and APP14 (Adobe color transform) are kept.
+JPEG_STRIP_MARKERS = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+JPEG_ICC_MARKER = 0xE2
+
+# PNG ancillary chunks dropped by strip_png_metadata; color chunks (gAMA, cHRM, sRGB) are kept
+PNG_STRIP_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf", b"tIME", b"iCCP"}
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Lossless WebP at the fastest effort: most of the size win of higher methods for
+# a fraction of the CPU, which would otherwise cost more than the upload saves
+WEBP_LOSSLESS_OPTIONS = {"lossless": True, "quality": 0, "method": 0}
+
+EXIF_ORIENTATION = 0x0112
+
+# Read size when copying kept byte ranges out of the source file
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+def _file_size(file):
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+def _add_range(ranges, start, end):
+    """Append [start, end), merging it into the previous range when they touch"""
+    if ranges and ranges[-1][1] == start:
+        ranges[-1] = (ranges[-1][0], end)
+    else:
+        ranges.append((start, end))
+
+
+def jpeg_metadata_ranges(file, keep_icc=False):
+    """Byte ranges of a JPEG file to keep when dropping its metadata segments
+
+    Only the segment headers are read; the entropy-coded data after the start
+    of scan is kept as one range. Returns None for malformed files.
+    """
+    size = _file_size(file)
+    if file.read(2) != b"\xff\xd8":
+        return None
+    strip = JPEG_STRIP_MARKERS - {JPEG_ICC_MARKER} if keep_icc else JPEG_STRIP_MARKERS
+
+    ranges = [(0, 2)]
+    offset = 2
+    while offset + 4 <= size:
+        file.seek(offset)
+        header = file.read(4)
+        if header[0] != 0xFF:
+            return None  # Malformed; leave it to the decoder
+        marker = header[1]
+        if marker == 0xDA:
+            # Start of scan: the rest is entropy-coded data
+            _add_range(ranges, offset, size)
+            return ranges
+        end = offset + 2 + int.from_bytes(header[2:4], "big")
+        if marker not in strip:
+            _add_range(ranges, offset, end)
+        offset = end
+    return None
+
+
+def png_metadata_ranges(file, keep_icc=False):
+    """Byte ranges of a PNG file to keep when dropping its text, EXIF, time and ICC chunks
+
+    Chunk headers are read and chunk bodies skipped with seeks, so IDAT data is
+    never loaded. Returns None for malformed or truncated files.
+    """
+    size = _file_size(file)
+    if file.read(8) != PNG_SIGNATURE:
+        return None
+    strip = PNG_STRIP_CHUNKS - {b"iCCP"} if keep_icc else PNG_STRIP_CHUNKS
+
+    ranges = [(0, 8)]
+    offset = 8
+    while offset + 12 <= size:
+        file.seek(offset)
+        length, tag = struct.unpack(">I4s", file.read(8))
+        end = offset + 12 + length
+        if end > size:
+            return None  # Truncated; leave it to the decoder
+        if tag not in strip:
+            _add_range(ranges, offset, end)
+        offset = end
+        if tag == b"IEND":
+            return ranges
+    return None
+
+
+def iter_ranges(file, ranges, chunk_size=COPY_CHUNK_SIZE):
+    """Yield the given byte ranges of file in chunks of at most chunk_size"""
+    for start, end in ranges:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def strip_jpeg_metadata(data, keep_icc=False):
+    """Drop metadata segments from a JPEG without touching the compressed pixels"""
+    file = BytesIO(data)
+    ranges = jpeg_metadata_ranges(file, keep_icc)
+    return data if ranges is None else b"".join(iter_ranges(file, ranges))
+
+
+def strip_png_metadata(data, keep_icc=False):
+    """Drop text, EXIF, time and ICC chunks from a PNG without recompressing it"""
+    file = BytesIO(data)
+    ranges = png_metadata_ranges(file, keep_icc)
+    return data if ranges is None else b"".join(iter_ranges(file, ranges))
+
+
+def _orientation(opened):
+    """EXIF orientation from the parsed header; getexif() would decode PNGs to find a late eXIf chunk"""
+    exif = opened.info.get("exif")
+    if not exif:
+        return 1
+    parsed = Image.Exif()
+    try:
+        parsed.load(exif)
+    except Exception:
+        return 1
+    return parsed.get(EXIF_ORIENTATION, 1)
+
+
+def _color_handling(icc, mode):
+    """What an embedded ICC profile needs, decided from the header alone
+
+    "convert": map the pixels to sRGB so the profile can be dropped.
+    "keep": the pixels stay as they are and the profile must travel with them
+    (no LittleCMS, an unreadable profile, or a mode such as CMYK that is not
+    converted here). None: no profile, or already sRGB.
+    """
+    if not icc:
+        return None
+    if ImageCms is None:
+        return "keep"
+    try:
+        if "srgb" in ImageCms.getProfileDescription(ImageCms.ImageCmsProfile(BytesIO(icc))).lower():
+            return None
+    except Exception:
+        return "keep"
+    return "convert" if mode in ("RGB", "RGBA") else "keep"
+
+
+def _to_srgb(image, icc):
+    """Convert RGB(A) pixels from an ICC profile to sRGB; returns (image, converted)"""
+    try:
+        source = ImageCms.ImageCmsProfile(BytesIO(icc))
+        return ImageCms.profileToProfile(image, source, ImageCms.createProfile("sRGB"), outputMode=image.mode), True
+    except Exception:
+        return image, False
+
+
+def _color_space(mode):
+    """Color space a mode's bands live in, ignoring alpha and palettes"""
+    if mode in ("P", "PA", "RGB", "RGBA", "RGBX"):
+        return "RGB"
+    return mode[:-1] if mode.endswith("A") else mode
+
+
+def _compact_mode(image, keep_color_space=False):
+    """Smallest mode that keeps every pixel: drop opaque alpha, collapse gray RGB
+
+    With keep_color_space, CMYK stays CMYK and gray RGB stays RGB, so an
+    embedded ICC profile still describes the bands.
+    """
+    convert = ("PA", "LA", "I", "I;16", "F", "YCbCr") if keep_color_space else ("PA", "LA", "I", "I;16", "F", "CMYK", "YCbCr")
+    if image.mode in convert:
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+
+    pixels = np.asarray(image)
+    if image.mode == "RGBA" and pixels[:, :, 3].min() == 255:
+        image, pixels = image.convert("RGB"), pixels[:, :, :3]
+    if not keep_color_space and image.mode == "RGB" and np.array_equal(pixels[:, :, 0], pixels[:, :, 1]) \
+            and np.array_equal(pixels[:, :, 1], pixels[:, :, 2]):
+        image = image.convert("L")
+    return image
+
+
+def _inspect(opened, max_edge):
+    """(rotate, resize, color) for a lazily opened image, from its header alone"""
+    rotate = _orientation(opened) != 1
+    resize = bool(max_edge) and max(opened.size) > max_edge
+    return rotate, resize, _color_handling(opened.info.get("icc_profile"), opened.mode)
+
+
+def _decode(opened, max_edge, rotate, resize, color):
+    """Decode and apply resize, EXIF rotation and sRGB conversion, only as needed
+
+    Returns (image, pixels_changed, icc_to_keep). The resize runs first, in
+    place, so JPEGs can be decoded at a reduced scale.
+    """
+    icc = opened.info.get("icc_profile")
+    image = opened
+    converted = False
+    if resize:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if rotate:
+        image = ImageOps.exif_transpose(image)
+    if color == "convert":
+        image, converted = _to_srgb(image, icc)
+        # A failed conversion leaves the pixels in the source space
+        color = None if converted else "keep"
+    return image, resize or rotate or converted, icc if color == "keep" else None
+
+
+def _as_file(image_source):
+    return BytesIO(image_source) if isinstance(image_source, (bytes, bytearray)) else image_source
+
+
+def prepare_image(image_source, max_edge=None):
+    """Decode an image (bytes or a seekable file): apply EXIF rotation, convert to sRGB, cap the longest edge
+
+    Returns (image, source_format, pixels_changed). pixels_changed is False when
+    the decoded pixels are exactly what the source already encodes.
+    """
+    opened = Image.open(_as_file(image_source))
+    source_format = opened.format
+    rotate, resize, color = _inspect(opened, max_edge)
+    image, changed, _ = _decode(opened, max_edge, rotate, resize, color)
+    if image is opened:
+        image.load()
+    else:
+        opened.close()
+    return image, source_format, changed
+
+
+def _encode(image, image_format, **options):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+class NormalizedImage:
+    """Image ready for upload, with the MIME type matching its bytes
+
+    Re-encoded images hold their bytes in data. Stripped images keep data as
+    None and are read from byte ranges of the source file, which must stay
+    open until iter_chunks() has been consumed.
+    """
+
+    def __init__(self, data, image_format, width, height, original_size, file=None, ranges=None):
+        self.data = data
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.original_size = original_size
+        self.file = file
+        self.ranges = ranges
+
+    @property
+    def content_type(self):
+        return FORMAT_CONTENT_TYPES.get(self.format, "application/octet-stream")
+
+    @property
+    def extension(self):
+        return "jpg" if self.format == "JPEG" else self.format.lower()
+
+    @property
+    def size(self):
+        if self.data is not None:
+            return len(self.data)
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def saved_bytes(self):
+        return self.original_size - self.size
+
+    def iter_chunks(self, chunk_size=COPY_CHUNK_SIZE):
+        """Yield the image bytes in chunks"""
+        if self.data is not None:
+            yield self.data
+        else:
+            yield from iter_ranges(self.file, self.ranges, chunk_size)
+
+
+def normalize_image(image_source, max_edge=None):
+    """Return an image (bytes or a seekable file) stripped of metadata, in a compact format, for upload
+
+    Orientation, ICC profile and size are read from the lazily opened header.
+    When none of them changes the pixels, JPEG and PNG files are only stripped
+    of their metadata segments: nothing is decoded or loaded beyond the segment
+    headers, and the result streams from the source file. Otherwise the image
+    is decoded and re-encoded: JPEG sources at visually lossless quality,
+    everything else as lossless WebP. An unchanged WebP source keeps its
+    original bytes when they are smaller than the re-encode; other formats
+    are always re-encoded once decoded. A profile that is not converted to
+    sRGB (CMYK, no LittleCMS, a failed conversion) is kept with the pixels.
+    """
+    file = _as_file(image_source)
+    original_size = _file_size(file)
+
+    with Image.open(file) as opened:
+        source_format = opened.format
+        width, height = opened.size
+        rotate, resize, color = _inspect(opened, max_edge)
+        changed = rotate or resize or color == "convert"
+
+        if not changed and source_format in LOSSY_FORMATS + ("PNG",):
+            find_ranges = png_metadata_ranges if source_format == "PNG" else jpeg_metadata_ranges
+            ranges = find_ranges(file, keep_icc=color == "keep")
+            if ranges is not None:
+                image_format = "PNG" if source_format == "PNG" else "JPEG"
+                return NormalizedImage(None, image_format, width, height, original_size, file=file, ranges=ranges)
+
+        image, changed, icc = _decode(opened, max_edge, rotate, resize, color)
+        space = _color_space(image.mode)
+        image = _compact_mode(image, keep_color_space=icc is not None)
+        if _color_space(image.mode) != space:
+            icc = None  # The bands moved to another color space; the profile no longer fits
+        options = {"icc_profile": icc} if icc else {}
+
+        # JPEG is also the only compact format that carries CMYK
+        if source_format in LOSSY_FORMATS or image.mode == "CMYK":
+            rgb = image.convert("RGB") if image.mode == "RGBA" else image
+            candidates = [("JPEG", _encode(rgb, "JPEG", quality=95, subsampling=0, **options))]
+        else:
+            candidates = [("WEBP", _encode(image, "WEBP", **WEBP_LOSSLESS_OPTIONS, **options))]
+
+        if not changed and source_format == "WEBP":
+            file.seek(0)
+            candidates.append((source_format, file.read()))
+
+        image_format, data = min(candidates, key=lambda candidate: len(candidate[1]))
+        return NormalizedImage(data, image_format, image.width, image.height, original_size)
@@ -0,0 +1,190 @@
+# coding:utf-8
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+FINISHED_STATES = (DONE, FAILED)
+
+
+class JobHandle:
+    """Passed to job functions so they can report progress such as the ComfyUI prompt_id"""
+
+    def __init__(self, manager, job_id, row=None):
+        self.manager = manager
+        self.id = job_id
+        self.row = row or {}
+
+    @property
+    def prompt_id(self):
+        return self.row.get("prompt_id")
+
+    @property
+    def params(self):
+        return self.row.get("params") or {}
+
+    def set_prompt_id(self, prompt_id):
+        self.row["prompt_id"] = prompt_id
+        self.manager._update(self.id, prompt_id=prompt_id)
+
+    def update_params(self, **fields):
+        """Merge fields into the stored params, e.g. which backend owns the job"""
+        params = dict(self.params, **fields)
+        self.row["params"] = params
+        self.manager._update(self.id, params=params)
+
+
+class JobManager:
+    """Process-wide background job runner backed by a small SQLite job table
+
+    Jobs outlive Streamlit reruns: pages keep only the job id and poll get().
+    Jobs left unfinished by a previous process can be picked up with recover().
+    """
+
+    def __init__(self, db_path="jobs.db", max_workers=4):
+        self.db_path = db_path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+        # Anything not finished at startup was interrupted by a previous process
+        self._orphans = [row for row in self.list_jobs(limit=None) if row["state"] not in FINISHED_STATES]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    prompt_id TEXT,
+                    params TEXT,
+                    result TEXT,
+                    result_paths TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state)")
+
+    def _update(self, job_id, **fields):
+        for key in ("params", "result", "result_paths"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    @staticmethod
+    def _row_to_dict(row):
+        job = dict(row)
+        for key in ("params", "result", "result_paths"):
+            if job.get(key):
+                job[key] = json.loads(job[key])
+        return job
+
+    def submit(self, kind, func, *args, params=None, **kwargs):
+        """Run func(job, *args, **kwargs) in the worker pool and return the job id
+
+        func returns a JSON-serializable result; a "paths" list in it is stored as
+        result_paths. params is stored with the job for display and recovery.
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, state, params, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(params or {}, ensure_ascii=False), time.time())
+            )
+
+        handle = JobHandle(self, job_id, {"params": params or {}})
+        self.executor.submit(self._run, handle, func, args, kwargs)
+        return job_id
+
+    def _run(self, handle, func, args, kwargs):
+        # Storing the result can fail too (a result that is not JSON-serializable,
+        # a locked database); the job is then marked failed rather than left running
+        try:
+            self._update(handle.id, state=RUNNING, started_at=time.time())
+            result = func(handle, *args, **kwargs)
+            paths = result.get("paths", []) if isinstance(result, dict) else []
+            self._update(handle.id, state=DONE, result=result, result_paths=paths, finished_at=time.time())
+        except Exception as e:
+            try:
+                self._update(handle.id, state=FAILED, error=str(e), finished_at=time.time())
+            except Exception as update_error:
+                print(f"Recording failure of job {handle.id} failed: {update_error}")
+
+    def get(self, job_id):
+        """Return the job row as a dict, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def list_jobs(self, kind=None, limit=50):
+        """Return recent jobs, newest first"""
+        sql = "SELECT * FROM jobs"
+        params = []
+        if kind:
+            sql += " WHERE kind = ?"
+            params.append(kind)
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def recover(self, kind, func=None):
+        """Resume jobs of this kind interrupted by a previous process
+
+        func(job) is run for each orphan with its stored prompt_id and params.
+        Without func the orphans are marked failed. Returns the affected job ids.
+        """
+        claimed = [row for row in self._orphans if row["kind"] == kind]
+        self._orphans = [row for row in self._orphans if row["kind"] != kind]
+
+        for row in claimed:
+            if func is None:
+                self._update(row["id"], state=FAILED, error="Interrupted by restart", finished_at=time.time())
+            else:
+                self.executor.submit(self._run, JobHandle(self, row["id"], row), func, (), {})
+        return [row["id"] for row in claimed]
+
+
+_default_manager = None
+_default_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, configured from config.py"""
+    global _default_manager
+
+    with _default_lock:
+        if _default_manager is None:
+            from config import JOB_DB_PATH, JOB_MAX_WORKERS
+            _default_manager = JobManager(JOB_DB_PATH, JOB_MAX_WORKERS)
+        return _default_manager
@@ -0,0 +1,288 @@
+# coding:utf-8
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in seconds: sub-second HTTP calls up to multi-minute GPU jobs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRIC_PREFIX = "poster"
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations, Prometheus style"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[position] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            pairs.append((bound, total))
+        pairs.append((float("inf"), self.count))
+        return pairs
+
+
+class Trace:
+    """Stage timings of one request, e.g. one upscale job or one page submit
+
+    Spans recorded while the trace is active (see trace()) are collected here,
+    including spans from worker threads that run in a copy of the context.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, status):
+        with self._lock:
+            self.spans.append((stage, seconds, status))
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown(self):
+        """Per-stage totals in first-seen order: [{"stage", "count", "seconds", "errors"}]
+
+        Stages that ran concurrently overlap, so the totals can exceed elapsed.
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        stages = {}
+        for stage, seconds, status in spans:
+            entry = stages.setdefault(stage, {"stage": stage, "count": 0, "seconds": 0.0, "errors": 0})
+            entry["count"] += 1
+            entry["seconds"] = round(entry["seconds"] + seconds, 4)
+            if status != "ok":
+                entry["errors"] += 1
+        return list(stages.values())
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class MetricsRegistry:
+    """Thread-safe stage histograms and event counters with Prometheus text output
+
+    Every span lands in one histogram family, labelled by stage, status and
+    any extra labels (such as the ComfyUI backend). Counters are named
+    freely, e.g. count("upscale_cache", result="hit").
+    """
+
+    def __init__(self, prefix=METRIC_PREFIX, buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _label_key(labels):
+        return tuple(sorted((key, str(value)) for key, value in labels.items() if value is not None))
+
+    def record(self, stage, seconds, status="ok", **labels):
+        """Record one finished stage: histogram, active trace and structured log"""
+        key = self._label_key(dict(labels, stage=stage, status=status))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+        current = _current_trace.get()
+        if current is not None:
+            current.add(stage, seconds, status)
+
+        if logger.isEnabledFor(logging.INFO):
+            event = dict(labels, stage=stage, seconds=round(seconds, 4), status=status)
+            if current is not None:
+                event["trace"] = current.id
+            logger.info(json.dumps(event, ensure_ascii=False, default=str))
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Time the enclosed block as stage; failures are recorded with status="error" and re-raised"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record(stage, time.perf_counter() - start, "error", **labels)
+            raise
+        self.record(stage, time.perf_counter() - start, "ok", **labels)
+
+    def count(self, name, value=1, **labels):
+        """Increment the counter <prefix>_<name>_total"""
+        key = (name, self._label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def snapshot(self):
+        """Plain-dict view of every histogram and counter, for logs or debugging"""
+        with self._lock:
+            return {
+                "stages": [
+                    dict(dict(key), count=histogram.count, sum=round(histogram.sum, 4))
+                    for key, histogram in self._histograms.items()
+                ],
+                "counters": [
+                    dict(dict(labels), name=name, value=value)
+                    for (name, labels), value in self._counters.items()
+                ]
+            }
+
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            histograms = [(key, histogram.cumulative(), histogram.sum, histogram.count)
+                          for key, histogram in sorted(self._histograms.items())]
+            counters = sorted(self._counters.items())
+
+        lines = []
+        family = f"{self.prefix}_stage_duration_seconds"
+        if histograms:
+            lines.append(f"# HELP {family} Time spent in each instrumented stage")
+            lines.append(f"# TYPE {family} histogram")
+        for key, buckets, total, count in histograms:
+            for bound, cumulative in buckets:
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{family}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+            lines.append(f"{family}_sum{_format_labels(key)} {total!r}")
+            lines.append(f"{family}_count{_format_labels(key)} {count}")
+
+        seen = set()
+        for (name, key), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs) + "}"
+
+
+# Process-wide registry used by the instrumented clients
+registry = MetricsRegistry()
+
+
+def span(stage, **labels):
+    """Time a block on the process-wide registry: `with span("comfyui.upload"): ...`"""
+    return registry.span(stage, **labels)
+
+
+def record(stage, seconds, status="ok", **labels):
+    """Record an already measured stage on the process-wide registry"""
+    registry.record(stage, seconds, status, **labels)
+
+
+def count(name, value=1, **labels):
+    """Increment a counter on the process-wide registry"""
+    registry.count(name, value, **labels)
+
+
+@contextmanager
+def trace(current=None):
+    """Collect the stage timings of everything run inside the block
+
+    Yields a Trace (pass an existing one to keep adding to it); worker threads
+    see it when started through contextvars.copy_context().run, as the
+    clients' thread pools do.
+    """
+    current = current or Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would flood the console
+
+
+def start_metrics_server(port, host="127.0.0.1", metrics_registry=None):
+    """Serve GET /metrics in Prometheus text format from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry or registry
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_server = None
+_configured = False
+_setup_lock = threading.Lock()
+
+
+def setup_metrics():
+    """Apply the config.py metrics settings once per process
+
+    METRICS_LOG_SPANS sends one JSON log line per span to stderr and
+    METRICS_PORT > 0 starts the scrape endpoint. Returns the server or None.
+    """
+    global _server, _configured
+
+    with _setup_lock:
+        if not _configured:
+            _configured = True
+            from config import METRICS_HOST, METRICS_LOG_SPANS, METRICS_PORT
+
+            if METRICS_LOG_SPANS and not logger.handlers:
+                handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+
+            if METRICS_PORT:
+                try:
+                    _server = start_metrics_server(METRICS_PORT, METRICS_HOST)
+                except OSError as e:
+                    print(f"Metrics server unavailable on {METRICS_HOST}:{METRICS_PORT}: {e}")
+        return _server
@@ -0,0 +1,79 @@
+# coding:utf-8
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def _upscale(comfyui_client, image_url, artifact_store=None):
+    """Upscale one image to bytes, or straight into a new artifact on disk"""
+    if artifact_store is None:
+        return comfyui_client.upscale_image(image_url)
+    return artifact_store.create(lambda path: comfyui_client.upscale_image(image_url, output=path))
+
+
+def generate_and_upscale(poster_generator, comfyui_client, prompt, count, width, height,
+                         generate_workers=4, upscale_workers=2, artifact_store=None):
+    """Generate poster images and upscale each one as soon as it exists
+
+    prompt is either one prompt for every image or a list with one prompt per
+    image (see PosterGenerator.generate_prompt_variants). Generation of later
+    images overlaps with upscaling of earlier ones. Yields
+    event dicts in the order things happen:
+    - {"stage": "generated", "index": i, "url": url}
+    - {"stage": "upscaled", "index": i, "url": url, "image_data": bytes}
+    - {"stage": "failed", "index": i, "url": url or None, "error": str}
+
+    With an artifact_store, results are streamed into artifacts instead and
+    "upscaled" events carry "artifact" in place of "image_data".
+
+    Work runs in copies of the caller's context, so an active metrics trace
+    collects the generation and upscale stages of every image.
+
+    Stopping early (closing the generator) cancels work that has not
+    started and returns without waiting for the images still in progress.
+    """
+    generate_pool = ThreadPoolExecutor(max_workers=max(1, generate_workers))
+    upscale_pool = ThreadPoolExecutor(max_workers=max(1, upscale_workers))
+    try:
+        pending = {}
+        for index in range(count):
+            future = generate_pool.submit(
+                contextvars.copy_context().run, poster_generator.generate_single_image,
+                prompt[index] if isinstance(prompt, (list, tuple)) else prompt, width, height
+            )
+            pending[future] = ("generate", index, None)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, index, url = pending.pop(future)
+
+                if stage == "generate":
+                    try:
+                        urls = future.result()
+                    except Exception as e:
+                        yield {"stage": "failed", "index": index, "url": None, "error": f"Image generation failed: {e}"}
+                        continue
+
+                    if not urls:
+                        yield {"stage": "failed", "index": index, "url": None, "error": "Image generation returned no image"}
+                        continue
+
+                    # Hand the image to the upscaler right away
+                    for image_url in urls:
+                        yield {"stage": "generated", "index": index, "url": image_url}
+                        upscale_future = upscale_pool.submit(
+                            contextvars.copy_context().run, _upscale, comfyui_client, image_url, artifact_store
+                        )
+                        pending[upscale_future] = ("upscale", index, image_url)
+                else:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        yield {"stage": "failed", "index": index, "url": url, "error": str(e)}
+                        continue
+
+                    field = "image_data" if artifact_store is None else "artifact"
+                    yield {"stage": "upscaled", "index": index, "url": url, field: result}
+    finally:
+        generate_pool.shutdown(wait=False, cancel_futures=True)
+        upscale_pool.shutdown(wait=False, cancel_futures=True)
@@ -1,23 +1,74 @@
 # coding:utf-8
 import requests
 import json
-from volcengine.visual.VisualService import VisualService
+import re
+import threading
+import time
+from lib.concurrency import run_bounded
+from lib.http_transport import get_transport
+from lib.metrics import count, record, span
+from lib.prompt_cache import PromptCache
+from lib.rate_limiter import get_volcengine_limiter
+from lib.singleflight import SingleFlight
+
+
+# System prompt that constrains Doubao to the poster description template
+POSTER_SYSTEM_PROMPT = "你是一个专业的红色年代海报设计师。请根据用户输入的内容，生成一个复古大字报风格的插画描述。格式必须是：'生成[合适的主体描述]作为主体，复古大字报风格的插画，背景是[相关背景元素]，底部是[相关标语]'。要体现红色年代的热情、团结、奋进精神，不要出现敏感内容如人民、革命等"
+
+# Every poster prompt must follow the template above; checked on variant responses
+POSTER_PROMPT_PATTERN = re.compile(r"^生成.+作为主体.*复古大字报风格")
+
+# Request fields recorded with each archived image
+ARCHIVED_PARAMS = ("width", "height", "scale", "use_pre_llm")
+
+# A ```json fenced block in a completion; its content is parsed in preference to the surrounding text
+CODE_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+# Fallback for variant responses without usable JSON: template-shaped phrases, one per line or quote
+VARIANT_TEXT_PATTERN = re.compile(r"生成[^\n\"“”]+?作为主体[^\n\"“”]*?复古大字报风格[^\n\"“”]*")
+
+# Extra instruction that turns one completion into several distinct prompts
+VARIANTS_INSTRUCTION = "请一次给出{count}个主体、背景与标语都明显不同的版本，每个版本都必须符合上述格式。只输出 JSON，不要输出其他内容：{{\"prompts\": [\"...\", \"...\"]}}"
 
 
 class PosterGenerator:
     """Red era poster generation service"""
     
-    def __init__(self, volcengine_ak, volcengine_sk, openai_api_key, openai_base_url, doubao_model):
-        # Initialize Visual Service
-        self.visual_service = VisualService()
-        self.visual_service.set_ak(volcengine_ak)
-        self.visual_service.set_sk(volcengine_sk)
+    def __init__(self, volcengine_ak, volcengine_sk, openai_api_key, openai_base_url, doubao_model, max_concurrency=4, transport=None, prompt_cache=None,
+                 archive=None, rate_limiter=None, generation_cache=None, visual_service_provider=None):
+        # Visual Service is created on first use; importing the SDK is slow. A
+        # visual_service_provider (e.g. the service registry's getter) supplies a
+        # shared client instead of a private one built from the keys.
+        self.volcengine_ak = volcengine_ak
+        self.volcengine_sk = volcengine_sk
+        self.visual_service_provider = visual_service_provider
+        self._visual_service = None
+        self._visual_service_lock = threading.Lock()
         
         # API configuration
         self.openai_api_key = openai_api_key
         self.openai_base_url = openai_base_url
         self.doubao_model = doubao_model
         
+        # Pooled keep-alive sessions for Doubao requests
+        self.transport = transport or get_transport()
+        
+        # Optional PromptCache; identical concurrent requests always share one call
+        self.prompt_cache = prompt_cache
+        self._prompt_flight = SingleFlight()
+        
+        # Maximum number of cv_process calls in flight per generate_images call
+        self.max_concurrency = max_concurrency
+        
+        # QPS and adaptive concurrency shared by every generator in the process; retries throttled calls
+        self.rate_limiter = rate_limiter or get_volcengine_limiter()
+        
+        # Optional GenerationCache: fixed-seed requests are served from local copies
+        self.generation_cache = generation_cache
+        
+        # Optional ImageArchive: generated images are saved in the background before their URLs expire
+        self.archive = archive
+        
         # Predefined aspect ratios and corresponding dimensions
         self.aspect_ratios = {
             "1:1 (正方形)": (1328, 1328),
@@ -27,8 +78,40 @@ class PosterGenerator:
             "21:9 (超宽屏)": (2016, 864)
         }
     
-    def generate_prompt(self, user_prompt):
-        """Use Doubao to generate poster-style prompt via direct HTTP request"""
+    @property
+    def visual_service(self):
+        """Volcengine VisualService, from the provider or built on first access"""
+        if self.visual_service_provider is not None:
+            return self.visual_service_provider()
+        with self._visual_service_lock:
+            if self._visual_service is None:
+                from volcengine.visual.VisualService import VisualService
+                visual_service = VisualService()
+                visual_service.set_ak(self.volcengine_ak)
+                visual_service.set_sk(self.volcengine_sk)
+                self._visual_service = visual_service
+            return self._visual_service
+    
+    def _build_prompt_payload(self, user_prompt):
+        """Build the chat completion payload for a user prompt"""
+        return {
+            "model": self.doubao_model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": POSTER_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": f"请为以下内容生成红色年代海报风格的提示词：{user_prompt}"
+                }
+            ],
+            "max_tokens": 200,
+            "temperature": 0.7
+        }
+    
+    def _request_prompt(self, payload):
+        """Send a chat completion request to Doubao and return the message content"""
         try:
             # Prepare request headers
             headers = {
@@ -36,71 +119,342 @@ class PosterGenerator:
                 "Authorization": f"Bearer {self.openai_api_key}"
             }
             
-            # Prepare request payload
-            payload = {
-                "model": self.doubao_model,
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "你是一个专业的红色年代海报设计师。请根据用户输入的内容，生成一个复古大字报风格的插画描述。格式必须是：'生成[合适的主体描述]作为主体，复古大字报风格的插画，背景是[相关背景元素]，底部是[相关标语]'。要体现红色年代的热情、团结、奋进精神，不要出现敏感内容如人民、革命等"
-                    },
-                    {
-                        "role": "user",
-                        "content": f"请为以下内容生成红色年代海报风格的提示词：{user_prompt}"
-                    }
-                ],
-                "max_tokens": 200,
-                "temperature": 0.7
+            with span("doubao.prompt"):
+                # Make HTTP request
+                response = self.transport.post(
+                    f"{self.openai_base_url}/chat/completions",
+                    headers=headers,
+                    json=payload,
+                    timeout=30
+                )
+                
+                # Check response status
+                response.raise_for_status()
+                
+                # Parse response
+                result = response.json()
+                return result["choices"][0]["message"]["content"].strip()
+            
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Network request failed: {e}")
+        except KeyError as e:
+            raise Exception(f"Response format error: {e}")
+        except Exception as e:
+            raise Exception(f"Generate prompt failed: {e}")
+    
+    def _build_variants_payload(self, user_prompt, variants):
+        """Build the chat completion payload asking for distinct prompts as JSON"""
+        payload = self._build_prompt_payload(user_prompt)
+        payload["messages"][0]["content"] = f"{POSTER_SYSTEM_PROMPT}。{VARIANTS_INSTRUCTION.format(count=variants)}"
+        payload["messages"][1]["content"] = f"请为以下内容生成{variants}个不同的红色年代海报风格提示词：{user_prompt}"
+        payload["max_tokens"] = 200 * variants
+        payload["temperature"] = 0.9
+        return payload
+    
+    @staticmethod
+    def _json_prompt_candidates(text):
+        """Return the prompt list of the first JSON object or list in text that has one, else []
+        
+        Decodes from each opening bracket in turn, so prose around the JSON
+        (including bracketed notes such as "[说明]") is skipped.
+        """
+        decoder = json.JSONDecoder()
+        for match in re.finditer(r"[\[{]", text):
+            try:
+                data, _ = decoder.raw_decode(text, match.start())
+            except ValueError:
+                continue
+            candidates = data.get("prompts") if isinstance(data, dict) else data
+            if isinstance(candidates, list) and any(isinstance(candidate, str) for candidate in candidates):
+                return candidates
+        return []
+    
+    @staticmethod
+    def parse_prompt_variants(content, variants):
+        """Extract up to `variants` distinct, template-conforming prompts from a JSON completion
+        
+        Accepts {"prompts": [...]} or a bare list, optionally inside a ```json
+        fence; prompts that do not match POSTER_PROMPT_PATTERN are dropped.
+        When no JSON yields a prompt, template-shaped phrases are picked out
+        of the plain text instead.
+        """
+        fenced = CODE_FENCE_PATTERN.search(content)
+        text = (fenced.group(1) if fenced else content).strip()
+        
+        prompts = []
+        for candidate in PosterGenerator._json_prompt_candidates(text):
+            if not isinstance(candidate, str):
+                continue
+            prompt = candidate.strip().strip('"“”')
+            if POSTER_PROMPT_PATTERN.match(prompt) and prompt not in prompts:
+                prompts.append(prompt)
+        
+        if not prompts:
+            for prompt in VARIANT_TEXT_PATTERN.findall(content):
+                prompt = prompt.strip().rstrip("，,；;")
+                if prompt not in prompts:
+                    prompts.append(prompt)
+        
+        if not prompts:
+            raise Exception("Response format error: no variant matches the poster prompt template")
+        return prompts[:variants]
+    
+    def generate_prompt_variants(self, user_prompt, variants, regenerate=False):
+        """Ask Doubao for several distinct poster prompts in one round trip
+        
+        Returns the valid, distinct prompts (possibly fewer than requested when
+        the model repeats itself or breaks the template). Cached like
+        generate_prompt(); regenerate=True asks for a fresh set.
+        """
+        if variants <= 1:
+            return [self.generate_prompt(user_prompt, regenerate)]
+        
+        payload = self._build_variants_payload(user_prompt, variants)
+        key = PromptCache.make_key(payload)
+        
+        if not regenerate and self.prompt_cache is not None:
+            cached = self.prompt_cache.get(key)
+            count("prompt_cache", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return list(cached)
+        
+        def request():
+            return self.parse_prompt_variants(self._request_prompt(payload), variants)
+        
+        if regenerate:
+            prompts = request()
+        else:
+            prompts = self._prompt_flight.do(key, request)
+        
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, prompts)
+        return list(prompts)
+    
+    def generate_prompt(self, user_prompt, regenerate=False):
+        """Use Doubao to generate poster-style prompt via direct HTTP request
+        
+        Results are served from the prompt cache when available; pass
+        regenerate=True to bypass it and ask for a fresh variant.
+        """
+        payload = self._build_prompt_payload(user_prompt)
+        key = PromptCache.make_key(payload)
+        
+        if regenerate:
+            result = self._request_prompt(payload)
+        else:
+            if self.prompt_cache is not None:
+                cached = self.prompt_cache.get(key)
+                count("prompt_cache", result="miss" if cached is None else "hit")
+                if cached is not None:
+                    return cached
+            result = self._prompt_flight.do(key, lambda: self._request_prompt(payload))
+        
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, result)
+        
+        return result
+    
+    def _stream_prompt(self, payload):
+        """Send a streaming chat completion request and yield content deltas
+        
+        Records doubao.first_token when the first delta arrives and
+        doubao.prompt_stream once the stream is fully read.
+        """
+        start = time.perf_counter()
+        first_token = False
+        status = "error"
+        try:
+            headers = {
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream",
+                "Authorization": f"Bearer {self.openai_api_key}"
             }
             
-            # Make HTTP request
-            response = requests.post(
+            response = self.transport.post(
                 f"{self.openai_base_url}/chat/completions",
                 headers=headers,
                 json=payload,
-                timeout=30
+                timeout=30,
+                stream=True
             )
             
-            # Check response status
-            response.raise_for_status()
-            
-            # Parse response
-            result = response.json()
-            return result["choices"][0]["message"]["content"].strip()
+            try:
+                response.raise_for_status()
+                # text/event-stream has no charset, requests would guess latin-1
+                response.encoding = 'utf-8'
+                
+                # Server-sent events: one "data: {json}" line per chunk, "data: [DONE]" at the end
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    chunk = json.loads(data)
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        if not first_token:
+                            first_token = True
+                            record("doubao.first_token", time.perf_counter() - start)
+                        yield delta
+                status = "ok"
+            finally:
+                response.close()
             
         except requests.exceptions.RequestException as e:
             raise Exception(f"Network request failed: {e}")
-        except KeyError as e:
+        except (KeyError, ValueError) as e:
             raise Exception(f"Response format error: {e}")
-        except Exception as e:
-            raise Exception(f"Generate prompt failed: {e}")
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        finally:
+            record("doubao.prompt_stream", time.perf_counter() - start, status)
     
-    def generate_images(self, prompt, count, width, height):
-        """Generate images using Volcengine API"""
-        try:
-            request_body = {
-                "req_key": "high_aes_general_v30l_zt2i",
-                "prompt": prompt,
-                "use_pre_llm": False,
-                "seed": -1,
-                "scale": 2.5,
-                "width": width,
-                "height": height,
-                "return_url": True,
+    def generate_prompt_stream(self, user_prompt, regenerate=False):
+        """Stream the poster prompt from Doubao, yielding text as it arrives
+        
+        The joined chunks equal generate_prompt()'s result; the final prompt is
+        cached as soon as the stream closes.
+        """
+        payload = self._build_prompt_payload(user_prompt)
+        key = PromptCache.make_key(payload)
+        
+        if not regenerate and self.prompt_cache is not None:
+            cached = self.prompt_cache.get(key)
+            count("prompt_cache", result="miss" if cached is None else "hit")
+            if cached is not None:
+                yield cached
+                return
+        
+        parts = []
+        for delta in self._stream_prompt(dict(payload, stream=True)):
+            parts.append(delta)
+            yield delta
+        
+        result = "".join(parts).strip()
+        if not result:
+            raise Exception("Generate prompt failed: empty response")
+        
+        if self.prompt_cache is not None:
+            self.prompt_cache.put(key, result)
+    
+    def _build_request_body(self, prompt, width, height, seed=-1):
+        """Build Volcengine request body for a single image"""
+        return {
+            "req_key": "high_aes_general_v30l_zt2i",
+            "prompt": prompt,
+            "use_pre_llm": False,
+            "seed": seed,
+            "scale": 2.5,
+            "width": width,
+            "height": height,
+            "return_url": True,
+        }
+    
+    def _cv_process(self, request_body):
+        """One cv_process attempt"""
+        with span("volcengine.cv_process"):
+            return self.visual_service.cv_process(request_body)
+    
+    def _generate_one(self, request_body):
+        """Return image URLs for one request, or local paths for fixed-seed requests when a generation cache is set"""
+        return self.generate_from_body(request_body)["urls"]
+    
+    def generate_from_body(self, request_body):
+        """Run one cv_process request body as given (e.g. with logo_info from a form)
+        
+        Returns {"urls": list, "cached": bool}. urls are local paths for
+        fixed-seed bodies when a generation cache is set; cached is True when
+        they came from it without a new cv_process call.
+        """
+        if self.generation_cache is not None and self.generation_cache.is_cacheable(request_body):
+            paths, hit = self.generation_cache.get_or_generate_detailed(request_body, lambda: self._request_images(request_body))
+            return {"urls": paths, "cached": hit}
+        return {"urls": self._request_images(request_body), "cached": False}
+    
+    def _request_images(self, request_body):
+        """Run cv_process through the rate limiter and return its image URLs"""
+        response = self.rate_limiter.call(self._cv_process, request_body)
+        if response.get("code") != 10000:
+            raise Exception(response.get("message"))
+        urls = response["data"].get("image_urls", [])
+        
+        if self.archive is not None:
+            for url in urls:
+                self.archive.submit(
+                    url, kind="generated", prompt=request_body["prompt"], seed=request_body.get("seed"),
+                    model=request_body.get("req_key"),
+                    params={name: request_body[name] for name in ARCHIVED_PARAMS if name in request_body}
+                )
+        return urls
+    
+    def generate_single_image(self, prompt, width, height, seed=-1):
+        """Generate one image and return its URLs"""
+        return self._generate_one(self._build_request_body(prompt, width, height, seed))
+    
+    def generate_images_detailed(self, prompt, count, width, height, max_workers=None, seed=-1):
+        """Generate images concurrently and return per-image results in order
+        
+        Each result is a dict: {"index": int, "urls": list, "error": str or None}.
+        With seed >= 0, image i uses seed + i, so repeating a call gives the
+        same images (served from the generation cache when one is set).
+        """
+        outcomes = run_bounded(
+            lambda index: self._generate_one(
+                self._build_request_body(prompt, width, height, seed + index if seed >= 0 else -1)
+            ),
+            range(count),
+            max_workers or self.max_concurrency
+        )
+        return [
+            {
+                "index": outcome["index"],
+                "urls": outcome["result"] or [],
+                "error": outcome["error"]
             }
-            
-            images = []
-            for i in range(count):
-                response = self.visual_service.cv_process(request_body)
-                if response.get("code") == 10000:
-                    generated_images = response["data"].get("image_urls", [])
-                    images.extend(generated_images)
-                else:
-                    raise Exception(f"Image {i+1} generation failed: {response.get('message')}")
-            
-            return images
-        except Exception as e:
-            raise Exception(f"Image generation failed: {e}")
+            for outcome in outcomes
+        ]
+    
+    def generate_variant_images_detailed(self, prompts, width, height, max_workers=None, seed=-1):
+        """Generate one image per prompt concurrently and return per-image results in order
+        
+        Each result is a dict: {"index": int, "prompt": str, "urls": list, "error": str or None}
+        """
+        outcomes = run_bounded(
+            lambda index: self._generate_one(
+                self._build_request_body(prompts[index], width, height, seed + index if seed >= 0 else -1)
+            ),
+            range(len(prompts)),
+            max_workers or self.max_concurrency
+        )
+        return [
+            {
+                "index": outcome["index"],
+                "prompt": prompts[outcome["index"]],
+                "urls": outcome["result"] or [],
+                "error": outcome["error"]
+            }
+            for outcome in outcomes
+        ]
+    
+    def generate_images(self, prompt, count, width, height, max_workers=None, seed=-1):
+        """Generate images using Volcengine API
+        
+        Returns every URL that succeeded (local paths for fixed-seed images
+        when a generation cache is set); only raises when no image could be generated.
+        """
+        results = self.generate_images_detailed(prompt, count, width, height, max_workers, seed)
+        images = [url for result in results for url in result["urls"]]
+        errors = [f"Image {r['index'] + 1}: {r['error']}" for r in results if r["error"]]
+        
+        if not images and errors:
+            raise Exception(f"Image generation failed: {'; '.join(errors)}")
+        
+        return images
     
     def get_aspect_ratios(self):
         """Get available aspect ratios"""
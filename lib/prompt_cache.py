@@ -0,0 +1,84 @@
+# coding:utf-8
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class PromptCache:
+    """TTL and LRU bounded cache of generated prompts, optionally persisted to a JSON file"""
+
+    def __init__(self, ttl=86400, max_entries=512, persist_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+
+        # key -> (expires_at, value), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if persist_path:
+            self._load()
+
+    @staticmethod
+    def make_key(payload):
+        """Key on the canonicalized request payload (model, messages, sampling params)"""
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return a cached value, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries past max_entries"""
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.persist_path:
+                self._save()
+
+    def _load(self):
+        """Load unexpired entries from the persist file"""
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        for key, expires_at, value in stored:
+            if expires_at >= now:
+                self._entries[key] = (expires_at, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        """Write entries to the persist file atomically (caller holds the lock)"""
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        os.makedirs(directory, exist_ok=True)
+
+        stored = [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(stored, f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            print(f"Failed to persist prompt cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,171 @@
+# coding:utf-8
+import random
+import re
+import threading
+import time
+
+from lib.metrics import count, record
+
+
+# Volcengine visual API codes for "Request Has Reached API Limit" (QPS) and the concurrency limit
+THROTTLE_CODES = frozenset([50429, 50430])
+
+# The SDK raises on HTTP errors with the response body as the message
+_THROTTLE_PATTERN = re.compile(r"\b(?:50429|50430)\b|Too Many Requests|Reached API Limit", re.IGNORECASE)
+
+
+def is_throttled(response=None, error=None):
+    """Whether a cv_process result means the request was throttled
+
+    Throttling arrives either as a response with a throttle code or as the
+    SDK's exception wrapping an HTTP 429 body.
+    """
+    if isinstance(response, dict):
+        return response.get("code") in THROTTLE_CODES
+    if error is not None:
+        return bool(_THROTTLE_PATTERN.search(str(error)))
+    return False
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, at most burst saved up
+
+    Callers reserve a token and sleep until it is due, so waiters are served
+    in arrival order without polling. rate <= 0 disables the bucket.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until it is available; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+class AdaptiveRateLimiter:
+    """Shared gate in front of a rate-limited API: token bucket, AIMD concurrency and retries
+
+    Every call takes a token (the configured QPS) and one of `limit`
+    concurrency slots. A throttled attempt halves the limit, at most once per
+    round of in-flight requests, and is retried after a jittered exponential
+    backoff; each success grows the limit by 1/limit, about one slot per
+    round, up to max_concurrency. Throughput therefore settles just under the
+    quota instead of failing requests.
+    """
+
+    def __init__(self, rate=2.0, burst=2, max_concurrency=8, min_concurrency=1, max_retries=5,
+                 backoff_base=0.5, backoff_max=20.0, name="volcengine", throttled=is_throttled):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.name = name
+        self.throttled = throttled
+
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _acquire_slot(self):
+        start = time.monotonic()
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def _release_slot(self, started, throttled):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                # Requests already in flight when the limit was cut report the same overload
+                if started >= self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = time.monotonic()
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff before retry number attempt + 1"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) under the limits and return its result
+
+        Throttled attempts are retried up to max_retries times; after that the
+        last response is returned (or its error raised) unchanged.
+        """
+        attempt = 0
+        while True:
+            waited = self._acquire_slot()
+            started = time.monotonic()
+            throttled = False
+            try:
+                waited += self.bucket.acquire()
+                record(f"{self.name}.rate_limit_wait", waited)
+
+                response = error = None
+                try:
+                    response = func(*args, **kwargs)
+                except Exception as e:
+                    error = e
+                throttled = self.throttled(response, error)
+            finally:
+                self._release_slot(started, throttled)
+
+            if throttled and attempt < self.max_retries:
+                count("throttled", limiter=self.name, result="retried")
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+
+            if throttled:
+                count("throttled", limiter=self.name, result="gave_up")
+            if error is not None:
+                raise error
+            return response
+
+    def stats(self):
+        """Current state for display: {"limit", "in_flight", "rate"}"""
+        with self._cond:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "rate": self.bucket.rate}
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_volcengine_limiter():
+    """Return the process-wide cv_process limiter shared by every session, configured from config.py"""
+    global _default_limiter
+
+    with _default_lock:
+        if _default_limiter is None:
+            from config import VOLCENGINE_BURST, VOLCENGINE_MAX_CONCURRENCY, VOLCENGINE_QPS, VOLCENGINE_THROTTLE_RETRIES
+            _default_limiter = AdaptiveRateLimiter(
+                rate=VOLCENGINE_QPS,
+                burst=VOLCENGINE_BURST,
+                max_concurrency=VOLCENGINE_MAX_CONCURRENCY,
+                max_retries=VOLCENGINE_THROTTLE_RETRIES
+            )
+        return _default_limiter
@@ -0,0 +1,139 @@
+# coding:utf-8
+import threading
+
+
+_MISSING = object()
+
+
+class ServiceRegistry:
+    """Process-wide services, built on first use and shared by every page and session
+
+    Each factory runs once under its own lock and imports what it needs
+    itself, so a page only pays for the SDKs and connection pools it
+    actually touches. Factories may get() other services.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        """Register (or replace, before first use) the factory for name"""
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """Return the service, building it on the first call"""
+        instance = self._instances.get(name, _MISSING)
+        if instance is not _MISSING:
+            return instance
+
+        with self._lock:
+            if name not in self._factories:
+                raise Exception(f"Unknown service {name}, expected one of: {', '.join(self._factories)}")
+            factory, lock = self._factories[name], self._locks[name]
+
+        with lock:
+            instance = self._instances.get(name, _MISSING)
+            if instance is _MISSING:
+                instance = self._instances[name] = factory()
+            return instance
+
+    def loaded(self):
+        """Names of the services built so far"""
+        return list(self._instances)
+
+
+def _build_visual_service():
+    from volcengine.visual.VisualService import VisualService
+    from config import VOLCENGINE_ACCESS_KEY, VOLCENGINE_SECRET_KEY
+
+    visual_service = VisualService()
+    visual_service.set_ak(VOLCENGINE_ACCESS_KEY)
+    visual_service.set_sk(VOLCENGINE_SECRET_KEY)
+    return visual_service
+
+
+def _build_poster_generator():
+    from lib.generation_cache import get_generation_cache
+    from lib.image_archive import get_image_archive
+    from lib.poster_generator import PosterGenerator
+    from lib.prompt_cache import PromptCache
+    from config import (
+        VOLCENGINE_ACCESS_KEY, VOLCENGINE_SECRET_KEY, OPENAI_API_KEY, OPENAI_BASE_URL, DOUBAO_MODEL,
+        IMAGE_GEN_MAX_CONCURRENCY, PROMPT_CACHE_TTL, PROMPT_CACHE_MAX_ENTRIES, PROMPT_CACHE_PATH
+    )
+
+    return PosterGenerator(
+        VOLCENGINE_ACCESS_KEY,
+        VOLCENGINE_SECRET_KEY,
+        OPENAI_API_KEY,
+        OPENAI_BASE_URL,
+        DOUBAO_MODEL,
+        max_concurrency=IMAGE_GEN_MAX_CONCURRENCY,
+        prompt_cache=PromptCache(PROMPT_CACHE_TTL, PROMPT_CACHE_MAX_ENTRIES, PROMPT_CACHE_PATH or None),
+        archive=get_image_archive(),
+        generation_cache=get_generation_cache(),
+        # One VisualService per process, still imported only on the first cv_process call
+        visual_service_provider=get_visual_service
+    )
+
+
+def _build_comfyui_client():
+    from lib.comfyui_pool import ComfyUIPool
+    from lib.image_archive import get_image_archive
+    from lib.upscale_cache import UpscaleCache
+    from config import (
+        COMFYUI_BASE_URLS, COMFYUI_HEALTH_CHECK_INTERVAL, UPSCALE_CACHE_DIR, UPSCALE_CACHE_MAX_MB,
+        UPSCALE_NORMALIZE_INPUT, UPSCALE_MAX_OUTPUT_EDGE
+    )
+
+    cache = None
+    if UPSCALE_CACHE_MAX_MB > 0:
+        cache = UpscaleCache(UPSCALE_CACHE_DIR, UPSCALE_CACHE_MAX_MB * 1024 * 1024)
+    # Jobs are routed across all configured ComfyUI servers by queue depth
+    return ComfyUIPool(
+        COMFYUI_BASE_URLS, COMFYUI_HEALTH_CHECK_INTERVAL, cache=cache,
+        normalize=UPSCALE_NORMALIZE_INPUT, max_output_edge=UPSCALE_MAX_OUTPUT_EDGE, archive=get_image_archive()
+    )
+
+
+def _build_artifact_store():
+    from lib.artifact_store import ArtifactStore
+    from config import ARTIFACT_DIR, ARTIFACT_URL_PREFIX, ARTIFACT_PREVIEW_MAX_EDGE, ARTIFACT_MAX_AGE_HOURS, ARTIFACT_MAX_MB
+
+    return ArtifactStore(
+        ARTIFACT_DIR, ARTIFACT_URL_PREFIX or None, ARTIFACT_PREVIEW_MAX_EDGE,
+        max_age_seconds=ARTIFACT_MAX_AGE_HOURS * 3600, max_bytes=ARTIFACT_MAX_MB * 1024 * 1024
+    )
+
+
+# Shared by all pages, sessions and the batch CLI in this process
+registry = ServiceRegistry()
+registry.register("visual_service", _build_visual_service)
+registry.register("poster_generator", _build_poster_generator)
+registry.register("comfyui_client", _build_comfyui_client)
+registry.register("artifact_store", _build_artifact_store)
+
+
+def get_visual_service():
+    """Volcengine VisualService configured from config.py"""
+    return registry.get("visual_service")
+
+
+def get_poster_generator():
+    """PosterGenerator with the prompt cache, generation cache and image archive from config.py"""
+    return registry.get("poster_generator")
+
+
+def get_comfyui_client():
+    """ComfyUIPool over COMFYUI_BASE_URLS with its pooled sessions, upscale cache and archive"""
+    return registry.get("comfyui_client")
+
+
+def get_artifact_store():
+    """ArtifactStore for upscale results shown on the pages, cleaned up by age and size"""
+    return registry.get("artifact_store")
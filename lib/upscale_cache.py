@@ -0,0 +1,76 @@
+# coding:utf-8
+import hashlib
+import json
+import os
+
+from lib.disk_cache import DiskLRUCache
+from lib.singleflight import SingleFlight
+
+
+class UpscaleCache:
+    """Content-addressed cache of upscale results with in-flight deduplication"""
+
+    def __init__(self, cache_dir="upscale_cache", max_bytes=1024 * 1024 * 1024):
+        self.store = DiskLRUCache(cache_dir, max_bytes, suffix=".png")
+        self.flight = SingleFlight()
+
+    @staticmethod
+    def make_key_from_digest(content_hash, model_name, params):
+        """Key on a precomputed input sha256, model name and workflow parameters"""
+        params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{content_hash}|{model_name}|{params_json}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def make_key(image_bytes, model_name, params):
+        """Key on input content hash, model name and workflow parameters"""
+        content_hash = hashlib.sha256(image_bytes).hexdigest()
+        return UpscaleCache.make_key_from_digest(content_hash, model_name, params)
+
+    def get(self, key):
+        """Return cached result bytes, or None on a miss"""
+        return self.store.get(key)
+
+    def put(self, key, image_data):
+        """Store result bytes for key"""
+        self.store.put(key, image_data)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result or run compute once across concurrent identical requests"""
+        image_data = self.store.get(key)
+        if image_data is not None:
+            return image_data
+
+        def run():
+            # A flight that finished just before we joined may have filled the cache
+            cached = self.store.get(key)
+            if cached is not None:
+                return cached
+            result = compute()
+            self.store.put(key, result)
+            return result
+
+        return self.flight.do(key, run)
+
+    def get_or_compute_path(self, key, compute_into):
+        """Like get_or_compute, but compute_into(path) streams the result into a file
+
+        Returns the path of the cached file, so results never have to be held in memory.
+        """
+        path = self.store.get_path(key)
+        if path is not None:
+            return path
+
+        def run():
+            cached = self.store.get_path(key)
+            if cached is not None:
+                return cached
+            tmp_path = self.store.temp_path()
+            try:
+                compute_into(tmp_path)
+                return self.store.put_file(key, tmp_path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        return self.flight.do(key, run)
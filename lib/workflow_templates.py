@@ -0,0 +1,140 @@
+# coding:utf-8
+import json
+import threading
+from types import MappingProxyType
+
+
+class WorkflowTemplate:
+    """Frozen ComfyUI workflow graph with declared parameter slots
+
+    The graph is kept only in serialized form, so no caller can mutate the
+    shared template; instantiate() returns a fresh graph per request.
+    """
+
+    def __init__(self, name, graph, slots, output_node, defaults=None, scale=1, label=None):
+        for node_id, input_key in slots.values():
+            if input_key not in graph.get(node_id, {}).get("inputs", {}):
+                raise Exception(f"Template {name}: slot target {node_id}.{input_key} not in graph")
+        if output_node not in graph:
+            raise Exception(f"Template {name}: output node {output_node} not in graph")
+
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "label", label or name)
+        object.__setattr__(self, "output_node", output_node)
+        object.__setattr__(self, "scale", scale)
+        object.__setattr__(self, "slots", MappingProxyType({key: tuple(value) for key, value in slots.items()}))
+        object.__setattr__(self, "defaults", MappingProxyType(dict(defaults or {})))
+        object.__setattr__(self, "_graph_json", json.dumps(graph, sort_keys=True, ensure_ascii=False))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("WorkflowTemplate is immutable")
+
+    @property
+    def model_name(self):
+        return self.defaults.get("model_name")
+
+    def instantiate(self, **params):
+        """Return a new workflow graph with every slot filled from params or defaults"""
+        unknown = set(params) - set(self.slots)
+        if unknown:
+            raise Exception(f"Unknown workflow parameters for {self.name}: {', '.join(sorted(unknown))}")
+
+        values = dict(self.defaults)
+        values.update(params)
+        missing = [slot for slot in self.slots if slot not in values]
+        if missing:
+            raise Exception(f"Missing workflow parameters for {self.name}: {', '.join(missing)}")
+
+        graph = json.loads(self._graph_json)
+        for slot, (node_id, input_key) in self.slots.items():
+            graph[node_id]["inputs"][input_key] = values[slot]
+        return graph
+
+    def cache_params(self):
+        """Everything besides the input image that determines the output"""
+        return {
+            "template": self.name,
+            "graph": self._graph_json,
+            "defaults": dict(self.defaults)
+        }
+
+
+# LoadImage -> UpscaleModelLoader + ImageUpscaleWithModel -> PreviewImage
+UPSCALE_GRAPH = {
+    "2": {
+        "inputs": {
+            "model_name": ""
+        },
+        "class_type": "UpscaleModelLoader"
+    },
+    "4": {
+        "inputs": {
+            "upscale_model": ["2", 0],
+            "image": ["5", 0]
+        },
+        "class_type": "ImageUpscaleWithModel"
+    },
+    "5": {
+        "inputs": {
+            "image": "",
+            "upload": "image"
+        },
+        "class_type": "LoadImage"
+    },
+    "7": {
+        "inputs": {
+            "images": ["4", 0]
+        },
+        "class_type": "PreviewImage"
+    }
+}
+
+UPSCALE_SLOTS = {
+    "input_image": ("5", "image"),
+    "model_name": ("2", "model_name")
+}
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def register_template(template):
+    """Register a template under its name, replacing any previous one"""
+    with _registry_lock:
+        _registry[template.name] = template
+    return template
+
+
+def get_template(name):
+    """Look up a registered template by name"""
+    with _registry_lock:
+        template = _registry.get(name)
+    if template is None:
+        raise Exception(f"Unknown workflow template: {name}")
+    return template
+
+
+def list_templates():
+    """Return all registered templates in registration order"""
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def register_upscale_model(name, model_name, scale, label=None):
+    """Register a RealESRGAN-style upscale model under the standard upscale graph"""
+    return register_template(WorkflowTemplate(
+        name,
+        UPSCALE_GRAPH,
+        UPSCALE_SLOTS,
+        output_node="7",
+        defaults={"model_name": model_name},
+        scale=scale,
+        label=label
+    ))
+
+
+register_upscale_model("realesrgan_x2", "RealESRGAN_x2.pth", 2, "RealESRGAN x2")
+register_upscale_model("realesrgan_x4", "RealESRGAN_x4.pth", 4, "RealESRGAN x4")
+
+DEFAULT_UPSCALE_TEMPLATE = "realesrgan_x2"
@@ -1,27 +1,112 @@
 # coding:utf-8
+import time
 import streamlit as st
-from lib.poster_generator import PosterGenerator
-from config import (
-    VOLCENGINE_ACCESS_KEY, 
-    VOLCENGINE_SECRET_KEY, 
-    OPENAI_API_KEY, 
-    OPENAI_BASE_URL, 
-    DOUBAO_MODEL
-)
-
-# Initialize services
+from lib.job_manager import DONE, FINISHED_STATES, get_job_manager
+from lib.pipeline import generate_and_upscale
+from lib.metrics import Trace, setup_metrics, trace
+from lib.services import get_artifact_store, get_comfyui_client, get_poster_generator
+from config import IMAGE_GEN_MAX_CONCURRENCY, UPSCALE_MAX_CONCURRENCY
+
+# Jobs run in a process-wide worker pool and survive reruns and page switches
 @st.cache_resource
-def init_services():
-    poster_gen = PosterGenerator(
-        VOLCENGINE_ACCESS_KEY,
-        VOLCENGINE_SECRET_KEY,
-        OPENAI_API_KEY,
-        OPENAI_BASE_URL,
-        DOUBAO_MODEL
-    )
-    return poster_gen
-
-poster_generator = init_services()
+def init_job_manager():
+    manager = get_job_manager()
+    # Volcengine calls cannot be reattached, so interrupted generations just fail
+    manager.recover("generate")
+    return manager
+
+# Shared with the other pages; the Volcengine SDK and ComfyUI pool load on first use
+poster_generator = get_poster_generator()
+job_manager = init_job_manager()
+
+# Scrape endpoint and span logs, if enabled in config.py
+setup_metrics()
+
+def run_generate_job(job, prompt, count, width, height):
+    """Background job: generate images concurrently, keeping per-image results and stage timings
+    
+    prompt may be a list of variant prompts, one image each.
+    """
+    with trace() as job_trace:
+        if isinstance(prompt, list):
+            results = poster_generator.generate_variant_images_detailed(prompt, width, height)
+        else:
+            results = poster_generator.generate_images_detailed(prompt, count, width, height)
+    return {"prompt": prompt, "results": results, "timings": job_trace.breakdown()}
+
+def show_download(artifact, filename, key):
+    """Offer the full-resolution file for download without inlining its bytes"""
+    if artifact.url:
+        # Served from disk by Streamlit's static file handler
+        st.markdown(
+            f'<a href="{artifact.url}" download="{filename}" style="display: inline-block; padding: 0.25rem 0.75rem; background-color: #ff4b4b; color: white; text-decoration: none; border-radius: 0.25rem; font-weight: 500;">📥 下载高清图片 ({artifact.size_mb:.1f} MB)</a>',
+            unsafe_allow_html=True
+        )
+    else:
+        with open(artifact.path, 'rb') as f:
+            st.download_button("📥 下载高清图片", data=f, file_name=filename, mime=artifact.mime_type, key=key)
+
+def show_timing_breakdown(timings):
+    """Per-stage timings of one request"""
+    if not timings:
+        return
+    with st.expander("⏱️ 耗时明细", expanded=True):
+        st.table([
+            {"阶段": item["stage"], "次数": item["count"], "累计耗时 (秒)": f"{item['seconds']:.2f}", "失败": item["errors"]}
+            for item in timings
+        ])
+        st.caption("并行执行的阶段耗时会重叠，累计值可能超过总耗时")
+
+@st.fragment(run_every=2)
+def poll_generate_job(job_id):
+    """Show live job status; rerun the page once the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None or job["state"] in FINISHED_STATES:
+        st.rerun()
+    
+    elapsed = time.time() - job["created_at"]
+    st.info(f"🔄 正在生成海报图片... 已用时 {elapsed:.0f} 秒")
+    st.caption("💡 可以离开此页面，任务会在后台继续运行")
+
+def show_generate_job(job):
+    """Render a finished generation job"""
+    if job["state"] != DONE:
+        st.error(f"❌ 图片生成失败: {job['error']}")
+        return
+    
+    results = job["result"]["results"]
+    # Variant results carry their own prompt
+    generated_images = [(url, result.get("prompt")) for result in results for url in result["urls"]]
+    
+    for result in results:
+        if result["error"]:
+            st.error(f"❌ 第 {result['index'] + 1} 张图片生成失败: {result['error']}")
+    
+    if not generated_images:
+        st.error("❌ 图片生成失败，请重试")
+        return
+    
+    st.success(f"🎉 成功生成 {len(generated_images)} 张红色年代海报!")
+    
+    # Display images in columns
+    cols = st.columns(min(len(generated_images), 4))
+    for idx, (image_url, image_prompt) in enumerate(generated_images):
+        with cols[idx % 4]:
+            st.image(image_url, caption=f"红色年代海报 {idx + 1}", width=256)
+            
+            # Add copy URL button for each image
+            with st.expander(f"📋 图片链接 {idx + 1}"):
+                st.code(image_url, language=None)
+                st.caption("💡 复制此链接到 [🔍 图像超分] 页面进行高清化处理")
+                if image_prompt:
+                    st.caption(f"提示词: {image_prompt}")
+    
+    if show_timings:
+        show_timing_breakdown(st.session_state.get("poster_prompt_timings", []) + job["result"].get("timings", []))
+    
+    # High-resolution processing tip
+    st.markdown("---")
+    st.info("🔍 **想要更高清的图片？** 勾选\"自动高清化\"，或复制上面的图片链接前往 [🔍 图像超分] 页面进行超分辨率处理！")
 
 # Streamlit App
 st.title("🚩 红色年代海报生成器")
@@ -34,9 +119,11 @@ st.markdown("""
 **示例输入:** "几位劳动者在工厂工作"  
 **AI会生成类似:** "生成几位分别在挥拳、前冲、吹冲锋号、办公的劳动者作为主体，复古大字报风格的插画，背景是工厂机械，底部是'劳动最光荣'"
 
-💡 **提示:** 如需高清化处理，可将生成的图片链接复制到 [🔍 图像超分] 页面进行处理。
+💡 **提示:** 勾选"自动高清化"可在每张图片生成后立即进行超分处理，无需手动复制链接。
 """)
 
+show_timings = st.sidebar.checkbox("⏱️ 显示耗时明细", value=False, help="按阶段显示提示词生成、图片生成与高清化各环节的耗时")
+
 with st.form("red_poster_form"):
     col1, col2 = st.columns([2, 1])
     
@@ -47,6 +134,12 @@ with st.form("red_poster_form"):
             placeholder="例如: 为豆包服务\n让豆包再次伟大\n为豆包点赞",
             height=100
         )
+        
+        # Bypass the prompt cache to get a fresh variant
+        regenerate = st.checkbox("🔄 重新生成提示词", value=False, help="忽略缓存，让 AI 为相同描述生成新的提示词")
+        
+        # One completion returns a different prompt for every image
+        variant_mode = st.checkbox("🎲 多样化变体", value=False, help="生成多张时，一次请求让 AI 给出多个主体、背景与标语各不相同的提示词，每张图片使用不同的提示词")
     
     with col2:
         # Image count
@@ -67,48 +160,110 @@ with st.form("red_poster_form"):
         
         # Display selected dimensions
         st.info(f"📏 尺寸: {width} × {height}")
+        
+        # Feed each generated image straight into the upscaler
+        auto_upscale = st.checkbox("🔍 自动高清化", value=False, help="每张图片生成后立即提交超分处理，生成与超分并行进行")
     
     # Submit button
     submitted = st.form_submit_button("🎨 生成红色年代海报", use_container_width=True)
 
 if submitted and user_prompt:
-    with st.spinner("正在生成红色年代风格提示词..."):
-        try:
-            # Generate poster prompt
-            poster_prompt = poster_generator.generate_prompt(user_prompt)
-            st.success("✅ AI生成的海报提示词:")
-            st.info(poster_prompt)
-        except Exception as e:
-            st.error(f"❌ 提示词生成失败: {e}")
-            st.stop()
+    # Stage timings of this submit, from prompt streaming to the last upscale
+    request_trace = Trace()
     
-    with st.spinner("正在生成海报图片..."):
-        try:
-            # Generate images
-            generated_images = poster_generator.generate_images(poster_prompt, image_count, width, height)
+    try:
+        if variant_mode and image_count > 1:
+            # All variants come from a single round trip, so they cannot be streamed
+            with st.spinner(f"🎲 正在生成 {image_count} 个不同的提示词..."), trace(request_trace):
+                poster_prompt = poster_generator.generate_prompt_variants(user_prompt, image_count, regenerate=regenerate)
             
-            if generated_images:
-                st.success(f"🎉 成功生成 {len(generated_images)} 张红色年代海报!")
+            st.success(f"✅ AI生成的 {len(poster_prompt)} 个海报提示词:")
+            with st.container(border=True):
+                for idx, variant in enumerate(poster_prompt):
+                    st.markdown(f"**{idx + 1}.** {variant}")
+            if len(poster_prompt) < image_count:
+                st.warning(f"⚠️ 仅得到 {len(poster_prompt)} 个符合格式的不同提示词，将生成 {len(poster_prompt)} 张图片")
+                image_count = len(poster_prompt)
+        else:
+            # Stream the poster prompt so tokens show up as soon as they arrive
+            st.success("✅ AI生成的海报提示词:")
+            with st.container(border=True), trace(request_trace):
+                poster_prompt = st.write_stream(
+                    poster_generator.generate_prompt_stream(user_prompt, regenerate=regenerate)
+                ).strip()
+    except Exception as e:
+        st.error(f"❌ 提示词生成失败: {e}")
+        st.stop()
+    
+    if auto_upscale:
+        st.session_state.pop("poster_job_id", None)
+        
+        # Generation of later images overlaps with upscaling of earlier ones;
+        # results go straight to disk and the page shows previews
+        comfyui_client = get_comfyui_client()
+        artifact_store = get_artifact_store()
+        progress = st.progress(0.0, text="🔄 正在生成海报并高清化...")
+        cols = st.columns(min(image_count, 2))
+        slots = []
+        for idx in range(image_count):
+            with cols[idx % 2]:
+                slots.append(st.empty())
+                slots[idx].info(f"⏳ 海报 {idx + 1} 生成中...")
+        
+        finished = 0
+        succeeded = 0
+        # Events stream in as they happen; work started here joins the request trace
+        with trace(request_trace):
+            for event in generate_and_upscale(
+                poster_generator, comfyui_client, poster_prompt, image_count, width, height,
+                generate_workers=IMAGE_GEN_MAX_CONCURRENCY, upscale_workers=UPSCALE_MAX_CONCURRENCY,
+                artifact_store=artifact_store
+            ):
+                idx = event["index"]
+                with slots[idx].container():
+                    if event["stage"] == "generated":
+                        st.image(event["url"], caption=f"红色年代海报 {idx + 1}（高清化中...）", width=256)
+                        continue
                 
-                # Display images in columns
-                cols = st.columns(min(len(generated_images), 4))
-                for idx, image_url in enumerate(generated_images):
-                    with cols[idx % 4]:
-                        st.image(image_url, caption=f"红色年代海报 {idx + 1}", width=256)
-                        
-                        # Add copy URL button for each image
-                        with st.expander(f"📋 图片链接 {idx + 1}"):
-                            st.code(image_url, language=None)
-                            st.caption("💡 复制此链接到 [🔍 图像超分] 页面进行高清化处理")
-                            
-                # High-resolution processing tip
-                st.markdown("---")
-                st.info("🔍 **想要更高清的图片？** 复制上面的图片链接，前往 [🔍 图像超分] 页面进行4倍超分辨率处理！")
-                            
-            else:
-                st.error("❌ 图片生成失败，请重试")
-        except Exception as e:
-            st.error(f"❌ 图片生成失败: {e}")
+                    finished += 1
+                    if event["stage"] == "upscaled":
+                        succeeded += 1
+                        artifact = event["artifact"]
+                        st.image(artifact.preview_path, caption=f"高清红色年代海报 {idx + 1}", width=512)
+                        show_download(artifact, f"red_poster_{idx + 1}_hd.png", f"download_hd_{idx}")
+                    else:
+                        if event["url"]:
+                            st.image(event["url"], caption=f"红色年代海报 {idx + 1}", width=256)
+                            st.code(event["url"], language=None)
+                        st.error(f"❌ 海报 {idx + 1} 处理失败: {event['error']}")
+                progress.progress(finished / image_count, text=f"已完成 {finished}/{image_count}")
+        
+        if succeeded:
+            st.success(f"🎉 成功生成 {succeeded} 张高清红色年代海报!")
+        else:
+            st.error("❌ 图片生成失败，请重试")
+        
+        if show_timings:
+            st.caption(f"⏱️ 总耗时 {request_trace.elapsed:.1f} 秒")
+            show_timing_breakdown(request_trace.breakdown())
+    
+    else:
+        # Prompt timings are shown together with the job's own once it finishes
+        st.session_state["poster_prompt_timings"] = request_trace.breakdown()
+        
+        # Submit to the background worker; results are rendered below from the job id
+        st.session_state["poster_job_id"] = job_manager.submit(
+            "generate", run_generate_job, poster_prompt, image_count, width, height,
+            params={"prompt": poster_prompt, "count": image_count, "width": width, "height": height}
+        )
 
 elif submitted and not user_prompt:
-    st.warning("⚠️ 请输入您的创意描述") 
\ No newline at end of file
+    st.warning("⚠️ 请输入您的创意描述") 
+
+# Reattach to the latest generation job across reruns
+poster_job_id = st.session_state.get("poster_job_id")
+poster_job = job_manager.get(poster_job_id) if poster_job_id else None
+if poster_job and poster_job["state"] not in FINISHED_STATES:
+    poll_generate_job(poster_job_id)
+elif poster_job:
+    show_generate_job(poster_job)
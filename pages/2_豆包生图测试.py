@@ -1,22 +1,16 @@
 # coding:utf-8
-from volcengine.visual.VisualService import VisualService
 import streamlit as st
 import os
-import requests
 from datetime import datetime
-from config import VOLCENGINE_ACCESS_KEY, VOLCENGINE_SECRET_KEY
+from lib.concurrency import run_bounded
+from lib.image_archive import get_image_archive
+from lib.services import get_poster_generator
+from config import IMAGE_GEN_MAX_CONCURRENCY
 
 # pip install volcengine streamlit python-dotenv openai
 
-# Initialize VisualService with config
-visual_service = VisualService()
-visual_service.set_ak(VOLCENGINE_ACCESS_KEY)
-visual_service.set_sk(VOLCENGINE_SECRET_KEY)
-
-# 创建保存目录
-save_dir = "doubao_generated"
-if not os.path.exists(save_dir):
-    os.makedirs(save_dir)
+# Generated image URLs expire, so every result is archived to disk in the background
+archive = get_image_archive()
 
 # Streamlit App
 st.title("🎨 通用 3.0 图像生成器")
@@ -91,20 +85,6 @@ with st.form("image_generation_form"):
     # Submit button
     submitted = st.form_submit_button("生成图像")
 
-# 保存图片函数
-def save_image(image_url, filename):
-    try:
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            filepath = os.path.join(save_dir, filename)
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return filepath
-        return None
-    except Exception as e:
-        st.error(f"保存图片失败: {e}")
-        return None
-    
 # If form is submitted
 if submitted:
     # Construct request body
@@ -133,30 +113,76 @@ if submitted:
     # 生成多张图片
     st.info(f"正在生成 {num_images} 张图片...")
     
+    # Shared generator: rate limiter, generation cache and archive are the same as on every other page
+    poster_generator = get_poster_generator()
+    
+    def generate_one(i):
+        # 如果设置了随机种子，为每张图片使用不同的种子
+        body = dict(request_body)
+        if seed != -1:
+            body["seed"] = seed + i
+        return poster_generator.generate_from_body(body)
+    
+    # 并发生成，保持顺序，单张失败不影响其他图片
+    results = run_bounded(generate_one, range(num_images), IMAGE_GEN_MAX_CONCURRENCY)
+    
     generated_images = []
-    for i in range(num_images):
-        try:
-            # 如果设置了随机种子，为每张图片使用不同的种子
-            if seed != -1:
-                request_body["seed"] = seed + i
-            
-            response = visual_service.cv_process(request_body)
-            
-            # Parse return result
-            if response.get("code") == 10000:
-                image_urls = response["data"].get("image_urls", [])
-                generated_images.extend(image_urls)
-            else:
-                st.error(f"第 {i+1} 张图片生成失败: {response.get('message')}")
-        except Exception as e:
-            st.error(f"第 {i+1} 张图片请求异常: {e}")
+    for result in results:
+        if result["error"]:
+            st.error(f"第 {result['index'] + 1} 张图片请求异常: {result['error']}")
+        else:
+            generated_images.extend((url, result["result"]["cached"]) for url in result["result"]["urls"])
     
     if generated_images:
         st.success(f"成功生成 {len(generated_images)} 张图片!")
         
         # 显示生成的图片
-        for idx, image_url in enumerate(generated_images):
-            st.image(image_url, caption=f"生成的图像 {idx + 1}")
+        for idx, (image_url, cached) in enumerate(generated_images):
+            st.image(image_url, caption=f"生成的图像 {idx + 1}" + ("（⚡ 本地缓存）" if cached else ""))
+        
+        if archive is not None:
+            st.caption("💾 图片正在后台保存到本地归档，可在下方浏览")
             
     else:
         st.warning("没有成功生成图片")
+
+# Browse and search the local archive
+if archive is not None:
+    st.markdown("---")
+    stats = archive.stats()
+    st.subheader(f"📚 图片归档（{stats['images']} 张，{stats['bytes'] / 1024 / 1024:.1f} / {stats['max_bytes'] / 1024 / 1024:.0f} MB）")
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        archive_query = st.text_input("按提示词搜索:", placeholder="输入提示词中的关键字")
+    with col2:
+        archive_kind = st.selectbox("类型:", options=["", "generated", "upscaled"], format_func=lambda kind: {"": "全部", "generated": "生成", "upscaled": "超分"}[kind])
+    
+    entries = archive.search(archive_query or None, archive_kind or None, limit=12)
+    if not entries:
+        st.info("暂无归档图片")
+    
+    # A file may have been evicted since the search ran; skip it and drop its stale rows
+    shown = []
+    for entry in entries:
+        try:
+            with open(entry["path"], "rb") as f:
+                shown.append((entry, f.read()))
+        except FileNotFoundError:
+            archive.prune(entry["sha256"])
+    
+    archive_cols = st.columns(4)
+    for idx, (entry, image_data) in enumerate(shown):
+        with archive_cols[idx % 4]:
+            st.image(image_data, use_container_width=True)
+            created = datetime.fromtimestamp(entry["created_at"]).strftime("%Y-%m-%d %H:%M")
+            details = [created, f"{entry['width']}×{entry['height']}" if entry["width"] else None,
+                       f"seed {entry['seed']}" if entry["seed"] is not None else None, entry["model"]]
+            st.caption(" · ".join(detail for detail in details if detail))
+            if entry["prompt"]:
+                with st.expander("提示词"):
+                    st.write(entry["prompt"])
+            st.download_button(
+                "📥 下载", data=image_data, file_name=os.path.basename(entry["path"]), key=f"archive_download_{entry['id']}",
+                on_click=archive.touch, args=(entry["sha256"],)
+            )
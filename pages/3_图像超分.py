@@ -1,55 +1,115 @@
 # coding:utf-8
+import os
+import time
 import streamlit as st
-import base64
-import requests
-from PIL import Image
 from io import BytesIO
-from lib.comfyui_client import ComfyUIClient
-from config import COMFYUI_BASE_URL
+from lib.fetched_image import FetchedImage
+from lib.job_manager import DONE, FINISHED_STATES, get_job_manager
+from lib.metrics import setup_metrics, trace
+from lib.services import get_artifact_store, get_comfyui_client
+from lib.workflow_templates import DEFAULT_UPSCALE_TEMPLATE, list_templates
+from config import (
+    UPSCALE_MAX_CONCURRENCY,
+    UPSCALE_TILE_SIZE,
+    UPSCALE_TILE_OVERLAP,
+    UPSCALE_TILE_MIN_EDGE
+)
+
+# One ComfyUI pool (sessions, health checks, cache) shared with the poster page;
+# results are written to disk once and the page only keeps artifact ids
+comfyui_client = get_comfyui_client()
+artifact_store = get_artifact_store()
+
+# Scrape endpoint and span logs, if enabled in config.py
+setup_metrics()
+
+def run_upscale_job(job, image_bytes, filename, template_name, tiled=False):
+    """Background job: upscale into a new artifact, recording the ComfyUI prompt_id and stage timings"""
+    source = BytesIO(image_bytes)
+    source.name = filename
+    with trace() as job_trace:
+        if tiled:
+            # Tiles run as separate ComfyUI jobs spread over UPSCALE_MAX_CONCURRENCY workers
+            artifact = artifact_store.create(
+                lambda path: comfyui_client.upscale_image_tiled(
+                    source, output=path, tile_size=UPSCALE_TILE_SIZE, overlap=UPSCALE_TILE_OVERLAP,
+                    max_workers=UPSCALE_MAX_CONCURRENCY, template=template_name
+                )
+            )
+        else:
+            # Pin the job to one backend and record it, so a restart can resume there
+            with comfyui_client.lease() as client:
+                job.update_params(backend=client.base_url)
+                artifact = artifact_store.create(
+                    lambda path: client.upscale_image(
+                        source, output=path, on_queued=job.set_prompt_id, template=template_name
+                    )
+                )
+    return {"artifact_id": artifact.id, "paths": [artifact.path, artifact.preview_path], "timings": job_trace.breakdown()}
+
+def resume_upscale_job(job):
+    """Reattach to a job interrupted by a restart using its stored prompt_id"""
+    if job.params.get("tiled"):
+        raise Exception("分块超分任务在重启后无法接管，请重新提交")
+    if not job.prompt_id:
+        raise Exception("任务在提交到 ComfyUI 之前被中断")
+    template_name = job.params.get("template", DEFAULT_UPSCALE_TEMPLATE)
+    with trace() as job_trace:
+        artifact = artifact_store.create(
+            lambda path: comfyui_client.resume_upscale(
+                job.prompt_id, output=path, template=template_name, base_url=job.params.get("backend")
+            )
+        )
+    return {"artifact_id": artifact.id, "paths": [artifact.path, artifact.preview_path], "timings": job_trace.breakdown()}
 
-# Initialize ComfyUI client
+# Jobs run in a process-wide worker pool and survive reruns and page switches
 @st.cache_resource
-def init_comfyui_client():
-    return ComfyUIClient(COMFYUI_BASE_URL)
-
-comfyui_client = init_comfyui_client()
-
-def download_button_for_image(image_data, filename):
-    """Create download button for binary image data"""
-    b64 = base64.b64encode(image_data).decode()
-    href = f'<a href="data:image/jpeg;base64,{b64}" download="{filename}" style="display: inline-block; padding: 0.25rem 0.75rem; background-color: #ff4b4b; color: white; text-decoration: none; border-radius: 0.25rem; font-weight: 500;">📥 下载高清图片</a>'
-    return href
-
-def validate_image_url(url):
-    """Validate if URL points to a valid image"""
-    try:
-        response = requests.head(url, timeout=10)
-        content_type = response.headers.get('content-type', '').lower()
-        return content_type.startswith('image/') and response.status_code == 200
-    except:
-        return False
-
-def get_image_info(image_source):
-    """Get image dimensions and format info"""
-    try:
-        if isinstance(image_source, str):  # URL
-            response = requests.get(image_source, timeout=10)
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content))
-        else:  # Uploaded file
-            image = Image.open(image_source)
-        
-        width, height = image.size
-        format_name = image.format or "JPEG"
-        
-        return {
-            "width": width,
-            "height": height,
-            "format": format_name,
-            "size_mb": len(response.content) / (1024*1024) if isinstance(image_source, str) else image_source.size / (1024*1024)
-        }
-    except Exception as e:
-        return {"error": str(e)}
+def init_job_manager():
+    manager = get_job_manager()
+    manager.recover("upscale", resume_upscale_job)
+    return manager
+
+job_manager = init_job_manager()
+
+@st.fragment(run_every=2)
+def poll_upscale_job(job_id):
+    """Show live job status; rerun the page once the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None or job["state"] in FINISHED_STATES:
+        st.rerun()
+    
+    elapsed = time.time() - (job["started_at"] or job["created_at"])
+    status = "排队中" if job["state"] == "queued" else "处理中"
+    st.info(f"🔄 {status}... 已用时 {elapsed:.0f} 秒" + (f"（ComfyUI 任务: {job['prompt_id']}）" if job["prompt_id"] else ""))
+    st.caption("💡 可以离开此页面或调整其他选项，任务会在后台继续运行")
+
+def show_download(artifact, filename, key):
+    """Offer the full-resolution file for download without inlining its bytes"""
+    if artifact.url:
+        # Served from disk by Streamlit's static file handler
+        st.markdown(
+            f'<a href="{artifact.url}" download="{filename}" style="display: inline-block; padding: 0.25rem 0.75rem; background-color: #ff4b4b; color: white; text-decoration: none; border-radius: 0.25rem; font-weight: 500;">📥 下载高清图片 ({artifact.size_mb:.1f} MB)</a>',
+            unsafe_allow_html=True
+        )
+    else:
+        with open(artifact.path, 'rb') as f:
+            st.download_button("📥 下载高清图片", data=f, file_name=filename, mime=artifact.mime_type, key=key)
+
+def show_timing_breakdown(timings):
+    """Per-stage timings of one request: download, normalize, upload, queue wait, GPU execution, fetch"""
+    if not timings:
+        return
+    with st.expander("⏱️ 耗时明细", expanded=True):
+        st.table([
+            {"阶段": item["stage"], "次数": item["count"], "累计耗时 (秒)": f"{item['seconds']:.2f}", "失败": item["errors"]}
+            for item in timings
+        ])
+        st.caption("并行执行的阶段（如分块、批量任务）耗时会重叠，累计值可能超过总耗时")
+
+@st.cache_data(ttl=600, max_entries=20, show_spinner="正在获取图片...")
+def fetch_image(url):
+    """Download a URL image once; validation, info, preview and upload all reuse it"""
+    return FetchedImage.from_url(url)
 
 # Streamlit App
 st.title("🔍 图像超分辨率处理")
@@ -57,27 +117,41 @@ st.markdown("---")
 
 # Description
 st.markdown("""
-**功能说明:** 使用 AI 技术将图像放大4倍，提升图像分辨率和清晰度。
+**功能说明:** 使用 AI 技术将图像放大2倍或4倍，提升图像分辨率和清晰度。
 
 **支持格式:** JPG, PNG, JPEG, WEBP  
-**处理模型:** RealESRGAN_x2.pth (4倍超分辨率)
+**处理模型:** RealESRGAN_x2.pth (2倍) / RealESRGAN_x4.pth (4倍)
 
 **使用方式:**
-1. 上传本地图片文件 或 输入图片链接
+1. 上传本地图片文件（支持批量） 或 输入图片链接
 2. 点击开始处理
 3. 等待处理完成后下载高清图片
 """)
 
+show_timings = st.sidebar.checkbox("⏱️ 显示耗时明细", value=False, help="按阶段显示下载、上传、排队、GPU 执行与获取结果等环节的耗时")
+
 # Input methods
 st.subheader("📤 选择图片输入方式")
 input_method = st.radio(
     "选择输入方式:",
-    ["📁 上传本地文件", "🔗 输入图片链接"],
+    ["📁 上传本地文件", "📚 批量上传文件", "🔗 输入图片链接"],
     horizontal=True
 )
 
+# Model selection; every choice is a registered, immutable workflow template
+upscale_templates = {template.name: template for template in list_templates()}
+template_name = st.selectbox(
+    "🧠 超分模型:",
+    options=list(upscale_templates.keys()),
+    index=list(upscale_templates.keys()).index(DEFAULT_UPSCALE_TEMPLATE),
+    format_func=lambda name: f"{upscale_templates[name].label} ({upscale_templates[name].model_name})"
+)
+upscale_template = upscale_templates[template_name]
+scale = upscale_template.scale
+
 image_source = None
 image_info = None
+batch_files = []
 
 if input_method == "📁 上传本地文件":
     uploaded_file = st.file_uploader(
@@ -87,16 +161,16 @@ if input_method == "📁 上传本地文件":
     )
     
     if uploaded_file:
-        image_source = uploaded_file
+        image_source = FetchedImage.from_upload(uploaded_file)
         
         # Display uploaded image
         col1, col2 = st.columns([1, 1])
         with col1:
-            st.image(uploaded_file, caption="原始图片", width=300)
+            st.image(image_source.data, caption="原始图片", width=300)
         
         with col2:
-            # Show image info
-            image_info = get_image_info(uploaded_file)
+            # Show image info (probed from the header bytes only)
+            image_info = image_source.info()
             if "error" not in image_info:
                 st.info(f"""
                 📊 **图片信息:**
@@ -105,12 +179,27 @@ if input_method == "📁 上传本地文件":
                 - 大小: {image_info['size_mb']:.2f} MB
                 
                 🎯 **处理后预期:**
-                - 尺寸: {image_info['width']*4} × {image_info['height']*4}
-                - 提升倍数: 4倍
+                - 尺寸: {image_info['width']*scale} × {image_info['height']*scale}
+                - 提升倍数: {scale}倍
                 """)
             else:
                 st.error(f"图片信息获取失败: {image_info['error']}")
 
+elif input_method == "📚 批量上传文件":
+    batch_files = st.file_uploader(
+        "选择多张图片文件:",
+        type=['jpg', 'jpeg', 'png', 'webp'],
+        accept_multiple_files=True,
+        help="可一次选择多张图片，所有图片会同时提交到 ComfyUI 队列"
+    ) or []
+    
+    if batch_files:
+        st.info(f"📚 已选择 {len(batch_files)} 张图片")
+        preview_cols = st.columns(min(len(batch_files), 4))
+        for idx, batch_file in enumerate(batch_files):
+            with preview_cols[idx % 4]:
+                st.image(batch_file, caption=batch_file.name, width=150)
+
 else:  # URL input
     image_url = st.text_input(
         "输入图片链接:",
@@ -119,20 +208,22 @@ else:  # URL input
     )
     
     if image_url:
-        if validate_image_url(image_url):
-            image_source = image_url
+        try:
+            fetched_image = fetch_image(image_url)
+        except Exception:
+            fetched_image = None
+        
+        if fetched_image is not None and fetched_image.is_image:
+            image_source = fetched_image
             
-            # Display image from URL
+            # Display the downloaded bytes instead of letting the browser fetch again
             col1, col2 = st.columns([1, 1])
             with col1:
-                try:
-                    st.image(image_url, caption="原始图片", width=300)
-                except:
-                    st.error("图片加载失败，请检查链接是否有效")
+                st.image(fetched_image.data, caption="原始图片", width=300)
             
             with col2:
-                # Show image info
-                image_info = get_image_info(image_url)
+                # Show image info (probed from the header bytes only)
+                image_info = fetched_image.info()
                 if "error" not in image_info:
                     st.info(f"""
                     📊 **图片信息:**
@@ -141,8 +232,8 @@ else:  # URL input
                     - 大小: {image_info['size_mb']:.2f} MB
                     
                     🎯 **处理后预期:**
-                    - 尺寸: {image_info['width']*4} × {image_info['height']*4}
-                    - 提升倍数: 4倍
+                    - 尺寸: {image_info['width']*scale} × {image_info['height']*scale}
+                    - 提升倍数: {scale}倍
                     """)
                 else:
                     st.error(f"图片信息获取失败: {image_info['error']}")
@@ -153,61 +244,135 @@ else:  # URL input
 st.markdown("---")
 st.subheader("🚀 开始处理")
 
-if image_source:
+if batch_files:
+    col1, col2 = st.columns([2, 1])
+    
+    with col1:
+        st.info(f"🔧 **批量处理设置:**\n- 超分模型: {upscale_template.model_name}\n- 图片数量: {len(batch_files)}\n- 同时处理: {UPSCALE_MAX_CONCURRENCY}")
+    
+    with col2:
+        batch_button = st.button("🎨 开始批量超分", type="primary", use_container_width=True)
+    
+    if batch_button:
+        progress = st.progress(0.0, text="🔄 正在上传图片并提交队列...")
+        result_cols = st.columns(min(len(batch_files), 2))
+        placeholders = []
+        for idx, batch_file in enumerate(batch_files):
+            with result_cols[idx % 2]:
+                placeholders.append(st.empty())
+                placeholders[idx].info(f"⏳ {batch_file.name} 等待处理...")
+        
+        done = 0
+        failed = 0
+        # Each result streams into its own file in the artifact store, which then adopts it without a copy
+        outputs = [artifact_store.temp_path() for _ in batch_files]
+        # Results arrive in completion order; each one fills its own slot
+        with trace() as batch_trace:
+            try:
+                for result in comfyui_client.upscale_batch(
+                    batch_files, max_workers=UPSCALE_MAX_CONCURRENCY, template=template_name, outputs=outputs
+                ):
+                    done += 1
+                    name = batch_files[result["index"]].name
+                    with placeholders[result["index"]].container():
+                        if result["error"]:
+                            failed += 1
+                            st.error(f"❌ {name} 处理失败: {result['error']}")
+                        else:
+                            artifact = artifact_store.create_from_file(result["image_data"])
+                            st.image(artifact.preview_path, caption=f"✨ {name}", width=400)
+                            show_download(artifact, f"upscaled_{name.rsplit('.', 1)[0]}.png", f"batch_download_{result['index']}")
+                    progress.progress(done / len(batch_files), text=f"已完成 {done}/{len(batch_files)}")
+            finally:
+                # Outputs of failed items were never adopted
+                for path in outputs:
+                    if os.path.exists(path):
+                        os.remove(path)
+        
+        if failed:
+            st.warning(f"⚠️ 批量处理完成，{failed} 张失败")
+        else:
+            st.success(f"✅ 全部 {len(batch_files)} 张图片超分处理完成!")
+        
+        if show_timings:
+            st.caption(f"⏱️ 总耗时 {batch_trace.elapsed:.1f} 秒")
+            show_timing_breakdown(batch_trace.breakdown())
+
+elif image_source:
     # Processing options
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        st.info("🔧 **处理设置:**\n- 超分模型: RealESRGAN_x2.pth\n- 放大倍数: 4倍\n- 预计处理时间: 30-120秒")
+        st.info(f"🔧 **处理设置:**\n- 超分模型: {upscale_template.model_name}\n- 放大倍数: {scale}倍\n- 预计处理时间: 30-120秒")
+        
+        # Large images are split into overlapping tiles processed in parallel
+        large_image = bool(image_info and "error" not in image_info and max(image_info['width'], image_info['height']) > UPSCALE_TILE_MIN_EDGE)
+        tiled = st.checkbox(
+            "🧩 分块超分",
+            value=large_image,
+            help=f"将图片切分为 {UPSCALE_TILE_SIZE}×{UPSCALE_TILE_SIZE} 的重叠小块（重叠 {UPSCALE_TILE_OVERLAP} 像素）并行处理后无缝拼接，适合大图，可降低单个任务显存占用"
+        )
     
     with col2:
         process_button = st.button("🎨 开始超分处理", type="primary", use_container_width=True)
     
     if process_button:
-        try:
-            with st.spinner("🔄 正在上传图片并处理，请稍候..."):
-                # Handle different input types - now both URL and file upload are supported
-                upscaled_image_data = comfyui_client.upscale_image(image_source)
-                
-                # Display results
-                st.success("✅ 图像超分处理完成!")
-                
-                col1, col2 = st.columns([1, 1])
-                
-                with col1:
-                    st.subheader("📷 原始图片")
-                    if isinstance(image_source, str):
-                        st.image(image_source, width=300)
-                    else:
-                        st.image(image_source, width=300)
-                
-                with col2:
-                    st.subheader("✨ 高清图片")
-                    st.image(upscaled_image_data, width=600)
-                
-                # Download section
-                st.markdown("---")
-                st.subheader("📥 下载高清图片")
-                
-                # Create download link
-                download_link = download_button_for_image(
-                    upscaled_image_data, 
-                    f"upscaled_image_4x.jpg"
-                )
-                st.markdown(download_link, unsafe_allow_html=True)
-                
-                # Processing stats
-                if image_info and "error" not in image_info:
-                    st.success(f"""
-                    🎯 **处理完成统计:**
-                    - 原始尺寸: {image_info['width']} × {image_info['height']}
-                    - 处理后尺寸: {image_info['width']*4} × {image_info['height']*4}
-                    - 像素提升: {((image_info['width']*4 * image_info['height']*4) / (image_info['width'] * image_info['height'])):.1f}倍
-                    """)
-                    
-        except Exception as e:
-            st.error(f"❌ 图像处理失败: {e}")
-            st.info("💡 请检查：\n- 图片链接是否有效\n- 网络连接是否正常\n- ComfyUI 服务是否可用")
+        # Submit to the background worker; the page only keeps the job id
+        source_file = image_source.as_file()
+        job_id = job_manager.submit(
+            "upscale", run_upscale_job, image_source.data, source_file.name, template_name, tiled,
+            params={"source": image_source.digest, "filename": source_file.name, "template": template_name, "tiled": tiled}
+        )
+        st.session_state["upscale_job"] = {"source": image_source.digest, "template": template_name, "tiled": tiled, "job_id": job_id}
+    
+    # Reattach to this input's job across reruns
+    upscale_job = st.session_state.get("upscale_job")
+    job = None
+    if (upscale_job and upscale_job["source"] == image_source.digest
+            and upscale_job.get("template") == template_name and upscale_job.get("tiled") == tiled):
+        job = job_manager.get(upscale_job["job_id"])
+    
+    artifact = None
+    if job and job["state"] not in FINISHED_STATES:
+        poll_upscale_job(job["id"])
+    elif job and job["state"] == DONE:
+        artifact = artifact_store.get(job["result"]["artifact_id"])
+        if artifact is None:
+            st.warning("⚠️ 该结果已过期清理，请重新处理")
+    elif job:
+        st.error(f"❌ 图像处理失败: {job['error']}")
+        st.info("💡 请检查：\n- 图片链接是否有效\n- 网络连接是否正常\n- ComfyUI 服务是否可用")
+    
+    if artifact:
+        # Display results
+        st.success(f"✅ 图像超分处理完成! 耗时 {job['finished_at'] - job['created_at']:.1f} 秒")
+        
+        col1, col2 = st.columns([1, 1])
+        
+        with col1:
+            st.subheader("📷 原始图片")
+            st.image(image_source.data, width=300)
+        
+        with col2:
+            st.subheader("✨ 高清图片")
+            st.image(artifact.preview_path, width=600)
+        
+        # Download section
+        st.markdown("---")
+        st.subheader("📥 下载高清图片")
+        show_download(artifact, f"upscaled_image_{scale}x.{artifact.path.rsplit('.', 1)[-1]}", "single_download")
+        
+        if show_timings:
+            show_timing_breakdown(job["result"].get("timings"))
+        
+        # Processing stats
+        if image_info and "error" not in image_info:
+            st.success(f"""
+            🎯 **处理完成统计:**
+            - 原始尺寸: {image_info['width']} × {image_info['height']}
+            - 处理后尺寸: {image_info['width']*scale} × {image_info['height']*scale}
+            - 像素提升: {scale * scale:.1f}倍
+            """)
 
 else:
     st.info("👆 请先选择要处理的图片")
@@ -220,11 +385,12 @@ with st.expander("ℹ️ 技术说明"):
     - 使用 RealESRGAN 模型进行图像超分辨率处理
     - 基于生成对抗网络(GAN)技术
     - 专门针对真实图像场景进行优化
+    - 大图可分块处理：重叠小块并行超分，重叠区域羽化融合，避免接缝
     
     **处理流程:**
     1. 图片上传到 ComfyUI 服务器
-    2. 加载 RealESRGAN_x2.pth 模型
-    3. 执行4倍超分辨率处理
+    2. 加载所选 RealESRGAN 模型（x2 / x4）
+    3. 执行对应倍数的超分辨率处理
     4. 返回高清图片结果
     
     **最佳效果建议:**
@@ -233,5 +399,13 @@ with st.expander("ℹ️ 技术说明"):
     - 避免过度压缩的图片
     """)
 
+# Backend rotation, refreshed by the pool's health checks
+backend_status = comfyui_client.status()
+if len(backend_status) > 1:
+    with st.expander(f"🖥️ ComfyUI 服务节点 ({sum(1 for backend in backend_status if backend['healthy'])}/{len(backend_status)} 可用)"):
+        for backend in backend_status:
+            state = "✅ 可用" if backend["healthy"] else "❌ 已移出轮换"
+            st.markdown(f"- `{backend['base_url']}` {state}，队列中 {backend['queue_remaining']}，本机提交 {backend['in_flight']}")
+
 st.markdown("---")
 st.caption("🤖 Powered by ComfyUI & RealESRGAN") 
\ No newline at end of file
@@ -0,0 +1,114 @@
+# coding:utf-8
+"""AsyncComfyUIClient against the local stand-in ComfyUI"""
+import pytest
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI, make_png
+from lib.async_comfyui_client import upscale_many_sync
+from lib.comfyui_client import ComfyUIClient
+from lib.upscale_cache import UpscaleCache
+from lib.workflow_templates import UPSCALE_GRAPH, UPSCALE_SLOTS, WorkflowTemplate
+
+
+INPUTS = [make_png(16, 16, seed=index) for index in range(6)]
+
+
+@pytest.fixture
+def comfyui():
+    with FakeComfyUI(api=Behavior(latency=0), processing=Behavior(latency=0.05), workers=4, result_size=(32, 32)) as server:
+        yield server
+
+
+def test_upscale_many_keeps_order(comfyui):
+    results = upscale_many_sync(INPUTS, ComfyUIClient(comfyui.base_url, normalize=False), max_in_flight=4, timeout=10)
+
+    assert [result["index"] for result in results] == list(range(len(INPUTS)))
+    assert all(result["error"] is None and result["image_data"] == comfyui.result_png for result in results)
+
+
+def test_upscale_many_uses_template_and_cache(comfyui, tmp_path, monkeypatch):
+    client = ComfyUIClient(comfyui.base_url, normalize=False, cache=UpscaleCache(str(tmp_path)))
+    templates = []
+    build_workflow = client._build_upscale_workflow
+    monkeypatch.setattr(client, "_build_upscale_workflow", lambda name, template=None: (
+        templates.append(template.name), build_workflow(name, template)
+    )[1])
+
+    first = upscale_many_sync(INPUTS[:2], client, timeout=10, template="realesrgan_x4")
+    second = upscale_many_sync(INPUTS[:2], client, timeout=10, template="realesrgan_x4")
+
+    assert templates == ["realesrgan_x4", "realesrgan_x4"]
+    assert [result["image_data"] for result in second] == [result["image_data"] for result in first]
+
+
+def test_identical_inputs_share_one_job(comfyui, tmp_path):
+    client = ComfyUIClient(comfyui.base_url, normalize=False, cache=UpscaleCache(str(tmp_path)))
+
+    results = upscale_many_sync([INPUTS[0]] * 4, client, timeout=10)
+
+    assert all(result["image_data"] == comfyui.result_png for result in results)
+    assert len(comfyui._prompts) == 1
+
+
+def test_failed_jobs_leave_no_temp_files(comfyui, tmp_path, monkeypatch):
+    client = ComfyUIClient(comfyui.base_url, normalize=False, cache=UpscaleCache(str(tmp_path)))
+
+    def broken_fetch(result_images, sink=None):
+        with open(sink, "wb") as f:
+            f.write(b"partial")
+        raise Exception("connection reset")
+
+    monkeypatch.setattr(client, "_fetch_first_image", broken_fetch)
+    results = upscale_many_sync(INPUTS[:2], client, timeout=10)
+
+    assert all("connection reset" in result["error"] for result in results)
+    assert list(tmp_path.rglob("*.tmp")) == []
+
+
+def test_failed_workflow_leaves_no_temp_files(tmp_path):
+    processing = Behavior(latency=0.05, error_rate=1.0)
+    with FakeComfyUI(api=Behavior(latency=0), processing=processing, result_size=(32, 32)) as server:
+        client = ComfyUIClient(server.base_url, normalize=False, cache=UpscaleCache(str(tmp_path)))
+        results = upscale_many_sync(INPUTS[:2], client, timeout=10)
+
+    assert all(result["error"] and result["image_data"] is None for result in results)
+    assert list(tmp_path.rglob("*.tmp")) == []
+
+
+def save_image_template():
+    # The upscale graph with its result saved by node 9 instead of previewed by node 7
+    graph = dict(UPSCALE_GRAPH, **{"9": {"inputs": {"images": ["4", 0], "filename_prefix": "up"}, "class_type": "SaveImage"}})
+    del graph["7"]
+    return WorkflowTemplate("save_x4", graph, UPSCALE_SLOTS, output_node="9", defaults={"model_name": "Save_x4.pth"}, scale=4)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_template_reaches_the_workflow_and_the_wait(tmp_path, monkeypatch, cached):
+    template = save_image_template()
+    with FakeComfyUI(api=Behavior(latency=0), processing=Behavior(latency=0.05), result_size=(32, 32), output_node="9") as server:
+        client = ComfyUIClient(server.base_url, normalize=False, cache=UpscaleCache(str(tmp_path)) if cached else None)
+        client.poll_initial_interval = 0.05
+        workflows = []
+        queue_prompt = client.queue_prompt
+        monkeypatch.setattr(client, "queue_prompt", lambda workflow, client_id: (
+            workflows.append(workflow), queue_prompt(workflow, client_id)
+        )[1])
+
+        results = upscale_many_sync(INPUTS[:2], client, timeout=10, template=template)
+
+    # Results are only found when the wait looks at the template's output node
+    assert all(result["error"] is None and result["image_data"] == server.result_png for result in results)
+    assert [workflow["2"]["inputs"]["model_name"] for workflow in workflows] == ["Save_x4.pth"] * 2
+    assert all("9" in workflow and "7" not in workflow for workflow in workflows)
+
+
+def test_default_template_is_the_clients(comfyui, monkeypatch):
+    client = ComfyUIClient(comfyui.base_url, normalize=False, template="realesrgan_x4")
+    templates = []
+    build_workflow = client._build_upscale_workflow
+    monkeypatch.setattr(client, "_build_upscale_workflow", lambda name, template=None: (
+        templates.append(template.name), build_workflow(name, template)
+    )[1])
+
+    upscale_many_sync(INPUTS[:1], client, timeout=10)
+
+    assert templates == ["realesrgan_x4"]
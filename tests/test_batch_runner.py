@@ -0,0 +1,57 @@
+# coding:utf-8
+"""Batch input parsing and resume behaviour"""
+import json
+
+from lib.batch_runner import FAILED, OK, PARTIAL, BatchRunner, read_items
+
+
+class NoServices:
+    def __getattr__(self, name):
+        raise AssertionError(f"service used: {name}")
+
+
+def write_lines(path, lines):
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_read_items_reports_unusable_rows_as_invalid(tmp_path):
+    path = write_lines(tmp_path / "items.jsonl", [
+        '"a plain prompt"',
+        '{"id": "poster", "prompt": "an object", "count": "2"}',
+        '["a", "list"]',
+        '42',
+        '{"id": "empty"}',
+        '{not json',
+    ])
+
+    items = read_items(path)
+
+    assert items[0] == {"prompt": "a plain prompt", "id": "000001"}
+    assert items[1] == {"id": "poster", "prompt": "an object", "count": 2}
+    assert [item["id"] for item in items[2:]] == ["000003", "000004", "empty", "000006"]
+    assert "got list" in items[2]["invalid"]
+    assert "got int" in items[3]["invalid"]
+    assert "needs a prompt or an image" in items[4]["invalid"]
+    assert "invalid JSON" in items[5]["invalid"]
+
+
+def test_invalid_item_is_recorded_as_failed(tmp_path):
+    runner = BatchRunner(NoServices(), NoServices(), str(tmp_path / "out"))
+
+    record = runner.process({"id": "000003", "invalid": "Item 3: expected an object or a prompt string, got list"})
+
+    assert record["status"] == FAILED
+    assert record["error"] == "Item 3: expected an object or a prompt string, got list"
+
+
+def test_resume_skips_only_ok_items(tmp_path):
+    runner = BatchRunner(NoServices(), NoServices(), str(tmp_path / "out"))
+    with open(runner.manifest_path, "w", encoding="utf-8") as f:
+        for item_id, status in (("a", OK), ("b", PARTIAL), ("c", FAILED)):
+            f.write(json.dumps({"id": item_id, "status": status}) + "\n")
+        f.write('"not a record"\n')
+
+    items = [{"id": item_id, "prompt": item_id} for item_id in ("a", "b", "c", "d")]
+
+    assert [item["id"] for item in runner.pending(items)] == ["b", "c", "d"]
@@ -0,0 +1,136 @@
+# coding:utf-8
+"""ComfyUIClient completion paths against the local stand-in ComfyUI"""
+import pytest
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI, make_png
+from lib.comfyui_client import ComfyUIClient, websocket
+from lib.upscale_cache import UpscaleCache
+
+
+INPUT_PNG = make_png(32, 32)
+
+
+@pytest.fixture
+def comfyui():
+    with FakeComfyUI(api=Behavior(latency=0), processing=Behavior(latency=0.1), result_size=(64, 64)) as server:
+        yield server
+
+
+@pytest.fixture
+def failing_comfyui():
+    processing = Behavior(latency=0.1, error_rate=1.0)
+    with FakeComfyUI(api=Behavior(latency=0), processing=processing, result_size=(64, 64)) as server:
+        yield server
+
+
+def make_client(server, use_websocket=True):
+    client = ComfyUIClient(server.base_url, use_websocket=use_websocket, normalize=False)
+    client.poll_initial_interval = 0.05
+    client.poll_max_interval = 0.2
+    return client
+
+
+def queue_upscale(client, client_id="test-client"):
+    uploaded_filename = client.upload_image(INPUT_PNG)
+    return client.queue_prompt(client._build_upscale_workflow(uploaded_filename), client_id)
+
+
+def fail_polling(*args, **kwargs):
+    raise AssertionError("polling fallback used")
+
+
+@pytest.mark.skipif(websocket is None, reason="websocket-client not installed")
+def test_websocket_completion(comfyui, monkeypatch):
+    client = make_client(comfyui)
+    monkeypatch.setattr(client, "_wait_via_polling", fail_polling)
+
+    ws = client.open_event_socket("test-client")
+    assert ws is not None
+    try:
+        prompt_id = queue_upscale(client, client_id="test-client")
+        images = client.wait_for_completion(prompt_id, timeout=10, ws=ws)
+    finally:
+        ws.close()
+
+    assert images == [{"filename": f"{prompt_id}.png", "subfolder": "", "type": "temp"}]
+
+
+@pytest.mark.skipif(websocket is None, reason="websocket-client not installed")
+def test_upscale_image_over_websocket(comfyui, monkeypatch):
+    client = make_client(comfyui)
+    monkeypatch.setattr(client, "_wait_via_polling", fail_polling)
+
+    assert client.upscale_image(INPUT_PNG) == comfyui.result_png
+
+
+def test_polling_without_websocket(comfyui):
+    client = make_client(comfyui, use_websocket=False)
+    assert client.open_event_socket("test-client") is None
+
+    assert client.upscale_image(INPUT_PNG) == comfyui.result_png
+
+
+@pytest.mark.skipif(websocket is None, reason="websocket-client not installed")
+def test_polling_fallback_when_socket_drops(comfyui):
+    client = make_client(comfyui)
+
+    class DroppedSocket:
+        def settimeout(self, timeout):
+            pass
+
+        def recv(self):
+            raise websocket.WebSocketConnectionClosedException("socket closed")
+
+    prompt_id = queue_upscale(client)
+    images = client.wait_for_completion(prompt_id, timeout=10, ws=DroppedSocket())
+
+    assert images[0]["filename"] == f"{prompt_id}.png"
+
+
+@pytest.mark.skipif(websocket is None, reason="websocket-client not installed")
+def test_execution_error_over_websocket(failing_comfyui, monkeypatch):
+    client = make_client(failing_comfyui)
+    monkeypatch.setattr(client, "_wait_via_polling", fail_polling)
+
+    ws = client.open_event_socket("test-client")
+    try:
+        prompt_id = queue_upscale(client, client_id="test-client")
+        with pytest.raises(Exception, match="Workflow failed: injected failure"):
+            client.wait_for_completion(prompt_id, timeout=10, ws=ws)
+    finally:
+        ws.close()
+
+
+def test_execution_error_while_polling(failing_comfyui):
+    client = make_client(failing_comfyui, use_websocket=False)
+
+    with pytest.raises(Exception, match="failed on ComfyUI"):
+        client.upscale_image(INPUT_PNG)
+
+
+def test_batch_streams_results_into_outputs(comfyui, tmp_path):
+    client = make_client(comfyui, use_websocket=False)
+    client.cache = UpscaleCache(str(tmp_path / "cache"))
+    outputs = [str(tmp_path / f"{index}.png") for index in range(2)]
+
+    first = list(client.upscale_batch([INPUT_PNG, make_png(24, 24)], template="realesrgan_x2", outputs=outputs))
+    # Served from the cache the second time, copied into a fresh output
+    again = list(client.upscale_batch([INPUT_PNG], template="realesrgan_x2", outputs=[str(tmp_path / "again.png")]))
+
+    assert sorted(result["image_data"] for result in first) == outputs
+    assert again == [{"index": 0, "image_data": str(tmp_path / "again.png"), "error": None}]
+    assert len(comfyui._prompts) == 2
+    for path in outputs + [str(tmp_path / "again.png")]:
+        with open(path, "rb") as f:
+            assert f.read() == comfyui.result_png
+
+
+def test_batch_without_cache_fetches_into_outputs(comfyui, tmp_path):
+    client = make_client(comfyui, use_websocket=False)
+    output = str(tmp_path / "out.png")
+
+    results = list(client.upscale_batch([INPUT_PNG], outputs=[output]))
+
+    assert results == [{"index": 0, "image_data": output, "error": None}]
+    with open(output, "rb") as f:
+        assert f.read() == comfyui.result_png
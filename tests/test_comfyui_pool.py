@@ -0,0 +1,82 @@
+# coding:utf-8
+"""ComfyUIPool routing and health handling"""
+import socket
+
+import pytest
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI, make_png
+from lib.comfyui_pool import ComfyUIPool
+from lib.http_transport import HttpTransport
+
+
+def unused_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+@pytest.fixture
+def comfyui():
+    with FakeComfyUI(api=Behavior(latency=0), processing=Behavior(latency=0.05), result_size=(32, 32)) as server:
+        yield server
+
+
+def test_unhealthy_backends_still_take_jobs(comfyui):
+    # One backend that fails health checks, e.g. a brief outage of the only server
+    pool = ComfyUIPool([comfyui.base_url], health_check_interval=0, normalize=False)
+    backend = pool.backends[0]
+    backend.client.get_queue_remaining = lambda timeout=5: (_ for _ in ()).throw(Exception("down"))
+    pool.check_health()
+    pool.check_health()
+    assert not backend.healthy
+
+    assert pool.upscale_image(make_png(16, 16)) == comfyui.result_png
+
+
+def test_least_recently_failed_backend_is_tried_first(comfyui):
+    pool = ComfyUIPool([unused_url(), comfyui.base_url], health_check_interval=0, normalize=False)
+    for backend in pool.backends:
+        backend.healthy = False
+    pool.backends[0].last_failure = 2.0
+    pool.backends[1].last_failure = 1.0
+
+    with pool.lease() as client:
+        assert client.base_url == comfyui.base_url
+
+
+def test_routes_to_healthy_backend_by_queue_depth(comfyui):
+    pool = ComfyUIPool(
+        [unused_url(), comfyui.base_url], health_check_interval=0, max_failures=1,
+        normalize=False, transport=HttpTransport(max_retries=0)
+    )
+    pool.check_health()
+    assert [backend["healthy"] for backend in pool.status()] == [False, True]
+
+    with pool.lease() as client:
+        assert client.base_url == comfyui.base_url
+
+
+def test_routed_jobs_are_not_counted_twice(comfyui):
+    pool = ComfyUIPool([comfyui.base_url, comfyui.base_url + "/"], health_check_interval=0, normalize=False)
+    first, second = pool.backends
+    # Two jobs sent to the first backend, both now reported in its server queue
+    first.in_flight, first.queue_remaining = 2, 2
+    second.in_flight, second.queue_remaining = 0, 3
+
+    with pool.lease() as client:
+        assert client is first.client
+
+
+def test_tiles_are_spread_over_backends():
+    processing = Behavior(latency=0.2)
+    with FakeComfyUI(api=Behavior(latency=0), processing=processing, result_size=(64, 64)) as first, \
+            FakeComfyUI(api=Behavior(latency=0), processing=processing, result_size=(64, 64)) as second:
+        pool = ComfyUIPool([first.base_url, second.base_url], health_check_interval=0, normalize=False)
+
+        # 28x28 in 16px tiles with 4px overlap: a 2x2 grid of 16x16 tiles
+        result = pool.upscale_image_tiled(make_png(28, 28), tile_size=16, overlap=4, max_workers=4, template="realesrgan_x4")
+
+    assert result.startswith(b"\x89PNG")
+    assert len(first._prompts) > 0 and len(second._prompts) > 0
+    assert len(first._prompts) + len(second._prompts) == 4
+    assert all(backend.in_flight == 0 for backend in pool.backends)
@@ -0,0 +1,92 @@
+# coding:utf-8
+"""Generation cache entries are whole and always served as local paths"""
+import os
+
+import pytest
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI
+from lib.batch_runner import BatchRunner
+from lib.comfyui_client import ComfyUIClient
+from lib.generation_cache import GenerationCache
+from lib.poster_generator import PosterGenerator
+
+
+BODY = {"req_key": "high_aes_general_v30l_zt2i", "prompt": "poster", "seed": 7, "return_url": True}
+
+
+@pytest.fixture
+def image_server():
+    # /view of the stand-in ComfyUI serves a PNG for any filename
+    with FakeComfyUI(api=Behavior(latency=0), result_size=(32, 32)) as server:
+        yield server
+
+
+def image_urls(server, n):
+    return [f"{server.base_url}/view?filename={index}.png" for index in range(n)]
+
+
+def test_hit_and_miss_both_return_local_paths(tmp_path, image_server):
+    cache = GenerationCache(str(tmp_path / "cache"))
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return image_urls(image_server, 2)
+
+    miss = cache.get_or_generate(BODY, generate)
+    hit = cache.get_or_generate(BODY, generate)
+
+    assert len(calls) == 1
+    assert miss == hit
+    assert all(os.path.exists(path) for path in hit)
+
+
+def test_partly_evicted_entry_is_a_miss(tmp_path, image_server):
+    cache = GenerationCache(str(tmp_path / "cache"))
+    paths = cache.get_or_generate(BODY, lambda: image_urls(image_server, 3))
+
+    os.remove(paths[1])
+
+    assert cache.get(cache.make_key(BODY)) is None
+    regenerated = cache.get_or_generate(BODY, lambda: image_urls(image_server, 3))
+    assert regenerated == paths and all(os.path.exists(path) for path in regenerated)
+
+
+def test_local_paths_are_accepted_downstream(tmp_path, image_server):
+    cache = GenerationCache(str(tmp_path / "cache"))
+    path = cache.get_or_generate(BODY, lambda: image_urls(image_server, 1))[0]
+
+    client = ComfyUIClient(image_server.base_url, use_websocket=False, normalize=True)
+    assert client.upload_image(path)
+    assert client._upload_source(path, client.template)
+
+    runner = BatchRunner(None, client, str(tmp_path / "out"))
+    saved = runner._download(path, "poster")
+    assert saved.endswith(".png") and os.path.getsize(saved) == os.path.getsize(path)
+
+
+def test_detailed_result_flags_only_real_generations_as_misses(tmp_path, image_server):
+    cache = GenerationCache(str(tmp_path / "cache"))
+
+    paths, hit = cache.get_or_generate_detailed(BODY, lambda: image_urls(image_server, 1))
+    again, hit_again = cache.get_or_generate_detailed(BODY, lambda: pytest.fail("generated twice"))
+
+    assert (hit, hit_again) == (False, True)
+    assert again == paths
+
+
+def test_poster_generator_reports_cached_results(tmp_path, image_server):
+    generator = PosterGenerator("ak", "sk", "key", "http://127.0.0.1:9", "model",
+                                generation_cache=GenerationCache(str(tmp_path / "cache")))
+    calls = []
+    generator._request_images = lambda body: calls.append(body) or image_urls(image_server, 1)
+    body = dict(BODY, logo_info={"add_logo": True, "logo_text_content": "mark"})
+
+    first = generator.generate_from_body(body)
+    second = generator.generate_from_body(body)
+    unseeded = generator.generate_from_body(dict(body, seed=-1))
+
+    assert (first["cached"], second["cached"], unseeded["cached"]) == (False, True, False)
+    assert first["urls"] == second["urls"] and os.path.exists(first["urls"][0])
+    assert unseeded["urls"][0].startswith("http://")
+    assert len(calls) == 2
@@ -0,0 +1,61 @@
+# coding:utf-8
+"""Archive files and index rows stay consistent under eviction and deletion"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_servers import make_png
+from lib.image_archive import ImageArchive
+
+
+def test_readding_a_deleted_file_writes_it_again(tmp_path):
+    archive = ImageArchive(str(tmp_path / "archive"))
+    data = make_png(16, 16)
+
+    first = archive.add(data, prompt="a")
+    os.remove(first["path"])
+    second = archive.add(data, prompt="a")
+
+    assert second["id"] == first["id"]
+    assert os.path.exists(second["path"])
+
+
+def test_prune_drops_rows_only_for_missing_files(tmp_path):
+    archive = ImageArchive(str(tmp_path / "archive"))
+    kept = archive.add(make_png(16, 16), prompt="kept")
+    gone = archive.add(make_png(24, 24), prompt="gone")
+    os.remove(gone["path"])
+
+    assert archive.prune(kept["sha256"]) is False
+    assert archive.prune(gone["sha256"]) is True
+    assert [entry["prompt"] for entry in archive.search()] == ["kept"]
+
+
+def test_concurrent_adds_and_evictions_keep_every_row_backed_by_a_file(tmp_path):
+    images = [make_png(8 + index, 8) for index in range(40)]
+    # Room for only a few files, so most adds evict another image
+    archive = ImageArchive(str(tmp_path / "archive"), max_bytes=sum(map(len, images[:4])), max_workers=8)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda data: archive.add(data), images * 3))
+
+    entries = archive.search(limit=None)
+    assert entries
+    assert all(os.path.exists(entry["path"]) for entry in entries)
+
+
+def test_submitted_path_survives_the_caller_moving_it(tmp_path):
+    archive = ImageArchive(str(tmp_path / "archive"))
+    data = make_png(32, 32)
+    source = tmp_path / "result.png.partial"
+    source.write_bytes(data)
+
+    future = archive.submit(str(source), kind="upscaled")
+    source.rename(tmp_path / "result.png")  # As batch runs do right after the upscale returns
+    entry = future.result()
+
+    assert entry["size"] == len(data)
+    with open(entry["path"], "rb") as f:
+        assert f.read() == data
+    assert entry["sha256"] == hashlib.sha256(data).hexdigest()
+    assert not [name for name in os.listdir(tmp_path / "archive") if name.endswith((".tmp", ".staged"))]
@@ -0,0 +1,105 @@
+# coding:utf-8
+"""Metadata stripping, ICC handling and streamed normalized uploads"""
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI
+from lib.comfyui_client import ComfyUIClient
+from lib.image_normalizer import ImageCms, normalize_image, prepare_image
+
+
+def make_jpeg(size=(64, 48), mode="RGB", orientation=None, icc_profile=None):
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    if orientation:
+        exif[0x0112] = orientation
+    options = {"exif": exif.tobytes()}
+    if icc_profile:
+        options["icc_profile"] = icc_profile
+    buffer = BytesIO()
+    Image.new(mode, size, (200, 40, 40, 0)[:len(mode)]).save(buffer, "JPEG", **options)
+    return buffer.getvalue()
+
+
+def non_srgb_profile():
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile("LAB")).tobytes()
+
+
+def read_back(normalized):
+    return Image.open(BytesIO(b"".join(normalized.iter_chunks())))
+
+
+def test_unchanged_jpeg_is_stripped_without_decoding(monkeypatch):
+    data = make_jpeg()
+    monkeypatch.setattr(Image.Image, "load", lambda self: pytest.fail("pixels decoded"))
+
+    normalized = normalize_image(BytesIO(data))
+
+    assert normalized.data is None
+    assert normalized.format == "JPEG"
+    assert (normalized.width, normalized.height) == (64, 48)
+    assert normalized.saved_bytes > 0
+    assert b"Exif" not in b"".join(normalized.iter_chunks())
+
+
+def test_exif_rotation_is_applied():
+    normalized = normalize_image(make_jpeg(orientation=6))
+
+    assert normalized.data is not None
+    assert (normalized.width, normalized.height) == (48, 64)
+    assert "exif" not in read_back(normalized).info
+
+
+@pytest.mark.skipif(ImageCms is None, reason="Pillow built without LittleCMS")
+def test_cmyk_profile_is_kept():
+    profile = non_srgb_profile()
+    data = make_jpeg(mode="CMYK", icc_profile=profile)
+
+    stripped = normalize_image(data)
+    resized = normalize_image(data, max_edge=32)
+
+    assert stripped.data is None
+    assert read_back(stripped).info.get("icc_profile") == profile
+    image = read_back(resized)
+    assert (image.mode, image.size) == ("CMYK", (32, 24))
+    assert image.info.get("icc_profile") == profile
+
+
+@pytest.mark.skipif(ImageCms is None, reason="Pillow built without LittleCMS")
+def test_failed_conversion_keeps_profile():
+    # An RGB image tagged with a Lab profile cannot be converted to sRGB
+    profile = non_srgb_profile()
+    normalized = normalize_image(make_jpeg(icc_profile=profile))
+
+    assert normalized.data is not None
+    assert read_back(normalized).info.get("icc_profile") == profile
+
+
+def test_prepare_image_returns_loaded_pixels():
+    image, source_format, changed = prepare_image(make_jpeg(), max_edge=32)
+
+    assert (source_format, changed) == ("JPEG", True)
+    assert image.size == (32, 24)
+
+
+def test_normalized_upload_streams_without_reading_the_source():
+    uploads = []
+    with FakeComfyUI(api=Behavior(latency=0)) as server:
+        client = ComfyUIClient(server.base_url, use_websocket=False, normalize=True)
+        client._read_image_source = lambda *args: pytest.fail("source read whole")
+        post_image_stream = client._post_image_stream
+
+        def capture(chunks, filename, content_type="image/jpeg"):
+            body = b"".join(chunks)
+            uploads.append((body, filename, content_type))
+            return post_image_stream([body], filename, content_type)
+
+        client._post_image_stream = capture
+        client._upload_source(BytesIO(make_jpeg()), client.template)
+
+    body, filename, content_type = uploads[0]
+    assert (filename.endswith(".jpg"), content_type) == (True, "image/jpeg")
+    assert b"Exif" not in body
+    assert Image.open(BytesIO(body)).size == (64, 48)
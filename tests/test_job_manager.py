@@ -0,0 +1,51 @@
+# coding:utf-8
+"""Jobs always reach a finished state"""
+import time
+
+from lib.job_manager import DONE, FAILED, FINISHED_STATES, JobManager
+
+
+def wait_finished(manager, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["state"] in FINISHED_STATES:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job still {manager.get(job_id)['state']}")
+
+
+def test_result_and_paths_are_stored(tmp_path):
+    manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+
+    job = wait_finished(manager, manager.submit("test", lambda job: {"paths": ["a.png"], "n": 1}))
+
+    assert job["state"] == DONE
+    assert job["result"] == {"paths": ["a.png"], "n": 1}
+    assert job["result_paths"] == ["a.png"]
+
+
+def test_unserializable_result_marks_the_job_failed(tmp_path):
+    manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+
+    job = wait_finished(manager, manager.submit("test", lambda job: {"data": b"raw bytes"}))
+
+    assert job["state"] == FAILED
+    assert "not JSON serializable" in job["error"]
+    assert job["finished_at"] is not None
+
+
+def test_storage_error_on_completion_marks_the_job_failed(tmp_path, monkeypatch):
+    manager = JobManager(str(tmp_path / "jobs.db"), max_workers=1)
+    update = manager._update
+
+    def flaky_update(job_id, **fields):
+        if fields.get("state") == DONE:
+            raise Exception("database is locked")
+        update(job_id, **fields)
+    monkeypatch.setattr(manager, "_update", flaky_update)
+
+    job = wait_finished(manager, manager.submit("test", lambda job: {"n": 1}))
+
+    assert job["state"] == FAILED
+    assert job["error"] == "database is locked"
@@ -0,0 +1,106 @@
+# coding:utf-8
+"""Stage histograms, counters, traces and the Prometheus endpoint"""
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+import pytest
+
+from lib.metrics import Histogram, MetricsRegistry, Trace, start_metrics_server, trace
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(0.1, 1), (1, 3), (float("inf"), 4)]
+    assert histogram.count == 4 and histogram.sum == pytest.approx(6.25)
+
+
+def test_span_records_errors_and_reraises():
+    metrics = MetricsRegistry()
+
+    with metrics.span("comfyui.upload", backend="a"):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span("comfyui.upload", backend="a"):
+            raise ValueError("refused")
+
+    stages = sorted(metrics.snapshot()["stages"], key=lambda stage: stage["status"])
+    assert [(stage["status"], stage["count"], stage["backend"]) for stage in stages] == [("error", 1, "a"), ("ok", 1, "a")]
+
+
+def test_counters_add_up_per_label_set():
+    metrics = MetricsRegistry()
+    metrics.count("upscale_cache", result="hit")
+    metrics.count("upscale_cache", result="hit")
+    metrics.count("upscale_cache", result="miss")
+    metrics.count("archived", value=3, kind=None)  # None labels are dropped
+
+    counters = {(counter["name"], counter.get("result")): counter["value"] for counter in metrics.snapshot()["counters"]}
+    assert counters == {("upscale_cache", "hit"): 2, ("upscale_cache", "miss"): 1, ("archived", None): 3}
+
+
+def test_trace_collects_spans_from_worker_threads():
+    metrics = MetricsRegistry()
+
+    def work(stage):
+        with metrics.span(stage):
+            pass
+
+    with trace() as current:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, work, stage) for stage in ("fetch", "fetch", "upload")]
+            for future in futures:
+                future.result()
+        # A plain thread does not inherit the context, so its span is not collected
+        thread = threading.Thread(target=work, args=("outside",))
+        thread.start()
+        thread.join()
+    with metrics.span("after"):
+        pass
+
+    assert {entry["stage"]: entry["count"] for entry in current.breakdown()} == {"fetch": 2, "upload": 1}
+
+
+def test_breakdown_counts_errors_per_stage():
+    current = Trace()
+    current.add("wait", 1.5, "ok")
+    current.add("wait", 0.5, "error")
+
+    assert current.breakdown() == [{"stage": "wait", "count": 2, "seconds": 2.0, "errors": 1}]
+
+
+def test_prometheus_text_format():
+    metrics = MetricsRegistry(prefix="test", buckets=(1,))
+    metrics.record("comfyui.wait", 0.5, backend='gpu "1"')
+    metrics.count("throttled", limiter="volcengine")
+
+    text = metrics.render_prometheus()
+
+    assert "# TYPE test_stage_duration_seconds histogram" in text
+    labels = 'backend="gpu \\"1\\"",stage="comfyui.wait",status="ok"'
+    assert f'test_stage_duration_seconds_bucket{{{labels},le="1.0"}} 1' in text
+    assert f'test_stage_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    assert f"test_stage_duration_seconds_count{{{labels}}} 1" in text
+    assert "# TYPE test_throttled_total counter" in text
+    assert 'test_throttled_total{limiter="volcengine"} 1' in text
+
+
+def test_metrics_endpoint_serves_the_registry():
+    metrics = MetricsRegistry(prefix="served")
+    metrics.count("requests")
+    server = start_metrics_server(0, metrics_registry=metrics)
+    try:
+        host, port = server.server_address
+        with urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+            body = response.read().decode("utf-8")
+            content_type = response.headers["Content-Type"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "served_requests_total 1" in body
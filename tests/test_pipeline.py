@@ -0,0 +1,133 @@
+# coding:utf-8
+"""Overlapped generation and upscaling in generate_and_upscale"""
+import os
+import threading
+import time
+
+from benchmarks.fake_servers import make_png
+from lib.artifact_store import ArtifactStore
+from lib.pipeline import generate_and_upscale
+
+
+class FakeGenerator:
+    def __init__(self, delay=0.0, fail=()):
+        self.delay = delay
+        self.fail = set(fail)
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def generate_single_image(self, prompt, width, height):
+        with self._lock:
+            self.prompts.append(prompt)
+        time.sleep(self.delay)
+        if prompt in self.fail:
+            raise Exception("quota exceeded")
+        return [f"http://images/{prompt}.png"]
+
+
+class FakeUpscaler:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def upscale_image(self, image_url, output=None):
+        time.sleep(self.delay)
+        return f"upscaled {image_url}".encode()
+
+
+class FileUpscaler:
+    def upscale_image(self, image_url, output=None):
+        with open(output, "wb") as f:
+            f.write(make_png(16, 16))
+        return output
+
+
+class FailingUpscaler:
+    def upscale_image(self, image_url, output=None):
+        raise Exception("Upscale failed: ComfyUI offline")
+
+
+def test_stopping_early_does_not_wait_for_queued_work():
+    generator = FakeGenerator(delay=0.3)
+    events = generate_and_upscale(generator, FakeUpscaler(), "p", 6, 512, 512, generate_workers=1)
+
+    first = next(events)
+    start = time.monotonic()
+    events.close()
+    closed_after = time.monotonic() - start
+
+    assert first["stage"] == "generated"
+    assert closed_after < 0.2
+    time.sleep(0.5)
+    # At most the image in progress when the consumer stopped was still generated
+    assert len(generator.prompts) <= 2
+
+
+def test_every_image_is_generated_then_upscaled():
+    events = list(generate_and_upscale(FakeGenerator(), FakeUpscaler(), "p", 3, 512, 512))
+
+    for index in range(3):
+        stages = [event["stage"] for event in events if event["index"] == index]
+        assert stages == ["generated", "upscaled"]
+    upscaled = [event for event in events if event["stage"] == "upscaled"]
+    assert sorted(event["image_data"] for event in upscaled) == [b"upscaled http://images/p.png"] * 3
+
+
+def test_prompt_list_gives_each_image_its_own_prompt():
+    generator = FakeGenerator()
+
+    events = list(generate_and_upscale(generator, FakeUpscaler(), ["a", "b", "c"], 3, 512, 512))
+
+    assert sorted(generator.prompts) == ["a", "b", "c"]
+    assert {event["index"]: event["url"] for event in events if event["stage"] == "generated"} == {
+        0: "http://images/a.png", 1: "http://images/b.png", 2: "http://images/c.png"
+    }
+
+
+def test_upscaling_overlaps_with_later_generations():
+    # Serial work would take 3 * (0.2 + 0.2) s; overlapped it is about 3 * 0.2 + 0.2 s
+    generator = FakeGenerator(delay=0.2)
+    start = time.monotonic()
+
+    events = list(generate_and_upscale(generator, FakeUpscaler(delay=0.2), "p", 3, 512, 512, generate_workers=1))
+
+    assert time.monotonic() - start < 1.05
+    assert [event["stage"] for event in events].count("upscaled") == 3
+    # The first image is upscaled before the last one is generated
+    stages = [(event["stage"], event["index"]) for event in events]
+    assert stages.index(("upscaled", 0)) < stages.index(("generated", 2))
+
+
+def test_failures_are_reported_per_image():
+    generator = FakeGenerator(fail={"b"})
+
+    events = list(generate_and_upscale(generator, FakeUpscaler(), ["a", "b"], 2, 512, 512))
+
+    failed = [event for event in events if event["stage"] == "failed"]
+    assert failed == [{"stage": "failed", "index": 1, "url": None, "error": "Image generation failed: quota exceeded"}]
+    assert [event["index"] for event in events if event["stage"] == "upscaled"] == [0]
+
+
+def test_empty_generation_is_a_failure():
+    generator = FakeGenerator()
+    generator.generate_single_image = lambda prompt, width, height: []
+
+    events = list(generate_and_upscale(generator, FakeUpscaler(), "p", 1, 512, 512))
+
+    assert events == [{"stage": "failed", "index": 0, "url": None, "error": "Image generation returned no image"}]
+
+
+def test_upscale_failure_keeps_the_generated_url():
+    events = list(generate_and_upscale(FakeGenerator(), FailingUpscaler(), "p", 1, 512, 512))
+
+    assert events[-1] == {"stage": "failed", "index": 0, "url": "http://images/p.png", "error": "Upscale failed: ComfyUI offline"}
+
+
+def test_artifact_store_receives_streamed_results(tmp_path):
+    store = ArtifactStore(str(tmp_path / "artifacts"))
+
+    events = list(generate_and_upscale(FakeGenerator(), FileUpscaler(), "p", 2, 512, 512, artifact_store=store))
+
+    artifacts = [event["artifact"] for event in events if event["stage"] == "upscaled"]
+    assert len(artifacts) == 2
+    assert all("image_data" not in event for event in events)
+    assert all(os.path.exists(artifact.path) and os.path.exists(artifact.preview_path) for artifact in artifacts)
@@ -0,0 +1,94 @@
+# coding:utf-8
+"""PosterGenerator SSE prompt streaming against local fake chat endpoints"""
+import json
+
+import pytest
+
+from benchmarks.fake_servers import FAKE_POSTER_PROMPT, Behavior, FakeOpenAI, FakeServer
+from lib.http_transport import HttpTransport
+from lib.poster_generator import PosterGenerator
+from lib.prompt_cache import PromptCache
+
+
+class ScriptedSSE(FakeServer):
+    """/chat/completions that streams fixed SSE lines, optionally dropping the connection mid-stream"""
+
+    def __init__(self, lines, drop=False):
+        super().__init__()
+        self.lines = lines
+        self.drop = drop
+
+    def handle(self, handler, method):
+        handler.read_body()
+        handler.begin_chunked("text/event-stream")
+        for line in self.lines:
+            handler.write_chunk(f"{line}\n\n".encode("utf-8"))
+        if self.drop:
+            # Half a chunk, then hang up without the terminating chunk
+            handler.wfile.write(b"40\r\ndata: {\"choi")
+            handler.wfile.flush()
+            handler.close_connection = True
+            return
+        handler.end_chunked()
+
+
+def delta_line(content):
+    return "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": content}}]}, ensure_ascii=False)
+
+
+def make_generator(server, prompt_cache=None):
+    # No retries, so an injected HTTP error surfaces on the first attempt
+    return PosterGenerator(
+        "ak", "sk", "key", f"{server.base_url}/v1", "fake-model",
+        transport=HttpTransport(max_retries=0), prompt_cache=prompt_cache
+    )
+
+
+def test_stream_joins_deltas_and_caches_after_close():
+    cache = PromptCache()
+    with FakeOpenAI(api=Behavior(latency=0), token_interval=0, chunk_chars=5) as server:
+        generator = make_generator(server, cache)
+        stream = generator.generate_prompt_stream("劳动")
+
+        deltas = [next(stream)]
+        key = PromptCache.make_key(generator._build_prompt_payload("劳动"))
+        assert cache.get(key) is None  # Not cached until the stream has closed
+
+        deltas.extend(stream)
+
+    assert len(deltas) > 1
+    assert "".join(deltas) == FAKE_POSTER_PROMPT
+    assert cache.get(key) == FAKE_POSTER_PROMPT
+
+    # A repeat is served from the cache without a request
+    assert list(generator.generate_prompt_stream("劳动")) == [FAKE_POSTER_PROMPT]
+
+
+def test_stream_stops_at_done():
+    lines = [": keep-alive", delta_line("生成工人"), delta_line("作为主体"), "data: [DONE]", delta_line("不应出现"), "data: {broken"]
+    with ScriptedSSE(lines) as server:
+        assert list(make_generator(server).generate_prompt_stream("劳动")) == ["生成工人", "作为主体"]
+
+
+def test_http_error_is_mapped():
+    cache = PromptCache()
+    with FakeOpenAI(api=Behavior(latency=0, error_rate=1.0)) as server:
+        with pytest.raises(Exception, match="Network request failed"):
+            list(make_generator(server, cache).generate_prompt_stream("劳动"))
+    assert not cache._entries
+
+
+def test_broken_stream_is_mapped_and_not_cached():
+    cache = PromptCache()
+    with ScriptedSSE([delta_line("生成工人")], drop=True) as server:
+        stream = make_generator(server, cache).generate_prompt_stream("劳动")
+        assert next(stream) == "生成工人"
+        with pytest.raises(Exception, match="Network request failed"):
+            list(stream)
+    assert not cache._entries
+
+
+def test_malformed_chunk_is_mapped():
+    with ScriptedSSE([delta_line("生成工人"), "data: {broken"]) as server:
+        with pytest.raises(Exception, match="Response format error"):
+            list(make_generator(server).generate_prompt_stream("劳动"))
@@ -0,0 +1,161 @@
+# coding:utf-8
+"""Prompt cache bounds and persistence, and SingleFlight coalescing of prompt requests"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lib.poster_generator import PosterGenerator
+from lib.prompt_cache import PromptCache
+from lib.singleflight import SingleFlight
+
+
+PROMPT = "生成挥舞红旗的工人作为主体，复古大字报风格的插画，背景是工厂烟囱，底部是团结奋进"
+
+
+def test_entries_expire_after_ttl():
+    cache = PromptCache(ttl=0.05)
+    cache.put("k", "v")
+
+    assert cache.get("k") == "v"
+    time.sleep(0.1)
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PromptCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+
+    cache.put("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+
+def test_persisted_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    PromptCache(persist_path=path).put("k", ["one", "two"])
+
+    assert PromptCache(persist_path=path).get("k") == ["one", "two"]
+
+
+def test_expired_entries_are_not_loaded(tmp_path):
+    path = str(tmp_path / "prompts.json")
+    PromptCache(ttl=-1, persist_path=path).put("k", "stale")
+
+    assert PromptCache(persist_path=path).get("k") is None
+
+
+def test_key_ignores_payload_field_order():
+    assert PromptCache.make_key({"model": "m", "temperature": 0.7}) == PromptCache.make_key({"temperature": 0.7, "model": "m"})
+    assert PromptCache.make_key({"model": "m"}) != PromptCache.make_key({"model": "n"})
+
+
+def test_single_flight_runs_concurrent_calls_once():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, "k", slow) for _ in range(4)]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.do("k", lambda: "again") == "again"  # Finished flights are not remembered
+
+
+def test_single_flight_shares_the_error():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flight.do, "k", failing) for _ in range(3)]
+        time.sleep(0.1)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError, match="upstream down"):
+                future.result()
+
+
+def make_generator(cache, delay=0.1):
+    generator = PosterGenerator("ak", "sk", "key", "http://127.0.0.1:9/v1", "fake-model", prompt_cache=cache)
+    requests = []
+
+    def request_prompt(payload):
+        requests.append(payload)
+        time.sleep(delay)
+        return PROMPT
+    generator._request_prompt = request_prompt
+    return generator, requests
+
+
+def test_concurrent_identical_prompts_make_one_request():
+    cache = PromptCache()
+    generator, requests = make_generator(cache)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: generator.generate_prompt("劳动"), range(4)))
+
+    assert results == [PROMPT] * 4
+    assert len(requests) == 1
+    assert generator.generate_prompt("劳动") == PROMPT
+    assert len(requests) == 1  # Served from the cache
+
+
+def test_regenerate_bypasses_and_refreshes_the_cache():
+    cache = PromptCache()
+    generator, requests = make_generator(cache, delay=0)
+    generator.generate_prompt("劳动")
+
+    generator.generate_prompt("劳动", regenerate=True)
+
+    assert len(requests) == 2
+    assert cache.get(PromptCache.make_key(generator._build_prompt_payload("劳动"))) == PROMPT
+
+
+def test_failed_requests_are_not_cached():
+    cache = PromptCache()
+    generator = PosterGenerator("ak", "sk", "key", "http://127.0.0.1:9/v1", "fake-model", prompt_cache=cache)
+
+    def request_prompt(payload):
+        raise Exception("Network request failed")
+    generator._request_prompt = request_prompt
+
+    with pytest.raises(Exception, match="Network request failed"):
+        generator.generate_prompt("劳动")
+    assert not cache._entries
+
+
+def test_variant_requests_are_coalesced_and_cached():
+    cache = PromptCache()
+    generator, requests = make_generator(cache)
+    reply = json.dumps({"prompts": [PROMPT, PROMPT.replace("工人", "农民")]}, ensure_ascii=False)
+
+    def request_prompt(payload):
+        requests.append(payload)
+        time.sleep(0.1)
+        return reply
+    generator._request_prompt = request_prompt
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = list(executor.map(lambda _: generator.generate_prompt_variants("劳动", 2), range(3)))
+
+    assert len(requests) == 1
+    assert all(result == results[0] and len(result) == 2 for result in results)
+    assert generator.generate_prompt_variants("劳动", 2) == results[0]
+    assert len(requests) == 1
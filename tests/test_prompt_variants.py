@@ -0,0 +1,43 @@
+# coding:utf-8
+"""Parsing of multi-prompt variant completions"""
+import json
+
+import pytest
+
+from lib.poster_generator import PosterGenerator
+
+
+A = "生成挥舞红旗的工人作为主体，复古大字报风格的插画，背景是工厂烟囱，底部是团结奋进"
+B = "生成收割麦子的农民作为主体，复古大字报风格的插画，背景是金色麦田，底部是丰收在望"
+C = "生成手持书本的学生作为主体，复古大字报风格的插画，背景是朝阳校园，底部是好好学习"
+
+parse = PosterGenerator.parse_prompt_variants
+
+
+def test_fenced_block_is_parsed():
+    content = "好的，以下是结果：\n```json\n" + json.dumps({"prompts": [A, B]}, ensure_ascii=False) + "\n```\n希望满意。"
+    assert parse(content, 3) == [A, B]
+
+
+def test_object_form_keeps_only_conforming_distinct_prompts():
+    content = json.dumps({"prompts": [A, "一张普通的海报", A, f"“{B}”", 42]}, ensure_ascii=False)
+    assert parse(content, 5) == [A, B]
+
+
+def test_list_form_is_capped_at_the_requested_count():
+    assert parse(json.dumps([A, B, C], ensure_ascii=False), 2) == [A, B]
+
+
+def test_leading_prose_with_brackets_is_skipped():
+    content = "[说明] 以下给出三个版本 {见下}：\n" + json.dumps({"prompts": [A, B, C]}, ensure_ascii=False) + "\n[完]"
+    assert parse(content, 3) == [A, B, C]
+
+
+def test_plain_text_falls_back_to_template_phrases():
+    content = f"版本如下：\n1. {A}\n2. {B}；\n3. 这一版不符合格式"
+    assert parse(content, 3) == [A, B]
+
+
+def test_response_without_any_conforming_prompt_is_an_error():
+    with pytest.raises(Exception, match="Response format error"):
+        parse('{"prompts": ["一张普通的海报"]}', 2)
@@ -0,0 +1,141 @@
+# coding:utf-8
+"""Token bucket timing and AIMD behaviour of the shared rate limiter"""
+import time
+
+import pytest
+
+from lib.rate_limiter import AdaptiveRateLimiter, TokenBucket, is_throttled
+
+
+THROTTLED = {"code": 50429, "message": "Request Has Reached API Limit"}
+OK = {"code": 10000, "data": {}}
+
+
+def limiter(**kwargs):
+    kwargs.setdefault("rate", 0)  # No token waits unless a test asks for them
+    kwargs.setdefault("backoff_base", 0)
+    return AdaptiveRateLimiter(**kwargs)
+
+
+def test_bucket_serves_the_burst_then_one_token_per_interval():
+    bucket = TokenBucket(rate=20, burst=3)
+
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(5)]
+    elapsed = time.monotonic() - start
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert all(0.03 < wait <= 0.05 for wait in waits[3:])
+    # Two tokens past the burst at 20/s
+    assert 0.09 <= elapsed < 0.2
+
+
+def test_bucket_refills_while_idle():
+    bucket = TokenBucket(rate=50, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+
+    time.sleep(0.05)
+
+    assert bucket.acquire() == 0.0
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(rate=0)
+    assert [bucket.acquire() for _ in range(10)] == [0.0] * 10
+
+
+@pytest.mark.parametrize("code", [50429, 50430])
+def test_throttle_codes_halve_the_limit(code):
+    gate = limiter(max_concurrency=8, max_retries=1)
+    responses = iter([{"code": code}, OK])
+
+    assert gate.call(lambda: next(responses)) == OK
+
+    # Halved by the throttle, then grown by 1/limit on the retry's success
+    assert gate.limit == pytest.approx(4 + 1 / 4)
+
+
+def test_throttled_sdk_errors_are_recognised():
+    assert is_throttled(error=Exception('b\'{"ResponseMetadata": {"Error": {"Code": "50429"}}}\''))
+    assert is_throttled(error=Exception("429 Too Many Requests"))
+    assert not is_throttled(error=Exception("50001 internal error"))
+    assert not is_throttled(response=OK)
+
+
+def test_successes_recover_the_limit_additively():
+    gate = limiter(max_concurrency=8, min_concurrency=1)
+    gate.limit = 2.0
+
+    limits = []
+    for _ in range(6):
+        gate.call(lambda: OK)
+        limits.append(gate.limit)
+
+    # Each success adds 1/limit: about one slot per round of requests
+    assert limits[0] == pytest.approx(2.5)
+    assert limits[1] == pytest.approx(2.9)
+    assert all(later > earlier for earlier, later in zip(limits, limits[1:]))
+    assert limits[-1] < 4.5  # Six successes at a limit of 2-4 add about two slots, not six
+
+    for _ in range(200):
+        gate.call(lambda: OK)
+    assert gate.limit == 8
+
+
+def test_limit_never_drops_below_the_minimum():
+    gate = limiter(max_concurrency=8, min_concurrency=2, max_retries=5)
+
+    gate.call(lambda: THROTTLED)
+
+    assert gate.limit == 2
+
+
+def test_gives_up_after_max_retries():
+    gate = limiter(max_retries=3)
+    calls = []
+
+    result = gate.call(lambda: calls.append(1) or THROTTLED)
+
+    assert result == THROTTLED
+    assert len(calls) == 4
+    assert gate.in_flight == 0
+
+
+def test_throttled_error_is_raised_after_max_retries():
+    gate = limiter(max_retries=2)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise Exception("429 Too Many Requests")
+
+    with pytest.raises(Exception, match="Too Many Requests"):
+        gate.call(request)
+    assert len(calls) == 3
+
+
+def test_other_errors_pass_through_without_retry():
+    gate = limiter(max_concurrency=4, max_retries=5)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise ValueError("bad request body")
+
+    with pytest.raises(ValueError, match="bad request body"):
+        gate.call(request)
+
+    assert len(calls) == 1
+    assert gate.limit == 4
+    assert gate.in_flight == 0
+
+
+def test_other_error_codes_are_returned_without_retry():
+    gate = limiter(max_retries=5)
+    calls = []
+
+    result = gate.call(lambda: calls.append(1) or {"code": 50001})
+
+    assert result == {"code": 50001}
+    assert len(calls) == 1
@@ -0,0 +1,92 @@
+# coding:utf-8
+"""Services built through the registry share their dependencies"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import lib.generation_cache
+import lib.image_archive
+from lib import services
+from lib.services import ServiceRegistry
+
+
+def test_poster_generator_uses_the_registry_visual_service(monkeypatch):
+    built = []
+    registry = ServiceRegistry()
+    registry.register("visual_service", lambda: built.append(object()) or built[-1])
+    registry.register("poster_generator", services._build_poster_generator)
+    monkeypatch.setattr(services, "registry", registry)
+    monkeypatch.setattr(lib.image_archive, "get_image_archive", lambda: None)
+    monkeypatch.setattr(lib.generation_cache, "get_generation_cache", lambda: None)
+
+    poster_generator = services.get_poster_generator()
+    assert built == []  # Still lazy: nothing is built until an image is generated
+
+    assert poster_generator.visual_service is services.get_visual_service()
+    assert len(built) == 1
+
+
+def test_services_are_built_once_on_first_use():
+    registry = ServiceRegistry()
+    calls = []
+    release = threading.Event()
+
+    def build():
+        calls.append(1)
+        release.wait(5)
+        return object()
+    registry.register("slow", build)
+
+    assert registry.loaded() == []
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(registry.get, "slow") for _ in range(4)]
+        time.sleep(0.1)
+        release.set()
+        instances = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(instance is instances[0] for instance in instances)
+    assert registry.loaded() == ["slow"]
+
+
+def test_factories_can_use_other_services():
+    registry = ServiceRegistry()
+    registry.register("transport", lambda: "transport")
+    registry.register("client", lambda: ("client", registry.get("transport")))
+
+    assert registry.get("client") == ("client", "transport")
+    assert sorted(registry.loaded()) == ["client", "transport"]
+
+
+def test_failed_build_is_retried_on_the_next_get():
+    registry = ServiceRegistry()
+    attempts = []
+
+    def build():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise Exception("SDK not configured")
+        return "service"
+    registry.register("flaky", build)
+
+    with pytest.raises(Exception, match="SDK not configured"):
+        registry.get("flaky")
+    assert registry.get("flaky") == "service"
+
+
+def test_unknown_service_names_the_known_ones():
+    registry = ServiceRegistry()
+    registry.register("artifact_store", object)
+
+    with pytest.raises(Exception, match="Unknown service missing, expected one of: artifact_store"):
+        registry.get("missing")
+
+
+def test_replaced_factory_is_used_before_first_use():
+    registry = ServiceRegistry()
+    registry.register("store", lambda: "real")
+    registry.register("store", lambda: "replacement")
+
+    assert registry.get("store") == "replacement"
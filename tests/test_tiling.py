@@ -0,0 +1,42 @@
+# coding:utf-8
+"""Tile planning and streamed stitching"""
+import random
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from lib.tiling import PNGStripeWriter, TileStitcher, plan_tiles
+
+
+@pytest.mark.parametrize("width, height, tile_size, overlap, scale", [
+    (1100, 700, 512, 32, 2),
+    (300, 200, 128, 16, 3),
+    (513, 512, 512, 32, 2),
+    (200, 200, 64, 60, 1)
+])
+def test_stitching_crops_reproduces_the_image(width, height, tile_size, overlap, scale):
+    expected = np.random.default_rng(0).integers(0, 256, (height * scale, width * scale, 3), dtype=np.uint8)
+    boxes = plan_tiles(width, height, tile_size, overlap)
+    random.Random(0).shuffle(boxes)
+
+    buffer = BytesIO()
+    writer = PNGStripeWriter(buffer, width * scale, height * scale)
+    stitcher = TileStitcher(width, height, scale, tile_size, overlap, writer.write_rows)
+    for x, y, w, h in boxes:
+        stitcher.add((x, y, w, h), expected[y * scale:(y + h) * scale, x * scale:(x + w) * scale])
+    stitcher.finish()
+    writer.close()
+
+    with Image.open(BytesIO(buffer.getvalue())) as stitched:
+        assert np.array_equal(np.asarray(stitched), expected)
+
+
+def test_missing_tile_is_reported():
+    stitcher = TileStitcher(300, 200, 1, 128, 16, lambda rows: None)
+    for box in plan_tiles(300, 200, 128, 16)[:-1]:
+        stitcher.add(box, np.zeros((box[3], box[2], 3), dtype=np.uint8))
+
+    with pytest.raises(Exception, match="incomplete"):
+        stitcher.finish()
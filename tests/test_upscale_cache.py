@@ -0,0 +1,44 @@
+# coding:utf-8
+"""UpscaleCache keeps the entry it just stored readable"""
+import os
+
+from benchmarks.fake_servers import Behavior, FakeComfyUI, make_png
+from lib.comfyui_client import ComfyUIClient
+from lib.upscale_cache import UpscaleCache
+
+
+def write_bytes(data):
+    def compute_into(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return compute_into
+
+
+def test_result_larger_than_the_cache_is_still_returned(tmp_path):
+    cache = UpscaleCache(str(tmp_path), max_bytes=10)
+
+    path = cache.get_or_compute_path("ab" * 32, write_bytes(b"x" * 100))
+
+    assert os.path.exists(path)
+    with open(path, "rb") as f:
+        assert f.read() == b"x" * 100
+
+
+def test_older_entries_are_evicted_for_the_new_one(tmp_path):
+    cache = UpscaleCache(str(tmp_path), max_bytes=150)
+    first = cache.get_or_compute_path("aa" * 32, write_bytes(b"1" * 100))
+    os.utime(first, (1, 1))
+
+    second = cache.get_or_compute_path("bb" * 32, write_bytes(b"2" * 100))
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+
+
+def test_tiny_cache_does_not_break_upscales(tmp_path):
+    with FakeComfyUI(api=Behavior(latency=0), processing=Behavior(latency=0.05), result_size=(32, 32)) as server:
+        client = ComfyUIClient(server.base_url, use_websocket=False, normalize=False, cache=UpscaleCache(str(tmp_path), max_bytes=10))
+        client.poll_initial_interval = 0.05
+
+        assert client.upscale_image(make_png(16, 16)) == server.result_png
+        assert client.upscale_image(make_png(16, 16, seed=1)) == server.result_png
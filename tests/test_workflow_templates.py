@@ -0,0 +1,82 @@
+# coding:utf-8
+"""Workflow templates stay immutable, validate their slots and key the upscale cache"""
+import pytest
+
+from lib import workflow_templates
+from lib.comfyui_client import ComfyUIClient
+from lib.upscale_cache import UpscaleCache
+from lib.workflow_templates import (
+    DEFAULT_UPSCALE_TEMPLATE, UPSCALE_GRAPH, UPSCALE_SLOTS, WorkflowTemplate, get_template, list_templates,
+    register_upscale_model
+)
+
+
+def test_instantiate_fills_slots_in_a_fresh_graph():
+    template = get_template("realesrgan_x4")
+
+    graph = template.instantiate(input_image="in.png")
+    graph["2"]["inputs"]["model_name"] = "tampered.pth"
+    again = template.instantiate(input_image="other.png")
+
+    assert again["5"]["inputs"]["image"] == "other.png"
+    assert again["2"]["inputs"]["model_name"] == "RealESRGAN_x4.pth"
+    assert UPSCALE_GRAPH["5"]["inputs"]["image"] == ""
+
+
+def test_params_override_defaults():
+    graph = get_template("realesrgan_x2").instantiate(input_image="in.png", model_name="Custom.pth")
+    assert graph["2"]["inputs"]["model_name"] == "Custom.pth"
+
+
+def test_unknown_and_missing_params_are_errors():
+    template = get_template("realesrgan_x2")
+
+    with pytest.raises(Exception, match="Unknown workflow parameters for realesrgan_x2: denoise"):
+        template.instantiate(input_image="in.png", denoise=0.5)
+    with pytest.raises(Exception, match="Missing workflow parameters for realesrgan_x2: input_image"):
+        template.instantiate()
+
+
+def test_slots_and_output_node_are_checked_against_the_graph():
+    with pytest.raises(Exception, match="slot target 9.image not in graph"):
+        WorkflowTemplate("broken", UPSCALE_GRAPH, {"input_image": ("9", "image")}, output_node="7")
+    with pytest.raises(Exception, match="output node 8 not in graph"):
+        WorkflowTemplate("broken", UPSCALE_GRAPH, UPSCALE_SLOTS, output_node="8")
+
+
+def test_templates_are_immutable():
+    template = get_template("realesrgan_x2")
+
+    with pytest.raises(AttributeError):
+        template.output_node = "4"
+    with pytest.raises(TypeError):
+        template.defaults["model_name"] = "other.pth"
+
+
+def test_registry_lookup_and_order(monkeypatch):
+    monkeypatch.setattr(workflow_templates, "_registry", dict(workflow_templates._registry))
+
+    register_upscale_model("test_x3", "Test_x3.pth", 3, "Test x3")
+
+    assert [template.name for template in list_templates()][-1] == "test_x3"
+    assert get_template("test_x3").scale == 3 and get_template("test_x3").label == "Test x3"
+    assert get_template(DEFAULT_UPSCALE_TEMPLATE).model_name == "RealESRGAN_x2.pth"
+    with pytest.raises(Exception, match="Unknown workflow template: missing"):
+        get_template("missing")
+
+
+def test_client_resolves_names_objects_and_its_default():
+    template = get_template("realesrgan_x4")
+    client = ComfyUIClient("http://127.0.0.1:9", normalize=False)
+
+    assert client.resolve_template() is get_template(DEFAULT_UPSCALE_TEMPLATE)
+    assert client.resolve_template("realesrgan_x4") is template
+    assert client.resolve_template(template) is template
+
+
+def test_cache_keys_differ_per_template(tmp_path):
+    client = ComfyUIClient("http://127.0.0.1:9", normalize=False, cache=UpscaleCache(str(tmp_path)))
+
+    keys = {client._cache_key(get_template(name), b"same input") for name in ("realesrgan_x2", "realesrgan_x4")}
+
+    assert len(keys) == 2